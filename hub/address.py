@@ -0,0 +1,112 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+address.py - network addresses packed for range queries
+
+- the model stores addresses as text, and "all players in this
+  subnet" can't use an index on text; so next to the text we
+  store a packed form that sorts like the address itself and
+  turn subnet queries into range scans over an index
+
+- the packed form is the 128-bit IPv6 address as 32 lowercase
+  hex digits; IPv4 addresses become IPv4-mapped IPv6 addresses
+  (::ffff:1.2.3.4) so both families share one column; fixed
+  width hex compares as strings exactly like the numbers do,
+  and every database can index a String(32), unlike 128-bit
+  integers or vendor-specific binary and inet types
+
+- server addresses come with a port, "1.2.3.4:27960" or
+  "[2001:f68::1]:27960", we pack the address without it
+
+- anything else in an address column, like a host name, has
+  no packed form (None)
+"""
+
+import binascii
+import socket
+
+from sqlalchemy import and_
+
+# prefix of IPv4-mapped IPv6 addresses
+MAPPED = 0xffff << 32
+BITS = 128
+
+
+def parse_address(address):
+    """
+    Convert textual address into (family, integer) tuple.
+
+    Raises ValueError if address is neither IPv4 nor IPv6.
+    """
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError, TypeError):
+            continue
+        return family, int(binascii.hexlify(packed), 16)
+    raise ValueError("invalid address %r" % (address,))
+
+def parse(address):
+    """
+    Convert textual address, maybe with port, into (family,
+    128-bit integer) tuple, IPv4 mapped into IPv6. Raises
+    ValueError if it's neither IPv4 nor IPv6.
+    """
+    if address.startswith("["):
+        address = address[1:].split("]", 1)[0]
+    elif address.count(":") == 1:
+        address = address.split(":", 1)[0]
+    family, value = parse_address(address)
+    if family == socket.AF_INET:
+        value |= MAPPED
+    return family, value
+
+def format_packed(value):
+    """Packed form of a 128-bit integer."""
+    return "%032x" % value
+
+def pack(address):
+    """Packed form of textual address, None if it has none."""
+    try:
+        return format_packed(parse(address)[1])
+    except (ValueError, AttributeError):
+        return None
+
+def unpack(packed):
+    """Textual address (without port) for packed form."""
+    value = int(packed, 16)
+    if value >> 32 == MAPPED >> 32:
+        ipv4 = binascii.unhexlify("%08x" % (value & 0xffffffff))
+        return socket.inet_ntop(socket.AF_INET, ipv4)
+    return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify(packed))
+
+def network(address, cidr):
+    """
+    First and last address of address/cidr in packed form;
+    cidr counts IPv4 bits for IPv4 addresses, but IPv6 bits for
+    IPv4-mapped IPv6 ones like ::ffff:1.2.3.4. Raises
+    ValueError for invalid addresses and prefix lengths.
+    """
+    family, value = parse(address)
+    bits = 32 if family == socket.AF_INET else BITS
+    if not 0 <= cidr <= bits:
+        raise ValueError("invalid cidr %r for %s" % (cidr, address))
+    host = (1 << (bits-cidr)) - 1
+    return format_packed(value & ~host), format_packed(value | host)
+
+def within(column, address, cidr):
+    """
+    Condition for a packed column to lie in address/cidr, an
+    index range scan.
+    """
+    start, end = network(address, cidr)
+    return and_(column >= start, column <= end)
+
+def covering(start, end, address):
+    """
+    Condition for a network given by packed start and end
+    columns to contain address.
+    """
+    packed = format_packed(parse(address)[1])
+    return and_(start <= packed, end >= packed)
@@ -0,0 +1,360 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+antientropy.py - hash summary of bans for syncing hubs
+
+- hubs tell each other about new bans in fire-and-forget UDP
+  packets; a lost packet means the ban sets drift apart for
+  good, and sending the whole list now and then to fix that
+  doesn't scale to 100k bans
+
+- instead each hub keeps a summary of its bans: every ban
+  lands in one of 16**depth buckets according to the hash of
+  its uuid, and there's a hash for every bucket as well as for
+  every prefix of bucket names, up to the root (prefix "");
+  it's a Merkle tree with fanout 16, one hex digit per level
+
+- two hubs compare roots; if they differ, they compare the 16
+  children of the root, then the children of the children
+  that differ, and so on; only for the buckets that still
+  differ at the bottom do they exchange the actual entries;
+  see diff() below, a handful of differences take depth+2
+  round trips no matter how many bans there are
+
+- the hash of a node is the XOR of the hashes of all entries
+  below it; unlike hashing the hashes of the children this
+  lets us update a node in constant time when an entry comes
+  or goes, so keeping the summary current costs depth+1
+  dict updates per ban; collisions are as unlikely as with
+  plain SHA-256 since every uuid shows up at most once
+
+- the hash of an entry covers address, cidr, and active as
+  well as uuid, so an edited or lifted ban shows up as a
+  difference, too
+
+- like the ban index the summary only changes when a session
+  that touched bans commits; see listen() below
+
+- hubs exchange hashes and entries as text: a request is a
+  line "ban hashes <depth>" or "ban entries <depth>" and a
+  line of comma-separated prefixes or buckets ("" is the
+  root); the answer repeats the first line and has one line
+  "<prefix>=<hash>" or "<uuid>=<hash>" for each; see
+  request(), answer(), and RemoteSummary below
+
+- the transport is up to the caller, all we need is a call()
+  that takes a request to the other hub and returns its
+  answer, or raises; it must authenticate both with the
+  secret we share with that hub, like all hub traffic, and
+  it must carry answers larger than a datagram: a bucket can
+  hold any number of bans; requests name at most batch
+  prefixes, so diff() may take more calls than round trips
+
+- differences are settled with the ban notifications hubs
+  send each other anyway: for bans in Difference.ours and
+  .changed we send the other hub a HubBanNotification with
+  our state, the other hub does the same with its Difference,
+  and each side treats what it gets like any other ban
+  notification from that hub
+
+- XOR is not a commitment: a hub can pick hashes that match
+  ours for any prefix, or make up entries that add up to any
+  hash it likes, so a hub that lies can hide differences or
+  invent some; the summary only finds drift between honest
+  hubs, it never proves anything, and bans still only come in
+  through ban notifications, with all their checks
+"""
+
+from hashlib import sha256
+import re
+
+from changes import follow
+from model import Ban
+
+DIGITS = "0123456789abcdef"
+HASHES = "ban hashes"
+ENTRIES = "ban entries"
+HASH = re.compile(r"^[0-9a-f]{64}$")
+NAME = re.compile(r"^[0-9a-f]*$")
+
+
+def entry_hash(uuid, address, cidr, active):
+    """Hash of a ban's state as an integer."""
+    return int(sha256("%s %s/%s %d" % (uuid, address, cidr, bool(active)))
+               .hexdigest(), 16)
+
+
+def bucket_of(uuid, depth):
+    """Name of the bucket for uuid, depth hex digits."""
+    return sha256(uuid).hexdigest()[:depth]
+
+
+def children(prefixes):
+    """All 16 children of each prefix, in order."""
+    return [prefix+digit for prefix in prefixes for digit in DIGITS]
+
+
+class BanSummary(object):
+    """
+    Hash summary of bans by uuid, for comparing ban sets with
+    other hubs; see diff() below.
+
+    Both sides of a comparison must use the same depth. The
+    default of 4 gives 65536 buckets, about two bans each for
+    100k bans.
+    """
+    def __init__(self, depth=4):
+        assert 0 < depth <= 16
+        self.depth = depth
+        # prefix -> XOR of entry hashes below, only if not zero
+        self.__hashes = {}
+        # bucket -> {uuid: entry hash}
+        self.__buckets = {}
+        # uuid -> (bucket, entry hash)
+        self.__entries = {}
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, uuid):
+        return uuid in self.__entries
+
+    def __toggle(self, bucket, value):
+        """XOR value into bucket and all its prefixes."""
+        hashes = self.__hashes
+        for length in range(self.depth+1):
+            prefix = bucket[:length]
+            merged = hashes.get(prefix, 0) ^ value
+            if merged:
+                hashes[prefix] = merged
+            else:
+                del hashes[prefix]
+
+    def add(self, uuid, address, cidr, active):
+        """
+        Add ban uuid in the given state; replaces an older entry
+        for the same uuid. Inactive bans are entries, too: their
+        state has to travel to other hubs as well.
+        """
+        self.remove(uuid)
+        bucket = bucket_of(uuid, self.depth)
+        value = entry_hash(uuid, address, cidr, active)
+        self.__buckets.setdefault(bucket, {})[uuid] = value
+        self.__entries[uuid] = (bucket, value)
+        self.__toggle(bucket, value)
+
+    def remove(self, uuid):
+        """Remove ban uuid, fine if we don't have it."""
+        entry = self.__entries.pop(uuid, None)
+        if entry is None:
+            return
+        bucket, value = entry
+        entries = self.__buckets[bucket]
+        del entries[uuid]
+        if not entries:
+            del self.__buckets[bucket]
+        self.__toggle(bucket, value)
+
+    def update(self, ban):
+        """Add or replace Ban object."""
+        self.add(ban.uuid, ban.address, ban.cidr, ban.active)
+
+    def root(self):
+        """Hash of all bans as 64 hex digits."""
+        return self.hashes([""])[""]
+
+    def hashes(self, prefixes):
+        """
+        Hashes for the given prefixes (at most depth digits) as
+        {prefix: 64 hex digits}; a prefix without bans has hash
+        zero.
+        """
+        return dict((prefix, "%064x" % self.__hashes.get(prefix, 0))
+                    for prefix in prefixes)
+
+    def entries(self, buckets):
+        """
+        Entries in the given buckets (depth digits each) as
+        {uuid: 64 hex digits}.
+        """
+        found = {}
+        for bucket in buckets:
+            for uuid, value in self.__buckets.get(bucket, {}).iteritems():
+                found[uuid] = "%064x" % value
+        return found
+
+    def clear(self):
+        """Forget all bans."""
+        self.__init__(self.depth)
+
+    def load(self, session):
+        """Replace summary contents with all bans in the database."""
+        self.clear()
+        query = session.query(Ban.uuid, Ban.address, Ban.cidr, Ban.active)
+        for uuid, address, cidr, active in query:
+            self.add(uuid, address, cidr, active)
+
+    def listen(self, session_factory):
+        """
+        Keep summary current with bans changed through sessions
+        created by session_factory (a sessionmaker or Session
+        class); changes are applied when the session commits.
+        """
+        follow(session_factory, 'antientropy', self.__collect, self.__apply)
+
+    @staticmethod
+    def __collect(obj, deleted):
+        """Change to remember for obj, None unless it's a ban."""
+        if not isinstance(obj, Ban):
+            return None
+        if deleted:
+            return (obj.uuid, None, None, None)
+        return (obj.uuid, obj.address, obj.cidr, obj.active)
+
+    def __apply(self, change):
+        """Apply a committed change of a ban."""
+        uuid, address, cidr, active = change
+        if active is None:
+            self.remove(uuid)
+        else:
+            self.add(uuid, address, cidr, active)
+
+
+class Difference(object):
+    """
+    Outcome of diff(): uuids only we have, uuids only they
+    have, uuids we both have in different states, and how many
+    round trips it took to find out.
+    """
+    def __init__(self):
+        self.ours = set()
+        self.theirs = set()
+        self.changed = set()
+        self.round_trips = 0
+
+    def __len__(self):
+        return len(self.ours) + len(self.theirs) + len(self.changed)
+
+    def __repr__(self):
+        return "Difference<ours: %s; theirs: %s; changed: %s; trips: %s>" % (
+            len(self.ours), len(self.theirs), len(self.changed),
+            self.round_trips
+        )
+
+
+def diff(local, remote):
+    """
+    Compare BanSummary local with remote, return a Difference.
+
+    All we need from remote are hashes() and entries() as in
+    BanSummary; each call is one round trip when remote is a
+    proxy for another hub. We only descend into prefixes whose
+    hashes differ, one level of the tree per round trip.
+    """
+    assert local.depth == getattr(remote, 'depth', local.depth)
+    found = Difference()
+    prefixes = [""]
+    for level in range(local.depth+1):
+        ours = local.hashes(prefixes)
+        theirs = remote.hashes(prefixes)
+        found.round_trips += 1
+        differing = [prefix for prefix in prefixes
+                     if ours[prefix] != theirs[prefix]]
+        if not differing:
+            return found
+        prefixes = children(differing) if level < local.depth else differing
+    ours = local.entries(prefixes)
+    theirs = remote.entries(prefixes)
+    found.round_trips += 1
+    for uuid, value in ours.iteritems():
+        if uuid not in theirs:
+            found.ours.add(uuid)
+        elif theirs[uuid] != value:
+            found.changed.add(uuid)
+    found.theirs.update(uuid for uuid in theirs if uuid not in ours)
+    return found
+
+
+def request(kind, depth, names):
+    """
+    Request for hashes (kind HASHES) of prefixes or entries
+    (kind ENTRIES) of buckets, names, from a summary of depth.
+    """
+    return "%s %d\n%s" % (kind, depth, ",".join(names))
+
+def parse_header(line, depth):
+    """Kind from first line of a request or answer for depth."""
+    kind, _, value = line.rpartition(" ")
+    if kind not in (HASHES, ENTRIES) or value != str(depth):
+        raise ValueError("unexpected %r for depth %s" % (line, depth))
+    return kind
+
+def answer(summary, text):
+    """
+    Answer request text with what BanSummary summary has;
+    raises ValueError for bad requests.
+    """
+    header, _, names = text.partition("\n")
+    kind = parse_header(header, summary.depth)
+    names = names.split(",")
+    for name in names:
+        if not NAME.match(name) or len(name) > summary.depth or (
+                kind == ENTRIES and len(name) != summary.depth):
+            raise ValueError("bad prefix or bucket %r" % name)
+    found = (summary.hashes(names) if kind == HASHES
+             else summary.entries(names))
+    return "\n".join([header] + ["%s=%s" % item
+                                 for item in sorted(found.iteritems())])
+
+def parse_answer(text, kind, depth):
+    """
+    {name: hash} from an answer to a kind request for depth;
+    raises ValueError for bad answers.
+    """
+    lines = text.split("\n")
+    if parse_header(lines[0], depth) != kind:
+        raise ValueError("answer %r to a %s request" % (lines[0], kind))
+    found = {}
+    for line in lines[1:]:
+        name, equals, value = line.partition("=")
+        if not equals or not HASH.match(value):
+            raise ValueError("bad answer line %r" % line)
+        found[name] = value
+    return found
+
+
+class RemoteSummary(object):
+    """
+    Stand-in for the BanSummary of another hub, for diff();
+    call(request) takes a request there and returns the answer,
+    see above.
+    """
+    def __init__(self, depth, call, batch=16):
+        assert 0 < depth <= 16
+        assert batch > 0
+        self.depth = depth
+        self.__call = call
+        self.__batch = batch
+
+    def __ask(self, kind, names):
+        """Answers for names, batch of them per call."""
+        found = {}
+        for start in range(0, len(names), self.__batch):
+            chunk = names[start:start+self.__batch]
+            found.update(parse_answer(
+                self.__call(request(kind, self.depth, chunk)),
+                kind, self.depth))
+        return found
+
+    def hashes(self, prefixes):
+        """Like BanSummary.hashes(); raises ValueError if a hash is missing."""
+        found = self.__ask(HASHES, list(prefixes))
+        missing = set(prefixes) - set(found)
+        if missing:
+            raise ValueError("no hashes for %s" % ",".join(sorted(missing)))
+        return found
+
+    def entries(self, buckets):
+        """Like BanSummary.entries()."""
+        return self.__ask(ENTRIES, list(buckets))
@@ -0,0 +1,191 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+banindex.py - in-memory index of active bans
+
+- every ServerUserinfoChanged has to be checked against the
+  bans; a database round trip per player is too slow during
+  the connection bursts we see at map changes, so the hub
+  builds this index from the bans table on startup and asks
+  it instead
+
+- we keep one hash table per prefix length in use; a check
+  masks the address once per prefix length and does a dict
+  lookup; walking a bit-wise radix trie would cost up to 128
+  steps of interpreted Python per check while in practice
+  only a handful of distinct prefix lengths are ever in use
+
+- IPv4 and IPv6 addresses live in separate tables; clients
+  may show up as IPv4-mapped IPv6 addresses (::ffff:1.2.3.4)
+  and must not slip past IPv4 bans that way, so those count
+  as IPv4, for bans of at least 96 bits, too; an IPv4 address
+  is also checked against IPv6 bans wide enough to cover the
+  mapped ones
+
+- bans of host names cover no addresses, we leave them out
+
+- the index only changes when a session that touched bans
+  commits; see listen() below; rolled back changes never
+  make it into the index
+"""
+
+import socket
+
+from address import MAPPED, parse_address
+from changes import follow
+from model import Ban
+
+BITS = {socket.AF_INET: 32, socket.AF_INET6: 128}
+# IPv6 bits before the IPv4 address in IPv4-mapped addresses
+MAPPED_BITS = 96
+
+
+def unmap(family, value):
+    """
+    IPv4 (family, integer) of an IPv4-mapped IPv6 address,
+    other addresses unchanged.
+    """
+    if family == socket.AF_INET6 and value >> 32 == MAPPED >> 32:
+        return socket.AF_INET, value & 0xffffffff
+    return family, value
+
+
+class BanIndex(object):
+    """
+    Active bans by network, for fast containment checks.
+
+    Bans are identified by their uuid; several bans can cover
+    the same network, the network stays banned until the last
+    of them is removed.
+    """
+    def __init__(self):
+        # family -> {cidr: {prefix: set(uuid)}}
+        self.__tables = {socket.AF_INET: {}, socket.AF_INET6: {}}
+        # family -> [(cidr, shift, table)] sorted most specific first
+        self.__lookups = {socket.AF_INET: [], socket.AF_INET6: []}
+        # IPv6 lookups wide enough to cover IPv4-mapped addresses
+        self.__mapped = []
+        # uuid -> (family, cidr, prefix)
+        self.__bans = {}
+
+    def __len__(self):
+        return len(self.__bans)
+
+    def __contains__(self, address):
+        return self.lookup(address) is not None
+
+    def __reindex(self, family):
+        """Rebuild lookup list for family after prefix lengths changed."""
+        bits = BITS[family]
+        tables = self.__tables[family]
+        self.__lookups[family] = [
+            (cidr, bits-cidr, tables[cidr])
+            for cidr in sorted(tables, reverse=True)
+        ]
+        if family == socket.AF_INET6:
+            self.__mapped = [lookup for lookup in self.__lookups[family]
+                             if lookup[0] <= MAPPED_BITS]
+
+    def add(self, uuid, address, cidr):
+        """
+        Add ban uuid for address/cidr; replaces an older entry
+        for the same uuid.
+        """
+        family, value = parse_address(address)
+        if not 0 <= cidr <= BITS[family]:
+            raise ValueError("invalid cidr %r for %s" % (cidr, address))
+        if cidr >= MAPPED_BITS:
+            unmapped, value = unmap(family, value)
+            if unmapped != family:
+                family, cidr = unmapped, cidr - MAPPED_BITS
+        bits = BITS[family]
+        self.remove(uuid)
+        prefix = value >> (bits-cidr)
+        tables = self.__tables[family]
+        if cidr not in tables:
+            tables[cidr] = {}
+            self.__reindex(family)
+        tables[cidr].setdefault(prefix, set()).add(uuid)
+        self.__bans[uuid] = (family, cidr, prefix)
+
+    def remove(self, uuid):
+        """Remove ban uuid, fine if we don't have it."""
+        entry = self.__bans.pop(uuid, None)
+        if entry is None:
+            return
+        family, cidr, prefix = entry
+        tables = self.__tables[family]
+        uuids = tables[cidr][prefix]
+        uuids.discard(uuid)
+        if not uuids:
+            del tables[cidr][prefix]
+        if not tables[cidr]:
+            del tables[cidr]
+            self.__reindex(family)
+
+    def update(self, ban):
+        """
+        Add or remove Ban object depending on whether it's active
+        and has a network.
+        """
+        if ban.active and ban.start is not None:
+            self.add(ban.uuid, ban.address, ban.cidr)
+        else:
+            self.remove(ban.uuid)
+
+    def lookup(self, address):
+        """
+        Return uuid of the most specific ban covering address
+        or None if address isn't banned.
+        """
+        family, value = unmap(*parse_address(address))
+        for _cidr, shift, table in self.__lookups[family]:
+            uuids = table.get(value >> shift)
+            if uuids:
+                return next(iter(uuids))
+        if family == socket.AF_INET:
+            value |= MAPPED
+            for _cidr, shift, table in self.__mapped:
+                uuids = table.get(value >> shift)
+                if uuids:
+                    return next(iter(uuids))
+        return None
+
+    def clear(self):
+        """Forget all bans."""
+        self.__init__()
+
+    def load(self, session):
+        """Replace index contents with all active bans in the database."""
+        self.clear()
+        query = session.query(Ban.uuid, Ban.address, Ban.cidr).filter(
+            Ban.active==True, Ban.start!=None)
+        for uuid, address, cidr in query:
+            self.add(uuid, address, cidr)
+
+    def listen(self, session_factory):
+        """
+        Keep index current with bans changed through sessions
+        created by session_factory (a sessionmaker or Session
+        class); changes are applied when the session commits.
+        """
+        follow(session_factory, 'banindex', self.__collect, self.__apply)
+
+    @staticmethod
+    def __collect(obj, deleted):
+        """Change to remember for obj, None unless it's a ban."""
+        if not isinstance(obj, Ban):
+            return None
+        if deleted:
+            return (obj.uuid, None, None, False)
+        return (obj.uuid, obj.address, obj.cidr,
+                obj.active and obj.start is not None)
+
+    def __apply(self, change):
+        """Apply a committed change of a ban."""
+        uuid, address, cidr, active = change
+        if active:
+            self.add(uuid, address, cidr)
+        else:
+            self.remove(uuid)
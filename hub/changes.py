@@ -0,0 +1,83 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+changes.py - follow committed model changes in memory
+
+- the ban index, the ban summary, and the credential index keep
+  model objects in memory and must hear about every change,
+  but only once it's committed; a rolled back change must never
+  make it into memory
+
+- so on every flush we remember what changed in session.info,
+  apply it when the session commits, and forget it when the
+  session rolls back; follow() wires that up for a sessionmaker
+  (or Session class), the caller only says which objects it
+  cares about and what to do with them
+
+- savepoints (begin_nested()) complicate that a bit: releasing
+  one is no commit yet, and rolling one back must only forget
+  what changed inside it; so we also remember how many changes
+  were pending when each savepoint began
+"""
+
+from sqlalchemy import event
+
+
+def follow(session_factory, key, collect, apply):
+    """
+    Follow changes committed through sessions created by
+    session_factory.
+
+    After each flush collect(obj, deleted) is called for every
+    new, dirty, and deleted object and returns a change to
+    remember or None for objects we don't care about; changes
+    wait in session.info[key], so key must be unique per
+    follower. When the outermost transaction commits,
+    apply(change) is called for each of them, in order.
+    """
+    # [(savepoint transaction, changes pending when it began)]
+    savepoints = key + ' savepoints'
+
+    def after_transaction_create(session, transaction):
+        """Remember where changes inside a savepoint start."""
+        if transaction.nested:
+            mark = len(session.info.get(key, []))
+            session.info.setdefault(savepoints, []).append((transaction, mark))
+
+    def after_flush(session, _context):
+        """Remember changes of this flush until commit."""
+        pending = session.info.setdefault(key, [])
+        for obj in session.new.union(session.dirty):
+            change = collect(obj, False)
+            if change is not None:
+                pending.append(change)
+        for obj in session.deleted:
+            change = collect(obj, True)
+            if change is not None:
+                pending.append(change)
+
+    def after_commit(session):
+        """Apply changes of the committed transaction."""
+        if session.info.get(savepoints):
+            # released a savepoint, its changes wait for the rest
+            session.info[savepoints].pop()
+            return
+        for change in session.info.pop(key, []):
+            apply(change)
+
+    def after_rollback(session, previous):
+        """Drop changes of the rolled back transaction or savepoint."""
+        marks = session.info.get(savepoints)
+        if marks and marks[-1][0] is previous:
+            _transaction, mark = marks.pop()
+            del session.info.get(key, [])[mark:]
+            return
+        session.info.pop(key, None)
+        session.info.pop(savepoints, None)
+
+    event.listen(session_factory, 'after_transaction_create',
+                 after_transaction_create)
+    event.listen(session_factory, 'after_flush', after_flush)
+    event.listen(session_factory, 'after_commit', after_commit)
+    event.listen(session_factory, 'after_soft_rollback', after_rollback)
@@ -0,0 +1,226 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+credentials.py - in-memory index of game admin credentials
+
+- every AdminLogin has to match (address, guid, password)
+  against game_admins and then check that the user behind the
+  admin may log in at all; a query plus a lazy load of the user
+  per attempt is wasteful, so the hub builds this index from
+  game_admins and users on startup and asks it instead
+
+- admins are keyed by (guid, address), each key maps password
+  hashes to admins; the unique constraint on game_admins makes
+  sure there's at most one admin per hash; users are kept
+  separately, so disabling or activating a user doesn't touch
+  any admin entries
+
+- a user may log in only if activated and not disabled, the
+  index checks that on every attempt
+
+- like the ban index the credentials only change when a session
+  that touched users or admins commits; see listen() below
+
+- a successful login updates "first" and "last" of the admin;
+  that's a write we don't want to wait for, so an optional
+  UsageWriter collects them and writes them in batches from a
+  background thread, through the engine and not a session so
+  the index doesn't hear about it
+"""
+
+from datetime import datetime
+from hashlib import sha256
+
+from sqlalchemy import bindparam, case, func, or_
+
+from changes import follow
+from model import GameAdmin, User
+from writebehind import WriteBehind
+
+ADMINS = GameAdmin.__table__
+
+
+def password_hash(password):
+    """Hash of password as stored in the model."""
+    return sha256(password).hexdigest()
+
+
+class CredentialIndex(object):
+    """
+    Game admin credentials by (guid, address), for fast login
+    checks; see authorize().
+
+    Pass a UsageWriter as usage to have successful logins
+    written back to the database.
+    """
+    def __init__(self, usage=None):
+        self.__usage = usage
+        # (guid, address) -> {password hash: admin id}
+        self.__keys = {}
+        # admin id -> ((guid, address), password hash, user id)
+        self.__admins = {}
+        # user id -> (may log in, login)
+        self.__users = {}
+
+    def __len__(self):
+        return len(self.__admins)
+
+    def add_user(self, user_id, login, activated, disabled):
+        """Add or replace user user_id."""
+        self.__users[user_id] = (bool(activated) and not disabled, login)
+
+    def remove_user(self, user_id):
+        """Remove user user_id, fine if we don't have it."""
+        self.__users.pop(user_id, None)
+
+    def add_admin(self, admin_id, address, guid, password, user_id):
+        """
+        Add or replace admin admin_id; password is the hash as
+        stored in the model.
+        """
+        self.remove_admin(admin_id)
+        key = (guid, address)
+        self.__keys.setdefault(key, {})[password] = admin_id
+        self.__admins[admin_id] = (key, password, user_id)
+
+    def remove_admin(self, admin_id):
+        """Remove admin admin_id, fine if we don't have it."""
+        entry = self.__admins.pop(admin_id, None)
+        if entry is None:
+            return
+        key, password, _user_id = entry
+        passwords = self.__keys[key]
+        del passwords[password]
+        if not passwords:
+            del self.__keys[key]
+
+    def lookup(self, address, guid, password):
+        """
+        Return (admin id, login) of the admin with these
+        credentials, password in plain text, or None if there's
+        no such admin or its user may not log in.
+        """
+        passwords = self.__keys.get((guid, address))
+        if not passwords:
+            return None
+        admin_id = passwords.get(password_hash(password))
+        if admin_id is None:
+            return None
+        user = self.__users.get(self.__admins[admin_id][2])
+        if user is None or not user[0]:
+            return None
+        return admin_id, user[1]
+
+    def authorize(self, address, guid, password, when=None):
+        """
+        Like lookup(), but also note the login for the usage
+        writer if we have one; when defaults to now.
+        """
+        found = self.lookup(address, guid, password)
+        if found is not None and self.__usage is not None:
+            self.__usage.record(found[0], when)
+        return found
+
+    def clear(self):
+        """Forget all credentials."""
+        self.__init__(self.__usage)
+
+    def load(self, session):
+        """Replace index contents with the users and admins in the database."""
+        self.clear()
+        query = session.query(User.id, User.login, User.activated,
+                              User.disabled)
+        for user_id, login, activated, disabled in query:
+            self.add_user(user_id, login, activated, disabled)
+        query = session.query(GameAdmin.id, GameAdmin.address, GameAdmin.guid,
+                              GameAdmin.password, GameAdmin.user_id)
+        for admin_id, address, guid, password, user_id in query:
+            self.add_admin(admin_id, address, guid, password, user_id)
+
+    def listen(self, session_factory):
+        """
+        Keep index current with users and admins changed through
+        sessions created by session_factory (a sessionmaker or
+        Session class); changes are applied when the session
+        commits.
+        """
+        follow(session_factory, 'credentials', self.__collect, self.__apply)
+
+    @staticmethod
+    def __collect(obj, deleted):
+        """Change to remember for obj, None unless it's a user or admin."""
+        if isinstance(obj, User):
+            return ('user', obj.id, None if deleted else (
+                obj.login, obj.activated, obj.disabled))
+        if isinstance(obj, GameAdmin):
+            return ('admin', obj.id, None if deleted else (
+                obj.address, obj.guid, obj.password, obj.user_id))
+        return None
+
+    def __apply(self, change):
+        """Apply a committed change of a user or admin."""
+        kind, key, values = change
+        if kind == 'user':
+            if values is None:
+                self.remove_user(key)
+            else:
+                self.add_user(key, *values)
+        else:
+            if values is None:
+                self.remove_admin(key)
+            else:
+                self.add_admin(key, *values)
+
+
+class UsageWriter(WriteBehind):
+    """
+    Write-behind for "first" and "last" of game admins.
+
+    A background thread collects logins for flush_time seconds
+    and writes them with one executemany; see writebehind.py.
+    """
+    def __init__(self, engine, flush_time=5.0):
+        """Initialize and start a new writer for engine."""
+        self.__engine = engine
+        # counters, read them through stats()
+        self.__recorded = 0
+        super(UsageWriter, self).__init__(None, flush_time)
+
+    def record(self, admin_id, when=None):
+        """Remember a login of admin_id at when (default now)."""
+        when = when or datetime.utcnow()
+        with self._cond:
+            # admin id -> [first, last] login since the last flush
+            pending = self._pending()
+            self.__recorded += 1
+            seen = pending.get(admin_id)
+            if seen is None:
+                pending[admin_id] = [when, when]
+            else:
+                seen[0] = min(seen[0], when)
+                seen[1] = max(seen[1], when)
+            self._added()
+
+    def _empty(self):
+        return {}
+
+    def _counters(self):
+        return {'recorded': self.__recorded}
+
+    def _write(self, _resource, pending):
+        """Write pending logins in one transaction."""
+        seen_first = bindparam('seen_first', type_=ADMINS.c.first.type)
+        seen_last = bindparam('seen_last', type_=ADMINS.c.last.type)
+        # replayed or late logins must not move "last" backwards
+        statement = ADMINS.update().where(
+            ADMINS.c.id == bindparam('admin_id')
+        ).values(
+            first=func.coalesce(ADMINS.c.first, seen_first),
+            last=case([(or_(ADMINS.c.last == None, ADMINS.c.last < seen_last),
+                        seen_last)], else_=ADMINS.c.last)
+        )
+        rows = [{'admin_id': admin_id, 'seen_first': first, 'seen_last': last}
+                for admin_id, (first, last) in pending.iteritems()]
+        with self.__engine.begin() as connection:
+            connection.execute(statement, rows)
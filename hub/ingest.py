@@ -0,0 +1,146 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+ingest.py - bulk writes of player sightings
+
+- every ServerUserinfoChanged is a player sighting; building
+  a mapped Player instance (and calling utcnow()) for each of
+  them costs far more than the write itself, so the event path
+  hands us batches of plain (name, address, guid, server) tuples
+  instead and we write them with one Core executemany
+
+- a sighting either inserts a new player or updates "last" of
+  the existing one, as identified by the unique constraint on
+  (name, address, guid, server); that's an upsert, and every
+  database spells it differently: SQLite and PostgreSQL have
+  INSERT ... ON CONFLICT DO UPDATE, MySQL has INSERT ... ON
+  DUPLICATE KEY UPDATE; see UPSERTS below
+
+- for other databases (and SQLAlchemy versions without the
+  dialect-specific insert constructs) we fall back to an UPDATE
+  per sighting and one executemany INSERT for the sightings we
+  didn't find; that's only safe if we're the only writer
+
+- a batch may see the same player more than once, PostgreSQL
+  refuses to upsert a row twice in one statement, so we merge
+  those first
+
+- new rows get the packed addresses the model keeps next to
+  the text ones; existing rows keep theirs, the key includes
+  both addresses so they can't have changed
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, bindparam
+
+from address import pack
+from model import Player
+
+PLAYERS = Player.__table__
+KEY = ('name', 'address', 'guid', 'server')
+
+
+def _sqlite_upsert():
+    from sqlalchemy.dialects.sqlite import insert
+    statement = insert(PLAYERS)
+    return statement.on_conflict_do_update(
+        index_elements=[PLAYERS.c[column] for column in KEY],
+        set_={'last': statement.excluded.last}
+    )
+
+def _postgresql_upsert():
+    from sqlalchemy.dialects.postgresql import insert
+    statement = insert(PLAYERS)
+    return statement.on_conflict_do_update(
+        index_elements=[PLAYERS.c[column] for column in KEY],
+        set_={'last': statement.excluded.last}
+    )
+
+def _mysql_upsert():
+    from sqlalchemy.dialects.mysql import insert
+    statement = insert(PLAYERS)
+    return statement.on_duplicate_key_update(last=statement.inserted.last)
+
+UPSERTS = {
+    'sqlite': _sqlite_upsert,
+    'postgresql': _postgresql_upsert,
+    'mysql': _mysql_upsert,
+}
+
+
+def upsert_statement(dialect):
+    """
+    Upsert statement for players on dialect, None if we don't
+    know how to upsert there.
+    """
+    make = UPSERTS.get(dialect.name)
+    if make is None:
+        return None
+    try:
+        return make()
+    except (ImportError, AttributeError):
+        return None
+
+def merge_sightings(sightings, when):
+    """
+    Turn sightings into a list of row dictionaries, one per
+    distinct player; sorted so that concurrent batches lock
+    rows in the same order.
+    """
+    rows = [
+        dict(zip(KEY, key), first=when, last=when)
+        for key in sorted(set(tuple(sighting) for sighting in sightings))
+    ]
+    for row in rows:
+        row['address_packed'] = pack(row['address'])
+        row['server_packed'] = pack(row['server'])
+    return rows
+
+def upsert_players(connection, rows):
+    """
+    Write rows from merge_sightings() with one upsert; returns
+    False if the dialect can't do that.
+    """
+    statement = upsert_statement(connection.dialect)
+    if statement is None:
+        return False
+    connection.execute(statement, rows)
+    return True
+
+def update_or_insert_players(connection, rows):
+    """
+    Write rows from merge_sightings() with an update for each
+    and one insert for all the players that don't exist yet.
+    """
+    update = PLAYERS.update().where(and_(
+        *[PLAYERS.c[column] == bindparam('_' + column) for column in KEY]
+    )).values(last=bindparam('last'))
+    missing = []
+    for row in rows:
+        keys = dict(('_' + column, row[column]) for column in KEY)
+        keys['last'] = row['last']
+        if connection.execute(update, keys).rowcount == 0:
+            missing.append(row)
+    if missing:
+        connection.execute(PLAYERS.insert(), missing)
+
+def record_players(connection, sightings, when=None):
+    """
+    Record a batch of sightings, (name, address, guid, server)
+    tuples, as seen at when (default now, UTC).
+
+    New players are inserted with first and last set to when,
+    for existing players only last is updated. Call this in a
+    transaction, we don't commit. Returns the number of distinct
+    players written.
+    """
+    if when is None:
+        when = datetime.utcnow()
+    rows = merge_sightings(sightings, when)
+    if not rows:
+        return 0
+    if not upsert_players(connection, rows):
+        update_or_insert_players(connection, rows)
+    return len(rows)
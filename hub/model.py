@@ -30,7 +30,14 @@ model.py - data model
   limits; we use the custom Address type for now and if we
   ever fail to store something important we'll revise it
 
-- we never delete anything; at most we mark things inactive
+- text can't be range-scanned by subnet, so numeric addresses
+  also get a Packed column that sorts like the address and has
+  an index; they're kept current whenever an address is set,
+  see address.py for the format and for query helpers
+
+- we never delete anything; at most we mark things inactive;
+  players not seen for a while move to monthly archive tables
+  but stay queryable, see retention.py
 
 - it's a major pain to get sqlalchemy to do something like
   autoincrement on non-primary keys portably across databases;
@@ -50,14 +57,17 @@ from hashlib import sha256
 
 from sqlalchemy import Column, Sequence, ForeignKey
 from sqlalchemy import Boolean, Integer, String, DateTime
-from sqlalchemy.orm import relationship
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.orm import relationship, validates
+from sqlalchemy.schema import Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 
+from address import network, pack
+
 GUID = Tiny = String(32)
 Password = Short = String(64)
 Medium = String(128)
 Address = Long = String(256)
+Packed = String(32)
 
 Base = declarative_base()
 
@@ -80,7 +90,15 @@ class Player(Base):
       userinfo change - but then we'd have no record of them...
     """
     __tablename__ = 'players'
-    __table_args__ = (UniqueConstraint('name', 'address', 'guid', 'server'), {})
+    __table_args__ = (
+        UniqueConstraint('name', 'address', 'guid', 'server'),
+        # keyset pagination in queries.py
+        Index('players_recent', 'last', 'id'),
+        Index('players_name_recent', 'name', 'last', 'id'),
+        # retention.py moves the newest ids into archives, too;
+        # SQLite must not hand them out again
+        {'sqlite_autoincrement': True}
+    )
 
     id = Column(Integer, Sequence('players_ids'), primary_key=True,
                 autoincrement=True, nullable=False, unique=True)
@@ -90,6 +108,10 @@ class Player(Base):
     server = Column(Address, nullable=False, doc="ip address")
     first = Column(DateTime, nullable=False, doc="on insert")
     last = Column(DateTime, nullable=False, doc="on insert and update")
+    address_packed = Column(Packed, nullable=True, index=True,
+                            doc="address for range queries")
+    server_packed = Column(Packed, nullable=True, index=True,
+                           doc="server without port for range queries")
 
     def __init__(self, name, address, guid, server):
         self.name = name
@@ -98,6 +120,12 @@ class Player(Base):
         self.server = server
         self.first = self.last = datetime.utcnow()
 
+    @validates('address', 'server')
+    def _pack(self, key, value):
+        """Update the packed form of address or server."""
+        setattr(self, key+'_packed', pack(value))
+        return value
+
     def __repr__(self):
         return "Player<name: %s; address: %s; guid: %s; server: %s>" % (
             self.name, self.address, self.guid, self.server
@@ -146,6 +174,9 @@ class GameAdmin(Base):
     """
     Information for users who are game server admins.
 
+    The hub checks in-game admin logins against an in-memory index
+    of these built when it starts up; see credentials.py.
+
     TODO: admins must configure clients for constant guids
 
     TODO: the "correct" design would be user --1:N--> ip --1:N--> guid
@@ -170,6 +201,8 @@ class GameAdmin(Base):
     created = Column(DateTime, nullable=False, doc="on insert")
     first = Column(DateTime, nullable=True, doc="first used in game")
     last = Column(DateTime, nullable=True, doc="last used in game")
+    address_packed = Column(Packed, nullable=True, index=True,
+                            doc="address for range queries")
 
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False,
                      unique=False)
@@ -180,6 +213,12 @@ class GameAdmin(Base):
         self.password = sha256(password).hexdigest()
         self.created = datetime.utcnow()
 
+    @validates('address')
+    def _pack(self, key, value):
+        """Update the packed form of address."""
+        self.address_packed = pack(value)
+        return value
+
     def __repr__(self):
         return "GameAdmin<user_name: %s; address: %s; guid: %s>" % (
             self.user.name, self.address, self.guid
@@ -226,7 +265,10 @@ class Ban(Base):
       right now several uuid are likely as utcnow() is used
 
     - store address and subnet range separately for faster
-      range queries
+      range queries; start and end are the first and last
+      address of the network, packed, so "which bans cover this
+      address" is a range query, too; bans of host names have
+      neither
 
     - who was banned is stored in player_bans, which assumes
       that we have a record for the player
@@ -234,10 +276,19 @@ class Ban(Base):
     - who did the ban and why as well as the history of the
       ban over time is stored in history_bans
 
-    - TODO: should the hub build a custom data structure for
-      fast ban checks when it starts up?
+    - the hub checks players against an in-memory index of the
+      active bans built when it starts up; see banindex.py
+
+    - hubs find out which bans they disagree on by comparing hash
+      summaries of their bans; see antientropy.py
     """
     __tablename__ = 'bans'
+    __table_args__ = (
+        Index('bans_range', 'start', 'end'),
+        # keyset pagination in queries.py
+        Index('bans_active', 'active', 'id'),
+        {}
+    )
 
     id = Column(Integer, Sequence('bans_ids'), autoincrement=True,
                 nullable=False, primary_key=True, unique=True)
@@ -245,6 +296,10 @@ class Ban(Base):
     address = Column(Address, nullable=False, unique=True, doc="without CIDR")
     cidr = Column(Integer, nullable=False)
     active = Column(Boolean, nullable=False)
+    start = Column(Packed, nullable=True,
+                   doc="first address of network, None for host names")
+    end = Column(Packed, nullable=True,
+                 doc="last address of network, None for host names")
 
     def __init__(self, address, cidr, active=True):
         self.uuid = sha256("%s%s" % (datetime.utcnow(), address)).hexdigest()
@@ -252,6 +307,22 @@ class Ban(Base):
         self.cidr = cidr
         self.active = active
 
+    @validates('address', 'cidr')
+    def _network(self, key, value):
+        """
+        Update start and end, raises ValueError for invalid
+        prefix lengths; a host name has no network.
+        """
+        address = value if key == 'address' else self.address
+        cidr = value if key == 'cidr' else self.cidr
+        if address is None or cidr is None:
+            return value
+        if pack(address) is None:
+            self.start = self.end = None
+        else:
+            self.start, self.end = network(address, cidr)
+        return value
+
     def __repr__(self):
         return "Ban<uuid: %s; address: %s/%s; active: %s>" % (
             self.uuid, self.address, self.cidr, self.active
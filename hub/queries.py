@@ -0,0 +1,155 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+queries.py - read-side queries for the web player and ban lists
+
+- WebPlayerList and WebBanList page through tables with
+  millions of rows; loading mapped objects costs far more than
+  the query, and OFFSET pagination makes the database walk
+  past all earlier pages again, so page 1000 is 1000 times
+  slower than page one
+
+- so we select only the columns a page shows, as plain result
+  rows, and page with keysets instead: a page ends with a key,
+  the next page starts right after it; with an index matching
+  the sort order every page is one index range scan, no matter
+  how deep
+
+- players are listed most recently seen first, by (last, id);
+  id breaks ties since many players share a "last"; the
+  matching indexes are declared in the model
+
+- bans have no times, they're listed newest first by id
+
+- players that haven't been seen for a while are moved to
+  monthly archive tables, see retention.py; pass the archives
+  to list and look up those players, too
+
+- pass a connection or a session, anything with execute()
+"""
+
+from sqlalchemy import and_, or_, select
+
+from model import Ban, Player
+
+PLAYERS = Player.__table__
+BANS = Ban.__table__
+
+# default projections
+PLAYER_LIST = ('id', 'name', 'address', 'server', 'last')
+PLAYER_DETAIL = ('id', 'name', 'address', 'guid', 'server', 'first', 'last')
+BAN_LIST = ('id', 'uuid', 'address', 'cidr', 'active')
+
+
+class Page(object):
+    """
+    Rows of one page and the key to pass as after for the next
+    page, None if this is the last one.
+    """
+    def __init__(self, rows, after):
+        self.rows = rows
+        self.after = after
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __repr__(self):
+        return "Page<rows: %s; after: %s>" % (len(self.rows), self.after)
+
+
+def project(table, columns, keys):
+    """Table columns named in columns, plus keys if missing."""
+    names = list(columns) + [key for key in keys if key not in columns]
+    return [table.c[name] for name in names]
+
+def after_key(table, keys, after):
+    """
+    Condition for rows after key after in descending order of
+    keys (two columns); written so the first key bounds an
+    index range.
+    """
+    first, second = [table.c[key] for key in keys]
+    return and_(first <= after[0],
+                or_(first < after[0], second < after[1]))
+
+def cut_page(rows, keys, limit):
+    """Page of the first limit of up to limit+1 sorted rows."""
+    if len(rows) <= limit:
+        return Page(rows, None)
+    rows = rows[:limit]
+    return Page(rows, tuple(rows[-1][key] for key in keys))
+
+def fetch_page(connection, query, keys, limit):
+    """
+    Run query (which must fetch limit+1 rows) and cut the
+    result into a Page.
+    """
+    return cut_page(connection.execute(query).fetchall(), keys, limit)
+
+def players_query(table, after, limit, name, columns):
+    """Query for a page of players in table, see player_list()."""
+    keys = ('last', 'id')
+    query = select(project(table, columns, keys))
+    if name is not None:
+        query = query.where(table.c.name == name)
+    if after is not None:
+        query = query.where(after_key(table, keys, after))
+    return query.order_by(table.c['last'].desc(),
+                          table.c['id'].desc()).limit(limit+1)
+
+def player_list(connection, after=None, limit=50, name=None,
+                columns=PLAYER_LIST, archives=()):
+    """
+    One page of players, most recently seen first; after is the
+    key of the previous page, name restricts the list to one
+    player name. Rows have the given columns plus last and id.
+
+    Pass archives from retention.archives() to page on into
+    archived players; we only ask the archives for months that
+    can still make it onto the page.
+    """
+    keys = ('last', 'id')
+    query = players_query(PLAYERS, after, limit, name, columns)
+    rows = connection.execute(query).fetchall()
+    for table, start, end in archives:
+        if after is not None and start > after[0]:
+            continue
+        if len(rows) > limit and rows[limit]['last'] >= end:
+            break
+        query = players_query(table, after, limit, name, columns)
+        rows.extend(connection.execute(query).fetchall())
+        rows.sort(key=lambda row: (row['last'], row['id']), reverse=True)
+        del rows[limit+1:]
+    return cut_page(rows, keys, limit)
+
+def player_detail(connection, player_id, columns=PLAYER_DETAIL, archives=()):
+    """
+    Row with the given columns of player player_id, None if
+    none; looks in archives from retention.archives(), too.
+    """
+    for table in [PLAYERS] + [table for table, _, _ in archives]:
+        query = select([table.c[name] for name in columns]).where(
+            table.c.id == player_id)
+        row = connection.execute(query).first()
+        if row is not None:
+            return row
+    return None
+
+def ban_list(connection, after=None, limit=50, active=None,
+             columns=BAN_LIST):
+    """
+    One page of bans, newest first; after is the key of the
+    previous page, active restricts the list to active or
+    inactive bans. Rows have the given columns plus id.
+    """
+    query = select(project(BANS, columns, ('id',)))
+    if active is not None:
+        query = query.where(BANS.c.active == active)
+    if after is not None:
+        query = query.where(BANS.c.id < after[0])
+    query = query.order_by(BANS.c.id.desc()).limit(limit+1)
+    return fetch_page(connection, query, ('id',), limit)
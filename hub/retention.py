@@ -0,0 +1,138 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+retention.py - hot players table, monthly archives for the rest
+
+- players gets a row per (name, address, guid, server) and we
+  never delete anything, so the table and its indexes only
+  ever grow, and every sighting pays for indexes that are
+  mostly history; yet all the hub itself cares about is who
+  played recently
+
+- so rollover() moves players not seen for some days into
+  archive tables, one per month of "last", named like
+  players_2011_01; the hot table stays about as big as the
+  recent past, however many years of history pile up behind it
+
+- a month moves in one transaction with one INSERT ... SELECT
+  and one DELETE, the rows never travel through Python
+
+- archive tables have the columns of players and the indexes
+  queries.py needs, but no unique constraints: if an archived
+  player shows up again, ingest.py simply inserts a fresh row
+  into players, the archived one stays as history; and a row
+  updated between our INSERT and DELETE stays hot, its old
+  version gets archived anyway, history again
+
+- ids stay unique across players and its archives, queries.py
+  relies on that; other databases never reuse ids anyway, on
+  SQLite players is created with AUTOINCREMENT for that
+
+- archive tables live in their own metadata, not in the
+  model's, so create_all() and drop_all() leave them alone;
+  archives() finds them in the database, pass its result to
+  the player queries in queries.py to include them
+"""
+
+from datetime import datetime, timedelta
+import re
+
+from sqlalchemy import Column, Index, MetaData, Table, and_, func, inspect
+from sqlalchemy import select
+
+from model import Player
+
+PLAYERS = Player.__table__
+ARCHIVES = MetaData()
+ARCHIVE_NAME = re.compile(r"^players_(\d{4})_(\d{2})$")
+
+
+def month_start(when):
+    """Start of the month when is in."""
+    return datetime(when.year, when.month, 1)
+
+def next_month(start):
+    """Start of the month after the one starting at start."""
+    if start.month == 12:
+        return datetime(start.year+1, 1, 1)
+    return datetime(start.year, start.month+1, 1)
+
+def archive_table(year, month):
+    """Archive table for players last seen in year and month."""
+    name = "players_%04d_%02d" % (year, month)
+    table = ARCHIVES.tables.get(name)
+    if table is None:
+        table = Table(name, ARCHIVES, *(
+            [Column(column.name, column.type, nullable=column.nullable)
+             for column in PLAYERS.columns] +
+            [Index("%s_recent" % name, "last", "id"),
+             Index("%s_name_recent" % name, "name", "last", "id"),
+             Index("%s_address" % name, "address_packed")]
+        ))
+    return table
+
+def archives(bind):
+    """
+    Archive tables in the database bind, as (table, start, end)
+    with start and end of their month, newest first.
+    """
+    found = []
+    for name in inspect(bind).get_table_names():
+        match = ARCHIVE_NAME.match(name)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+            start = datetime(year, month, 1)
+            found.append((archive_table(year, month), start,
+                          next_month(start)))
+    found.sort(key=lambda archive: archive[1], reverse=True)
+    return found
+
+def archive_month(bind, start, cutoff):
+    """
+    Move players last seen in the month starting at start, but
+    before cutoff, into its archive table; returns how many.
+    """
+    table = archive_table(start.year, start.month)
+    end = min(next_month(start), cutoff)
+    seen = and_(PLAYERS.c['last'] >= start, PLAYERS.c['last'] < end)
+    names = [column.name for column in PLAYERS.columns]
+    with bind.begin() as connection:
+        table.create(connection, checkfirst=True)
+        connection.execute(table.insert().from_select(
+            names, select([PLAYERS.c[name] for name in names]).where(seen)))
+        return connection.execute(PLAYERS.delete().where(seen)).rowcount
+
+def oldest_before(bind, after, cutoff):
+    """
+    Oldest "last" of players seen from after (None for the
+    beginning of time) up to cutoff, None if there is none.
+    """
+    seen = PLAYERS.c['last'] < cutoff
+    if after is not None:
+        seen = and_(PLAYERS.c['last'] >= after, seen)
+    with bind.connect() as connection:
+        return connection.execute(
+            select([func.min(PLAYERS.c['last'])]).where(seen)).scalar()
+
+def rollover(bind, days=90, now=None):
+    """
+    Move players not seen for days days (before now, default
+    now, UTC) out of players into the archives, one transaction
+    per month; returns how many we moved. Only months somebody
+    was last seen in get an archive table, we skip to the next
+    such month instead of walking the calendar.
+    """
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    moved = 0
+    oldest = oldest_before(bind, None, cutoff)
+    while oldest is not None:
+        start = month_start(oldest)
+        moved += archive_month(bind, start, cutoff)
+        oldest = oldest_before(bind, next_month(start), cutoff)
+    return moved
+
+def drop_archives(bind):
+    """Drop all archive tables in the database bind."""
+    for table, _, _ in archives(bind):
+        table.drop(bind)
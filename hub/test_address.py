@@ -0,0 +1,160 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_address.py - test packed addresses and range queries
+"""
+
+from address import covering, network, pack, unpack, within
+from model import Ban, Player
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+
+class TestPack(object):
+    """
+    Packing and unpacking.
+    """
+    def test0_ipv4(self):
+        assert pack("1.2.3.4") == "00000000000000000000ffff01020304"
+        assert pack("1.2.3.4:27960") == pack("1.2.3.4")
+        assert unpack(pack("1.2.3.4")) == "1.2.3.4"
+
+    def test1_ipv6(self):
+        assert pack("::1") == "0"*31 + "1"
+        assert pack("[2001:f68::1986:69af]:27960") == \
+            "20010f680000000000000000198669af"
+        assert unpack(pack("2001:f68::1986:69af")) == "2001:f68::1986:69af"
+
+    def test2_invalid(self):
+        for address in ["", "1.2.3", "hub.tld", "hub.tld:27960", None]:
+            assert pack(address) is None
+
+    def test3_order(self):
+        addresses = ["0.0.0.0", "1.2.3.4", "1.2.3.40", "10.0.0.1",
+                     "255.255.255.255", "2001:f68::1"]
+        assert sorted(addresses, key=pack) == addresses
+
+    def test4_network(self):
+        assert network("72.34.121.50", 24) == (pack("72.34.121.0"),
+                                               pack("72.34.121.255"))
+        assert network("1.2.3.4", 32) == (pack("1.2.3.4"), pack("1.2.3.4"))
+        assert network("1.2.3.4", 0) == (pack("0.0.0.0"),
+                                         pack("255.255.255.255"))
+        assert network("2001:f68::1", 32) == (pack("2001:f68::"),
+                                              pack("2001:f68:ffff:ffff:ffff:"
+                                                   "ffff:ffff:ffff"))
+        assert network("::ffff:1.2.3.4", 120) == (pack("1.2.3.0"),
+                                                  pack("1.2.3.255"))
+        assert network("::ffff:1.2.3.4", 128) == (pack("1.2.3.4"),
+                                                  pack("1.2.3.4"))
+        for address, cidr in [("1.2.3.4", 33), ("1.2.3.4", -1),
+                              ("::1", 129), ("::ffff:1.2.3.4", 129),
+                              ("hub.tld", 8)]:
+            try:
+                network(address, cidr)
+            except ValueError:
+                pass
+            else:
+                assert False, (address, cidr)
+
+
+class TestQueries(object):
+    """
+    Range queries through the model.
+    """
+    def test0_players(self):
+        session = Global.Session()
+        for i, address in enumerate(["10.1.2.3", "10.1.200.3", "10.2.0.1",
+                                     "9.255.255.255", "2001:f68::7"]):
+            session.add(Player("subnet%s" % i, address, "0"*32,
+                               "5.6.7.8:27960"))
+        session.commit()
+        found = sorted(name for name, in session.query(Player.name).filter(
+            within(Player.address_packed, "10.1.0.0", 16)))
+        assert found == ["subnet0", "subnet1"]
+        found = sorted(name for name, in session.query(Player.name).filter(
+            within(Player.address_packed, "2001:f68::", 32)))
+        assert found == ["subnet4"]
+        assert session.query(Player).filter(
+            within(Player.server_packed, "5.6.7.0", 24)).count() == 5
+        session.close()
+
+    def test1_bans(self):
+        session = Global.Session()
+        session.add(Ban("72.34.121.50", 24))
+        session.add(Ban("72.34.0.0", 16))
+        session.add(Ban("2001:f68::1986:69af", 64))
+        session.commit()
+        covers = lambda address: sorted(
+            cidr for cidr, in session.query(Ban.cidr).filter(
+                covering(Ban.start, Ban.end, address)))
+        assert covers("72.34.121.1") == [16, 24]
+        assert covers("72.34.122.1") == [16]
+        assert covers("72.35.0.1") == []
+        assert covers("2001:f68::1") == [64]
+        session.close()
+
+    def test2_update(self):
+        session = Global.Session()
+        ban = Ban("8.8.8.8", 32)
+        session.add(ban)
+        session.commit()
+        ban.cidr = 8
+        player = session.query(Player).filter_by(name="subnet0").one()
+        player.address = "11.0.0.1"
+        session.commit()
+        assert (ban.start, ban.end) == network("8.0.0.0", 8)
+        assert player.address_packed == pack("11.0.0.1")
+        try:
+            ban.cidr = 40
+        except ValueError:
+            pass
+        else:
+            assert False
+        session.rollback()
+        session.close()
+
+    def test3_hostname(self):
+        session = Global.Session()
+        ban = Ban("bans.hub.tld", 24)
+        session.add(ban)
+        session.commit()
+        assert (ban.start, ban.end) == (None, None)
+        ban.address = "8.8.4.4"
+        assert (ban.start, ban.end) == network("8.8.4.0", 24)
+        ban.address = "bans.hub.tld"
+        assert (ban.start, ban.end) == (None, None)
+        session.commit()
+        session.close()
@@ -0,0 +1,218 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_antientropy.py - test the ban summary and syncing with it
+"""
+
+from antientropy import DIGITS, BanSummary, RemoteSummary, answer, diff
+from model import Ban
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+def summaries(count, depth=3):
+    """
+    Two summaries with the same count bans.
+    """
+    local, remote = BanSummary(depth), BanSummary(depth)
+    for i in range(count):
+        for summary in (local, remote):
+            summary.add("uuid%s" % i, "10.0.%s.%s" % (i // 256, i % 256),
+                        32, True)
+    return local, remote
+
+
+class TestSummary(object):
+    """
+    Summary without database.
+    """
+    def test0_order(self):
+        local, remote = BanSummary(), BanSummary()
+        local.add("a", "1.2.3.4", 32, True)
+        local.add("b", "1.2.3.5", 32, True)
+        remote.add("b", "1.2.3.5", 32, True)
+        remote.add("a", "1.2.3.4", 32, True)
+        assert local.root() == remote.root()
+        assert local.root() != BanSummary().root()
+
+    def test1_remove(self):
+        summary = BanSummary()
+        empty = summary.root()
+        summary.add("a", "1.2.3.4", 32, True)
+        summary.add("a", "1.2.3.4", 32, False)
+        assert len(summary) == 1
+        summary.remove("a")
+        summary.remove("a")
+        assert len(summary) == 0
+        assert summary.root() == empty
+        assert summary.entries(["%04x" % i for i in range(65536)]) == {}
+
+    def test2_state(self):
+        local, remote = BanSummary(), BanSummary()
+        local.add("a", "1.2.3.4", 32, True)
+        remote.add("a", "1.2.3.4", 32, False)
+        assert local.root() != remote.root()
+        remote.add("a", "1.2.3.4", 32, True)
+        assert local.root() == remote.root()
+
+
+class TestDiff(object):
+    """
+    Finding differences between summaries.
+    """
+    def test0_same(self):
+        local, remote = summaries(1000)
+        found = diff(local, remote)
+        assert len(found) == 0
+        assert found.round_trips == 1
+
+    def test1_differences(self):
+        local, remote = summaries(1000)
+        local.add("ours", "1.1.1.1", 32, True)
+        remote.add("theirs", "2.2.2.2", 32, True)
+        remote.add("uuid7", "10.0.0.7", 32, False)
+        found = diff(local, remote)
+        assert found.ours == set(["ours"])
+        assert found.theirs == set(["theirs"])
+        assert found.changed == set(["uuid7"])
+        assert found.round_trips == local.depth + 2
+
+    def test2_few_hashes(self):
+        local, remote = summaries(1000)
+        remote.remove("uuid42")
+        asked = []
+        class Remote(object):
+            depth = remote.depth
+            def hashes(self, prefixes):
+                asked.extend(prefixes)
+                return remote.hashes(prefixes)
+            def entries(self, buckets):
+                asked.extend(buckets)
+                return remote.entries(buckets)
+        found = diff(local, Remote())
+        assert found.ours == set(["uuid42"])
+        # root, 16 per level below it, the one differing bucket
+        assert len(asked) == 1 + 16*local.depth + 1
+
+
+class TestExchange(object):
+    """
+    Finding differences through requests and answers.
+    """
+    def test0_remote(self):
+        local, remote = summaries(1000)
+        remote.remove("uuid42")
+        remote.add("uuid7", "10.0.0.7", 32, False)
+        calls = []
+        def call(text):
+            calls.append(text)
+            return answer(remote, text)
+        found = diff(local, RemoteSummary(remote.depth, call))
+        assert found.ours == set(["uuid42"])
+        assert found.changed == set(["uuid7"])
+        assert found.theirs == set()
+        assert calls[0] == "ban hashes 3\n"
+        assert all(len(text.split("\n")[1].split(",")) <= 16
+                   for text in calls)
+
+    def test1_format(self):
+        summary = BanSummary(depth=1)
+        summary.add("a", "1.2.3.4", 32, True)
+        text = answer(summary, "ban hashes 1\n")
+        assert text == "ban hashes 1\n=%s" % summary.root()
+        text = answer(summary, "ban entries 1\n" + ",".join(DIGITS))
+        assert text.startswith("ban entries 1\na=")
+
+    def test2_bad_requests(self):
+        summary = BanSummary()
+        for text in ["ban hashes 3\n", "ban hashes 4\n00000",
+                     "ban entries 4\n000", "ban entries 4\n000g",
+                     "ban cakes 4\n"]:
+            try:
+                answer(summary, text)
+            except ValueError:
+                continue
+            assert False, text
+
+    def test3_bad_answers(self):
+        summary = BanSummary()
+        for reply in ["ban hashes 3\n=%064x" % 0, "ban entries 4\n=%064x" % 0,
+                      "ban hashes 4\n=nothex", "ban hashes 4"]:
+            remote = RemoteSummary(4, lambda text: reply)
+            try:
+                diff(summary, remote)
+            except ValueError:
+                continue
+            assert False, reply
+
+
+class TestDatabase(object):
+    """
+    Summary built from and kept current with the database.
+    """
+    def test0_load(self):
+        session = Global.Session()
+        session.add(Ban("72.34.121.50", 24))
+        session.add(Ban("1.2.3.4", 16, False))
+        session.commit()
+        summary = BanSummary()
+        summary.load(session)
+        assert len(summary) == 2
+        session.close()
+
+    def test1_listen(self):
+        summary = BanSummary()
+        summary.listen(Global.Session)
+        session = Global.Session()
+        summary.load(session)
+        before = summary.root()
+        ban = Ban("233.255.21.3", 8)
+        session.add(ban)
+        session.flush()
+        assert ban.uuid not in summary
+        session.commit()
+        assert ban.uuid in summary
+        added = summary.root()
+        assert added != before
+        ban.active = False
+        session.commit()
+        assert summary.root() not in (before, added)
+        session.delete(ban)
+        session.commit()
+        assert summary.root() == before
+        session.add(Ban("9.9.9.8", 32))
+        session.flush()
+        session.rollback()
+        assert summary.root() == before
+        session.close()
@@ -0,0 +1,172 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_banindex.py - test the in-memory ban index
+"""
+
+from banindex import BanIndex, parse_address
+from model import Ban
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+
+class TestParse(object):
+    """
+    Address parsing.
+    """
+    def test0_ipv4(self):
+        import socket
+        assert parse_address("1.2.3.4") == (socket.AF_INET, 0x01020304)
+
+    def test1_ipv6(self):
+        import socket
+        assert parse_address("::1") == (socket.AF_INET6, 1)
+
+    def test2_invalid(self):
+        for address in ["", "1.2.3", "1.2.3.4:27960", "hub.tld"]:
+            try:
+                parse_address(address)
+            except ValueError:
+                pass
+            else:
+                assert False, address
+
+
+class TestIndex(object):
+    """
+    Index without database.
+    """
+    def test0_lookup(self):
+        index = BanIndex()
+        index.add("a", "72.34.121.50", 24)
+        index.add("b", "72.34.0.0", 16)
+        index.add("c", "2001:f68::1986:69af", 64)
+        assert len(index) == 3
+        assert index.lookup("72.34.121.1") == "a"
+        assert index.lookup("72.34.122.1") == "b"
+        assert index.lookup("72.35.121.50") is None
+        assert index.lookup("2001:f68::1") == "c"
+        assert index.lookup("2001:f69::1") is None
+        assert "72.34.255.255" in index
+        assert "1.2.3.4" not in index
+
+    def test1_remove(self):
+        index = BanIndex()
+        index.add("a", "72.34.121.50", 24)
+        index.add("b", "72.34.121.0", 24)
+        index.remove("a")
+        assert index.lookup("72.34.121.1") == "b"
+        index.remove("b")
+        index.remove("b")
+        assert index.lookup("72.34.121.1") is None
+        assert len(index) == 0
+
+    def test2_replace(self):
+        index = BanIndex()
+        index.add("a", "72.34.121.50", 32)
+        index.add("a", "1.2.3.4", 32)
+        assert len(index) == 1
+        assert index.lookup("72.34.121.50") is None
+        assert index.lookup("1.2.3.4") == "a"
+
+    def test3_mapped(self):
+        index = BanIndex()
+        index.add("v4", "1.2.3.0", 24)
+        assert index.lookup("::ffff:1.2.3.4") == "v4"
+        index.add("mapped", "::ffff:5.6.7.8", 120)
+        assert index.lookup("5.6.7.9") == "mapped"
+        assert index.lookup("::ffff:5.6.7.9") == "mapped"
+        index.add("wide", "::", 80)
+        assert index.lookup("9.9.9.9") == "wide"
+        assert index.lookup("::ffff:9.9.9.9") == "wide"
+        assert index.lookup("1.2.3.4") == "v4"
+        index.remove("mapped")
+        assert index.lookup("5.6.7.9") == "wide"
+        assert index.lookup("2001:f68::1") is None
+
+    def test4_edges(self):
+        index = BanIndex()
+        index.add("all", "0.0.0.0", 0)
+        assert index.lookup("255.255.255.255") == "all"
+        assert index.lookup("::1") is None
+        for cidr in [-1, 33]:
+            try:
+                index.add("bad", "1.2.3.4", cidr)
+            except ValueError:
+                pass
+            else:
+                assert False, cidr
+
+
+class TestDatabase(object):
+    """
+    Index built from and kept current with the database.
+    """
+    def test0_load(self):
+        session = Global.Session()
+        session.add(Ban("72.34.121.50", 24))
+        session.add(Ban("1.2.3.4", 16, False))
+        session.add(Ban("load.hub.tld", 24))
+        session.commit()
+        index = BanIndex()
+        index.load(session)
+        assert len(index) == 1
+        assert "72.34.121.7" in index
+        assert "1.2.3.4" not in index
+        session.close()
+
+    def test1_listen(self):
+        index = BanIndex()
+        index.listen(Global.Session)
+        session = Global.Session()
+        index.load(session)
+        ban = Ban("233.255.21.2", 8)
+        session.add(ban)
+        session.flush()
+        assert "233.1.1.1" not in index
+        session.commit()
+        assert "233.1.1.1" in index
+        ban.active = False
+        session.commit()
+        assert "233.1.1.1" not in index
+        session.add(Ban("9.9.9.9", 32))
+        session.flush()
+        session.rollback()
+        assert "9.9.9.9" not in index
+        indexed = len(index)
+        session.add(Ban("listen.hub.tld", 8))
+        session.commit()
+        assert len(index) == indexed
+        session.close()
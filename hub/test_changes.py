@@ -0,0 +1,103 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_changes.py - test following committed model changes
+"""
+
+from changes import follow
+from model import Ban
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+    # addresses of bans applied so far
+    applied = []
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    url = config.getvalue("database")
+    Global.engine = create_engine(url)
+    if url.startswith("sqlite"):
+        # pysqlite gets savepoints wrong unless we begin ourselves
+        @event.listens_for(Global.engine, 'connect')
+        def connect(connection, _record):
+            connection.isolation_level = None
+        @event.listens_for(Global.engine, 'begin')
+        def begin(connection):
+            connection.execute("BEGIN")
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+    follow(Global.Session, 'test_changes', collect, Global.applied.append)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+def collect(obj, deleted):
+    """
+    Address of bans that were added or changed.
+    """
+    if isinstance(obj, Ban) and not deleted:
+        return obj.address
+    return None
+
+
+class TestFollow(object):
+    """
+    Changes are applied once committed, and only then.
+    """
+    def test0_commit(self):
+        session = Global.Session()
+        session.add(Ban("10.0.0.1", 32))
+        session.flush()
+        assert Global.applied == []
+        session.commit()
+        assert Global.applied == ["10.0.0.1"]
+        session.add(Ban("10.0.0.2", 32))
+        session.flush()
+        session.rollback()
+        assert Global.applied == ["10.0.0.1"]
+        session.close()
+        del Global.applied[:]
+
+    def test1_savepoints(self):
+        session = Global.Session()
+        session.add(Ban("10.1.0.1", 32))
+        session.flush()
+        savepoint = session.begin_nested()
+        session.add(Ban("10.1.0.2", 32))
+        session.flush()
+        savepoint.rollback()
+        savepoint = session.begin_nested()
+        session.add(Ban("10.1.0.3", 32))
+        savepoint.commit()
+        assert Global.applied == []
+        session.commit()
+        assert Global.applied == ["10.1.0.1", "10.1.0.3"]
+        savepoint = session.begin_nested()
+        session.add(Ban("10.1.0.4", 32))
+        savepoint.commit()
+        session.rollback()
+        assert Global.applied == ["10.1.0.1", "10.1.0.3"]
+        session.close()
+        del Global.applied[:]
@@ -0,0 +1,168 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_credentials.py - test the in-memory credential index
+"""
+
+from datetime import datetime, timedelta
+
+from credentials import CredentialIndex, UsageWriter, password_hash
+from model import GameAdmin, User
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from sqlalchemy.pool import StaticPool
+    from py.test import config
+    url = config.getvalue("database")
+    if url == "sqlite:///":
+        # the usage writer's thread has to see the same database
+        Global.engine = create_engine(
+            url, poolclass=StaticPool,
+            connect_args={'check_same_thread': False})
+    else:
+        Global.engine = create_engine(url)
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+def add_admin(session, login, activated, address, guid, password):
+    """
+    Add a user with one game admin, return both.
+    """
+    user = User(login, "secret", login, "%s@alphahub.tld" % login,
+                activated, False)
+    admin = GameAdmin(address, guid, password)
+    admin.user = user
+    session.add(user)
+    session.add(admin)
+    return user, admin
+
+
+class TestIndex(object):
+    """
+    Index without database.
+    """
+    def test0_lookup(self):
+        index = CredentialIndex()
+        index.add_user(1, "mad", True, False)
+        index.add_admin(1, "5.3.1.9", "MAD"*10+"MA", password_hash("untz"), 1)
+        index.add_admin(2, "5.3.1.9", "MAD"*10+"MA", password_hash("other"), 1)
+        assert len(index) == 2
+        assert index.lookup("5.3.1.9", "MAD"*10+"MA", "untz") == (1, "mad")
+        assert index.lookup("5.3.1.9", "MAD"*10+"MA", "other") == (2, "mad")
+        assert index.lookup("5.3.1.9", "MAD"*10+"MA", "wrong") is None
+        assert index.lookup("5.3.1.8", "MAD"*10+"MA", "untz") is None
+        assert index.lookup("5.3.1.9", "SAD"*10+"SA", "untz") is None
+
+    def test1_users(self):
+        index = CredentialIndex()
+        index.add_admin(1, "5.3.1.9", "G"*32, password_hash("untz"), 1)
+        assert index.lookup("5.3.1.9", "G"*32, "untz") is None
+        index.add_user(1, "mad", False, False)
+        assert index.lookup("5.3.1.9", "G"*32, "untz") is None
+        index.add_user(1, "mad", True, True)
+        assert index.lookup("5.3.1.9", "G"*32, "untz") is None
+        index.add_user(1, "mad", True, False)
+        assert index.lookup("5.3.1.9", "G"*32, "untz") == (1, "mad")
+        index.remove_admin(1)
+        index.remove_admin(1)
+        assert len(index) == 0
+        assert index.lookup("5.3.1.9", "G"*32, "untz") is None
+
+
+class TestDatabase(object):
+    """
+    Index built from and kept current with the database.
+    """
+    def test0_load(self):
+        session = Global.Session()
+        add_admin(session, "cred0", True, "1.2.3.4", "A"*32, "untz")
+        add_admin(session, "cred1", False, "1.2.3.5", "B"*32, "untz")
+        session.commit()
+        index = CredentialIndex()
+        index.load(session)
+        assert len(index) == 2
+        assert index.lookup("1.2.3.4", "A"*32, "untz")[1] == "cred0"
+        assert index.lookup("1.2.3.5", "B"*32, "untz") is None
+        session.close()
+
+    def test1_listen(self):
+        index = CredentialIndex()
+        index.listen(Global.Session)
+        session = Global.Session()
+        index.load(session)
+        user, admin = add_admin(session, "cred2", True, "1.2.3.6", "C"*32,
+                                "untz")
+        session.flush()
+        assert index.lookup("1.2.3.6", "C"*32, "untz") is None
+        session.commit()
+        assert index.lookup("1.2.3.6", "C"*32, "untz") == (admin.id, "cred2")
+        user.disabled = True
+        session.commit()
+        assert index.lookup("1.2.3.6", "C"*32, "untz") is None
+        user.disabled = False
+        admin.address = "1.2.3.7"
+        session.commit()
+        assert index.lookup("1.2.3.6", "C"*32, "untz") is None
+        assert index.lookup("1.2.3.7", "C"*32, "untz") == (admin.id, "cred2")
+        session.delete(user)
+        session.commit()
+        assert index.lookup("1.2.3.7", "C"*32, "untz") is None
+        add_admin(session, "cred3", True, "1.2.3.8", "D"*32, "untz")
+        session.flush()
+        session.rollback()
+        assert index.lookup("1.2.3.8", "D"*32, "untz") is None
+        session.close()
+
+    def test2_usage(self):
+        session = Global.Session()
+        _user, admin = add_admin(session, "cred4", True, "1.2.3.9", "E"*32,
+                                 "untz")
+        session.commit()
+        admin_id = admin.id
+        usage = UsageWriter(Global.engine, 0.01)
+        index = CredentialIndex(usage)
+        index.load(session)
+        first = datetime(2011, 1, 1, 12, 0, 0)
+        last = first + timedelta(minutes=5)
+        assert index.authorize("1.2.3.9", "E"*32, "untz", last) is not None
+        assert index.authorize("1.2.3.9", "E"*32, "untz", first) is not None
+        assert index.authorize("1.2.3.9", "E"*32, "wrong", last) is None
+        usage.close()
+        assert usage.stats()['recorded'] == 2
+        assert usage.stats()['written'] == 1
+        session.expire_all()
+        admin = session.query(GameAdmin).filter(GameAdmin.id==admin_id).one()
+        assert (admin.first, admin.last) == (first, last)
+        usage = UsageWriter(Global.engine, 0.01)
+        usage.record(admin_id, first + timedelta(minutes=1))
+        usage.close()
+        session.expire_all()
+        assert (admin.first, admin.last) == (first, last)
+        session.close()
@@ -0,0 +1,133 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_ingest.py - test bulk writes of player sightings
+"""
+
+from datetime import datetime, timedelta
+
+from ingest import record_players, update_or_insert_players, merge_sightings
+from model import Player
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+def players(name):
+    """
+    All players with the given name, as (address, first, last).
+    """
+    session = Global.Session()
+    found = sorted(
+        (player.address, player.first, player.last)
+        for player in session.query(Player).filter_by(name=name)
+    )
+    session.close()
+    return found
+
+
+class TestRecord(object):
+    """
+    Recording sightings, with upserts if the database has them.
+    """
+    def test0_insert(self):
+        when = datetime(2011, 1, 1, 12, 0, 0)
+        with Global.engine.begin() as connection:
+            count = record_players(connection, [
+                ("ingest0", "1.2.3.4", "0"*32, "5.6.7.8:27960"),
+                ("ingest0", "1.2.3.5", "0"*32, "5.6.7.8:27960"),
+            ], when)
+        assert count == 2
+        assert players("ingest0") == [
+            ("1.2.3.4", when, when), ("1.2.3.5", when, when)
+        ]
+
+    def test1_update(self):
+        first = datetime(2011, 1, 1, 12, 0, 0)
+        last = first + timedelta(minutes=5)
+        with Global.engine.begin() as connection:
+            count = record_players(connection, [
+                ("ingest0", "1.2.3.4", "0"*32, "5.6.7.8:27960"),
+                ("ingest0", "1.2.3.6", "0"*32, "5.6.7.8:27960"),
+            ], last)
+        assert count == 2
+        assert players("ingest0") == [
+            ("1.2.3.4", first, last),
+            ("1.2.3.5", first, first),
+            ("1.2.3.6", last, last),
+        ]
+
+    def test2_duplicates(self):
+        when = datetime(2011, 1, 2, 12, 0, 0)
+        sighting = ("ingest2", "1.2.3.4", "0"*32, "5.6.7.8:27960")
+        with Global.engine.begin() as connection:
+            assert record_players(connection, [sighting]*3, when) == 1
+            assert record_players(connection, [], when) == 0
+        assert players("ingest2") == [("1.2.3.4", when, when)]
+
+    def test3_packed(self):
+        with Global.engine.begin() as connection:
+            record_players(connection, [
+                ("ingest3", "1.2.3.4", "0"*32, "5.6.7.8:27960"),
+            ])
+        session = Global.Session()
+        player = session.query(Player).filter_by(name="ingest3").one()
+        assert player.address_packed == "00000000000000000000ffff01020304"
+        assert player.server_packed == "00000000000000000000ffff05060708"
+        session.close()
+
+    def test4_rollback(self):
+        connection = Global.engine.connect()
+        transaction = connection.begin()
+        record_players(connection, [
+            ("ingest4", "1.2.3.4", "0"*32, "5.6.7.8:27960"),
+        ])
+        transaction.rollback()
+        connection.close()
+        assert players("ingest4") == []
+
+
+class TestFallback(object):
+    """
+    Recording sightings without upserts.
+    """
+    def test0_insert_update(self):
+        first = datetime(2011, 1, 3, 12, 0, 0)
+        last = first + timedelta(minutes=5)
+        sighting = ("fallback0", "1.2.3.4", "0"*32, "5.6.7.8:27960")
+        with Global.engine.begin() as connection:
+            update_or_insert_players(connection,
+                                     merge_sightings([sighting], first))
+            update_or_insert_players(connection,
+                                     merge_sightings([sighting], last))
+        assert players("fallback0") == [("1.2.3.4", first, last)]
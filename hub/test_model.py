@@ -20,6 +20,7 @@ test_model.py - test the data model
 """
 
 from datetime import datetime
+from address import pack
 from model import Ban, GameAdmin, Player, Server, User
 
 
@@ -132,6 +133,8 @@ class TestPlayers(object):
         assert player.address == address
         assert player.guid == guid
         assert player.server == server
+        assert player.address_packed == pack(address)
+        assert player.server_packed == pack(server.split(":")[0])
         assert player.first is None or isinstance(player.first, datetime)
         assert player.last is None or isinstance(player.last, datetime)
         assert player.first <= player.last
@@ -283,6 +286,7 @@ class TestGameAdmins(object):
         assert gameadmin.id == id
         assert gameadmin.address == address
         assert gameadmin.guid == guid
+        assert gameadmin.address_packed == pack(address)
         assert gameadmin.password == sha256(password).hexdigest()
         assert gameadmin.created < datetime.utcnow()
         assert gameadmin.first is None or isinstance(user.first, datetime)
@@ -371,6 +375,7 @@ class TestBans(object):
         assert ban.address == address
         assert ban.cidr == cidr
         assert ban.active == active
+        assert ban.start <= pack(address) <= ban.end
 
     def test0_insert(self):
         bans = [
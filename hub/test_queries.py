@@ -0,0 +1,122 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_queries.py - test the read-side queries
+"""
+
+from datetime import datetime, timedelta
+
+from ingest import record_players
+from model import Ban
+from queries import ban_list, player_detail, player_list
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+    # 50 players, five of them seen at each of ten times
+    start = datetime(2011, 2, 1, 12, 0, 0)
+    with Global.engine.begin() as connection:
+        for minute in range(10):
+            record_players(connection, [
+                ("query%s" % (minute % 2), "1.2.3.%s" % i, "0"*32,
+                 "5.6.7.8:27960")
+                for i in range(minute*5, minute*5+5)
+            ], start + timedelta(minutes=minute))
+    session = Global.Session()
+    for i in range(25):
+        session.add(Ban("10.9.%s.0" % i, 24, i % 5 != 0))
+    session.commit()
+    session.close()
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    Base.metadata.drop_all(Global.engine)
+
+def pages(fetch, **kwargs):
+    """
+    All pages fetch() gives us, following the keys.
+    """
+    found = []
+    page = fetch(Global.engine, **kwargs)
+    found.append(page)
+    while page.after is not None:
+        page = fetch(Global.engine, after=page.after, **kwargs)
+        found.append(page)
+    return found
+
+
+class TestPlayers(object):
+    """
+    Player list and details.
+    """
+    def test0_pages(self):
+        found = pages(player_list, limit=7)
+        assert [len(page) for page in found] == [7]*7 + [1]
+        rows = [row for page in found for row in page]
+        keys = [(row.last, row.id) for row in rows]
+        assert keys == sorted(keys, reverse=True)
+        assert len(set(row.id for row in rows)) == 50
+
+    def test1_exact(self):
+        found = pages(player_list, limit=10)
+        assert [len(page) for page in found] == [10]*5
+        assert found[-1].after is None
+
+    def test2_name(self):
+        found = pages(player_list, limit=4, name="query1")
+        rows = [row for page in found for row in page]
+        assert len(rows) == 25
+        assert set(row.name for row in rows) == set(["query1"])
+
+    def test3_columns(self):
+        page = player_list(Global.engine, limit=1, columns=('name',))
+        assert page.rows[0].keys() == ['name', 'last', 'id']
+
+    def test4_detail(self):
+        row = player_list(Global.engine, limit=1).rows[0]
+        detail = player_detail(Global.engine, row.id)
+        assert (detail.name, detail.guid) == (row.name, "0"*32)
+        assert player_detail(Global.engine, -1) is None
+
+
+class TestBans(object):
+    """
+    Ban list.
+    """
+    def test0_pages(self):
+        found = pages(ban_list, limit=10)
+        assert [len(page) for page in found] == [10, 10, 5]
+        ids = [row.id for page in found for row in page]
+        assert ids == sorted(ids, reverse=True)
+
+    def test1_active(self):
+        rows = [row for page in pages(ban_list, limit=3, active=False)
+                for row in page]
+        assert len(rows) == 5
+        assert not any(row.active for row in rows)
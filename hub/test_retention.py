@@ -0,0 +1,147 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_retention.py - test rolling players over into archives
+"""
+
+from datetime import datetime, timedelta
+
+from ingest import record_players
+from queries import player_detail, player_list
+from retention import archives, drop_archives, rollover
+
+
+class Global(object):
+    """
+    Global state for tests.
+    """
+    # factory class for sessions
+    Session = None
+    # engine we are connected to
+    engine = None
+    # when the tests run, as far as rollover() knows
+    now = datetime(2011, 4, 15, 12, 0, 0)
+
+
+def setup_module():
+    """
+    Prepare the test database.
+    """
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from model import Base
+    from py.test import config
+    Global.engine = create_engine(config.getvalue("database"))
+    Base.metadata.create_all(Global.engine)
+    Global.Session = sessionmaker(bind=Global.engine)
+    # 4 players every 10 days going back 100 days, 40 in all
+    with Global.engine.begin() as connection:
+        for days in range(0, 100, 10):
+            record_players(connection, [
+                ("retention%s" % i, "1.2.%s.%s" % (days, i), "0"*32,
+                 "5.6.7.8:27960")
+                for i in range(4)
+            ], Global.now - timedelta(days=days, minutes=1))
+
+def teardown_module():
+    """
+    Clean up the test database.
+    """
+    from model import Base
+    from py.test import config
+    if config.getvalue("nodrop"):
+        return
+    drop_archives(Global.engine)
+    Base.metadata.drop_all(Global.engine)
+
+def hot():
+    """
+    Number of players in the hot table.
+    """
+    from model import Player
+    session = Global.Session()
+    count = session.query(Player).count()
+    session.close()
+    return count
+
+
+class TestRollover(object):
+    """
+    Moving players into archives and finding them there.
+    """
+    def test0_rollover(self):
+        assert rollover(Global.engine, 30, Global.now) == 28
+        assert hot() == 12
+        found = archives(Global.engine)
+        assert [start for _, start, _ in found] == [
+            datetime(2011, 3, 1), datetime(2011, 2, 1), datetime(2011, 1, 1)
+        ]
+        assert rollover(Global.engine, 30, Global.now) == 0
+
+    def test1_list(self):
+        found = archives(Global.engine)
+        assert len(player_list(Global.engine, limit=100).rows) == 12
+        rows = []
+        page = player_list(Global.engine, limit=7, archives=found)
+        rows.extend(page)
+        while page.after is not None:
+            page = player_list(Global.engine, after=page.after, limit=7,
+                               archives=found)
+            rows.extend(page)
+        keys = [(row.last, row.id) for row in rows]
+        assert len(keys) == 40
+        assert keys == sorted(set(keys), reverse=True)
+        page = player_list(Global.engine, limit=100, name="retention1",
+                           archives=found)
+        assert len(page) == 10
+
+    def test2_detail(self):
+        found = archives(Global.engine)
+        page = player_list(Global.engine, limit=40, archives=found)
+        oldest = page.rows[-1]
+        assert player_detail(Global.engine, oldest.id) is None
+        detail = player_detail(Global.engine, oldest.id, archives=found)
+        assert (detail.name, detail.last) == (oldest.name, oldest.last)
+
+    def test3_seen_again(self):
+        with Global.engine.begin() as connection:
+            record_players(connection, [
+                ("retention0", "1.2.90.0", "0"*32, "5.6.7.8:27960"),
+            ], Global.now)
+        assert hot() == 13
+        page = player_list(Global.engine, limit=100, name="retention0",
+                           archives=archives(Global.engine))
+        assert len(page) == 11
+        assert page.rows[0].last == Global.now
+
+    def test4_gaps(self):
+        with Global.engine.begin() as connection:
+            for when in [datetime(2005, 6, 1), datetime(2008, 2, 29)]:
+                record_players(connection, [
+                    ("retention%s" % when.year, "1.3.0.1", "0"*32,
+                     "5.6.7.8:27960"),
+                ], when)
+        assert rollover(Global.engine, 30, Global.now) == 2
+        assert [start for _, start, _ in archives(Global.engine)] == [
+            datetime(2011, 3, 1), datetime(2011, 2, 1), datetime(2011, 1, 1),
+            datetime(2008, 2, 1), datetime(2005, 6, 1)
+        ]
+
+    def test5_ids(self):
+        found = archives(Global.engine)
+        page = player_list(Global.engine, limit=100, archives=found)
+        newest = max(row.id for row in page)
+        rollover(Global.engine, 0, Global.now + timedelta(days=1))
+        assert hot() == 0
+        with Global.engine.begin() as connection:
+            record_players(connection, [
+                ("retention_new", "1.4.0.1", "0"*32, "5.6.7.8:27960"),
+            ], Global.now + timedelta(days=1))
+        found = archives(Global.engine)
+        page = player_list(Global.engine, limit=100, archives=found)
+        ids = [row.id for row in page]
+        assert len(ids) == len(set(ids))
+        assert max(ids) > newest
+        detail = player_detail(Global.engine, max(ids), archives=found)
+        assert detail.name == "retention_new"
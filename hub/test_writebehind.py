@@ -0,0 +1,110 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+test_writebehind.py - test the write-behind base class
+"""
+
+import threading
+
+from writebehind import WriteBehind
+
+
+class Collector(WriteBehind):
+    """
+    Write-behind stage that writes into a list, or fails if
+    told to.
+    """
+    def __init__(self, flush_size=None, flush_time=60.0):
+        self.written = []
+        self.fail = False
+        self.opened = 0
+        self.closed = 0
+        self.wrote = threading.Event()
+        super(Collector, self).__init__(flush_size, flush_time)
+
+    def add(self, *items):
+        with self._cond:
+            self._pending().extend(items)
+            self._added()
+
+    def _open(self):
+        self.opened += 1
+        return self.written
+
+    def _write(self, written, pending):
+        self.wrote.set()
+        if self.fail:
+            raise IOError("disk full")
+        written.append(pending)
+
+    def _close(self, written):
+        self.closed += 1
+
+
+def test_close_writes_pending():
+    """
+    Closing writes what's pending, in one batch.
+    """
+    stage = Collector()
+    stage.add(1, 2)
+    stage.add(3)
+    assert stage.stats()['depth'] == 3
+    stage.close()
+    assert stage.written == [[1, 2, 3]]
+    assert stage.opened == 1
+    assert stage.closed == 1
+    stats = stage.stats()
+    assert stats['depth'] == 0
+    assert stats['flushes'] == 1
+    assert stats['written'] == 3
+    assert stats['failures'] == 0
+
+def test_flush_size():
+    """
+    A full batch is written right away.
+    """
+    stage = Collector(flush_size=3)
+    stage.add(1, 2)
+    stage.add(3, 4)
+    assert stage.wrote.wait(5.0)
+    stage.close()
+    assert stage.written == [[1, 2, 3, 4]]
+
+def test_flush_time():
+    """
+    A batch is written once its first item waited flush_time.
+    """
+    stage = Collector(flush_time=0.01)
+    stage.add(1)
+    assert stage.wrote.wait(5.0)
+    stage.add(2)
+    stage.close()
+    assert stage.written == [[1], [2]]
+
+def test_failures():
+    """
+    A failed batch is counted and lost.
+    """
+    stage = Collector()
+    stage.fail = True
+    stage.add(1)
+    stage.close()
+    stats = stage.stats()
+    assert stage.written == []
+    assert stats['failures'] == 1
+    assert stats['flushes'] == 0
+    assert stage.closed == 1
+
+def test_abstract():
+    """
+    A stage that doesn't say how to write can't be created.
+    """
+    class Mute(WriteBehind):
+        pass
+    try:
+        Mute()
+    except TypeError:
+        pass
+    else:
+        assert False
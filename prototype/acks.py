@@ -0,0 +1,104 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Batched acknowledgements for failover entries.
+
+A hub used to acknowledge each failover entry it got with its
+own packet, and the failover hub deleted each of them with its
+own DELETE and commit. When the primary hub comes back after an
+outage that's thousands of transactions in a row. Instead a hub
+now acknowledges many entries at once, as comma-separated rowids
+and rowid ranges in one signed packet:
+
+    got failover players
+    1-5,7,9-12
+
+(The old "got failover player" packet with a single rowid is
+still understood.) On our side the AckCollector gathers the
+acknowledged ranges and deletes them in one transaction per
+flush.
+"""
+
+import logging as L
+
+import writebehind as WRITEBEHIND
+
+KIND = 'got failover players'
+
+def parse_ranges(text):
+    """
+    Parse "1-5,7" into a list of (first, last) rowid ranges;
+    raises ValueError for anything that doesn't look like that.
+    """
+    ranges = []
+    for part in text.strip().split(','):
+        first, dash, last = part.partition('-')
+        first = int(first)
+        last = int(last) if dash else first
+        if not 0 < first <= last:
+            raise ValueError("bad rowid range %r" % part)
+        ranges.append((first, last))
+    return ranges
+
+def merge_ranges(ranges):
+    """Sorted list of ranges with overlapping and adjacent ones merged."""
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1]+1:
+            if last > merged[-1][1]:
+                merged[-1] = (merged[-1][0], last)
+        else:
+            merged.append((first, last))
+    return merged
+
+def format_ranges(rowids):
+    """Format rowids compactly for an acknowledgement, "1-5,7" style."""
+    return ','.join(str(first) if first == last else '%s-%s' % (first, last)
+                    for first, last in merge_ranges((r, r) for r in rowids))
+
+class AckCollector(WRITEBEHIND.WriteBehind):
+    """
+    Write-behind stage for acknowledgements.
+
+    A background thread with its own store deletes the
+    acknowledged entries; add() never touches the store itself.
+    """
+
+    def __init__(self, open_store, flush_size=1024, flush_time=1.0):
+        """
+        Initialize and start a new collector.
+
+        The open_store callable is used by the background thread
+        to get a store with delete(ranges) and close() methods.
+        Ranges are deleted as soon as flush_size of them are
+        waiting, but no later than flush_time seconds after the
+        first of them arrived.
+        """
+        assert callable(open_store)
+        self.__open_store = open_store
+        # counters, read them through stats()
+        self.__acked = 0
+        super(AckCollector, self).__init__(flush_size, flush_time)
+
+    def add(self, ranges):
+        """Remember acknowledged rowid ranges, delete them later."""
+        with self._cond:
+            self.__acked += len(ranges)
+            self._pending().extend(ranges)
+            self._added()
+
+    def _counters(self):
+        return {'acked': self.__acked}
+
+    def _open(self):
+        return self.__open_store()
+
+    def _write(self, store, pending):
+        """Delete acknowledged ranges in one transaction."""
+        ranges = merge_ranges(pending)
+        store.delete(ranges)
+        L.debug("deleted %s acknowledged range(s)", len(ranges))
+
+    def _close(self, store):
+        store.close()
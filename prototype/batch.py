@@ -0,0 +1,81 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Batched packet receiving.
+
+During map changes game servers send lots of packets at once,
+and going back to select() after each one of them costs a
+pair of system calls per packet. Instead we drain a ready
+socket until it has nothing left (or we have enough) and hand
+everything we got downstream in one go.
+
+The batch size histogram tells us how full our batches are;
+if most of them hit the limit, the limit is probably too low.
+"""
+
+import errno as E
+import logging as L
+import socket as S
+import threading as T
+import time as TIME
+
+def drain(sock, limit):
+    """
+    Receive up to limit packets from non-blocking socket sock
+    without waiting; returns a (possibly empty) list of
+    (packet, host, port) tuples.
+    """
+    batch = []
+    while len(batch) < limit:
+        try:
+            packet, (host, port) = sock.recvfrom(4096)
+        except S.error as exc:
+            if exc.args[0] in (E.EAGAIN, E.EWOULDBLOCK):
+                break
+            raise
+        batch.append((packet, host, port))
+    return batch
+
+class Histogram(object):
+    """
+    Histogram of batch sizes in power-of-two buckets.
+
+    Bucket 0 counts empty batches, bucket i counts batches of
+    2**(i-1) up to 2**i-1 packets.
+    """
+
+    def __init__(self, limit, interval=60):
+        """
+        Initialize for batches of at most limit packets; log
+        the histogram every interval seconds from report().
+        """
+        assert limit > 0
+        self.__lock = T.Lock()
+        self.__counts = [0] * (limit.bit_length()+1)
+        self.__interval = interval
+        self.__reported = TIME.time()
+
+    def add(self, size):
+        """Count a batch of size packets."""
+        with self.__lock:
+            self.__counts[size.bit_length()] += 1
+
+    def snapshot(self):
+        """List of (label, count) tuples, one per bucket."""
+        with self.__lock:
+            counts = list(self.__counts)
+        labels = ["0", "1"] + ["%s-%s" % (2**(i-1), 2**i-1)
+                               for i in range(2, len(counts))]
+        return zip(labels, counts)
+
+    def report(self, name="batch sizes"):
+        """Log the histogram if interval seconds passed since last time."""
+        now = TIME.time()
+        if now - self.__reported < self.__interval:
+            return
+        self.__reported = now
+        L.info("%s: %s", name, str(self))
+
+    def __str__(self):
+        return ", ".join("%s: %s" % pair for pair in self.snapshot())
@@ -0,0 +1,283 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Micro-benchmark suite for the hot paths of the hub.
+
+Times userinfo parsing, checksum verification, the player and
+gossip writes, thread pool dispatch, metrics counters, failover
+packet writes, and ORM inserts of the model in ../hub, each in
+microseconds per operation (best of a few runs).
+
+Like the tests in ../hub the suite takes a --database URL,
+default "sqlite:///" (in memory). The ORM benchmarks use it as
+is and drop their tables when they're done, like the tests. The
+prototype only speaks SQLite, its benchmarks use a file next to
+the database ("-prototype" appended, SQLite table names ignore
+case so prototype and model tables can't share a file) and are
+skipped for other databases. Use scratch databases!
+
+Results can be saved as a baseline and later runs compared to
+it; a benchmark that got slower than the threshold allows is
+a regression, and we exit with status 1 if there are any:
+
+    python bench.py --save                # record baseline
+    python bench.py --compare             # check against it
+    python bench.py --compare --threshold 0.25 \\
+        --database sqlite:////tmp/scratch.db
+
+Run it from the prototype directory.
+"""
+
+import json as JSON
+import logging as L
+import optparse as OPT
+import os as OS
+import sys as SYS
+import threading as T
+import time as TIME
+
+import bench_parse as BENCH_PARSE
+import failover as FAILOVER
+import hub as HUB
+import metrics as METRICS
+import packet as PACKET
+import pool as POOL
+import verify as VERIFY
+
+SYS.path.append(OS.path.join(OS.path.dirname(OS.path.abspath(__file__)),
+                             OS.pardir, 'hub'))
+
+BENCHMARKS = []
+# called when all benchmarks are done
+CLEANUP = []
+
+class Skip(Exception):
+    """Benchmark can't run here, the message says why."""
+
+def benchmark(name, count):
+    """
+    Register a benchmark: a function that gets the options and
+    returns a function doing count operations.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, count, setup))
+        return setup
+    return register
+
+def measure(run, count, repeat):
+    """Microseconds per operation, best of repeat runs of run(count)."""
+    best = None
+    for _ in range(repeat):
+        start = TIME.time()
+        run(count)
+        elapsed = TIME.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+def sqlite_path(url):
+    """SQLite database for a database URL, Skip for other databases."""
+    if not url.startswith('sqlite://'):
+        raise Skip("prototype only supports SQLite")
+    path = url[len('sqlite:///'):]
+    return path+'-prototype' if path else ':memory:'
+
+def sqlite_connect(opts, open_database, create_tables):
+    """Open and set up the prototype database for opts."""
+    conn = open_database({'database': sqlite_path(opts.database)})
+    create_tables(conn)
+    CLEANUP.append(conn.close)
+    return conn
+
+@benchmark("parse_userinfo (legacy split)", 20000)
+def bench_parse_userinfo(_opts):
+    def run(count):
+        for _ in xrange(count):
+            BENCH_PARSE.parse_userinfo(BENCH_PARSE.USERINFO)
+    return run
+
+@benchmark("packet.scan userinfo", 20000)
+def bench_scan(_opts):
+    def run(count):
+        for _ in xrange(count):
+            PACKET.scan(BENCH_PARSE.USERINFO, 0, HUB.USERINFO_KEYS)
+    return run
+
+@benchmark("verify.Verifier.check", 20000)
+def bench_check(_opts):
+    try:
+        verifier = VERIFY.Verifier("somesecret")
+    except ValueError as exc:
+        raise Skip(str(exc))
+    payload = BENCH_PARSE.PACKET_DATA[len(PACKET.HEADER)+PACKET.DIGEST+1:]
+    digest = verifier.digest(payload)
+    view = memoryview(payload)
+    def run(count):
+        for _ in xrange(count):
+            verifier.check(digest, view)
+    return run
+
+@benchmark("hub.write_player", 2000)
+def bench_write_player(opts):
+    conn = sqlite_connect(opts, HUB.open_database, HUB.create_tables)
+    def run(count):
+        for i in xrange(count):
+            # half of them are repeat sightings
+            HUB.write_player(conn, "bench%s" % (i//2), "10.0.0.1",
+                             "0"*32, "127.0.0.1", "27960")
+    return run
+
+@benchmark("hub.write_gossip", 2000)
+def bench_write_gossip(opts):
+    conn = sqlite_connect(opts, HUB.open_database, HUB.create_tables)
+    def run(count):
+        for i in xrange(count):
+            HUB.write_gossip(conn, "bench%s" % (i//2), "10.0.0.1",
+                             "0"*32, "127.0.0.1", "27960", "127.0.0.2:9533")
+    return run
+
+@benchmark("pool.ThreadPool.add (and run)", 20000)
+def bench_pool_add(_opts):
+    done = T.Semaphore(0)
+    pool = POOL.ThreadPool(max_tasks=20000)
+    def run(count):
+        for _ in xrange(count):
+            pool.add(done.release)
+        for _ in xrange(count):
+            done.acquire()
+    return run
+
+@benchmark("metrics.Counter.inc", 200000)
+def bench_counter_inc(_opts):
+    counter = METRICS.REGISTRY.counter(
+        'bench_total', "Benchmark counter.", ('label',)).labels('value')
+    def run(count):
+        for _ in xrange(count):
+            counter.inc()
+    return run
+
+@benchmark("failover.write_packet", 2000)
+def bench_write_packet(opts):
+    conn = sqlite_connect(opts, FAILOVER.open_database,
+                          FAILOVER.create_tables)
+    def run(count):
+        for _ in xrange(count):
+            FAILOVER.write_packet(conn, "127.0.0.1", "27960",
+                                  BENCH_PARSE.PACKET_DATA)
+    return run
+
+def orm_session(opts):
+    """Session for the model in ../hub, Skip without SQLAlchemy."""
+    try:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from model import Base
+    except ImportError as exc:
+        raise Skip(str(exc))
+    engine = create_engine(opts.database)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    CLEANUP.append(lambda: (session.close(), Base.metadata.drop_all(engine)))
+    return session
+
+def orm_run(session, make):
+    """Insert count objects from make(), committing every 100."""
+    serial = [0]
+    def run(count):
+        for _ in xrange(count):
+            serial[0] += 1
+            session.add(make(serial[0]))
+            if serial[0] % 100 == 0:
+                session.commit()
+        session.commit()
+    return run
+
+@benchmark("model.Player insert (ORM)", 2000)
+def bench_orm_player(opts):
+    session = orm_session(opts)
+    from model import Player
+    return orm_run(session, lambda i: Player(
+        "bench%s" % i, "10.0.0.1", "0"*32, "127.0.0.1:27960"))
+
+@benchmark("model.Ban insert (ORM)", 2000)
+def bench_orm_ban(opts):
+    session = orm_session(opts)
+    from model import Ban
+    return orm_run(session, lambda i: Ban(
+        "10.%s.%s.%s" % (i >> 16 & 255, i >> 8 & 255, i & 255), 32))
+
+def run_all(opts):
+    """Run all benchmarks, return {name: usec} and {name: reason}."""
+    results = {}
+    skipped = {}
+    for name, count, setup in BENCHMARKS:
+        try:
+            results[name] = measure(setup(opts), count, opts.repeat)
+        except Skip as exc:
+            skipped[name] = str(exc)
+    for cleanup in CLEANUP:
+        cleanup()
+    return results, skipped
+
+def compare(results, baseline, threshold):
+    """
+    Rows of (name, usec, baseline usec, change, regressed) for
+    all results.
+    """
+    rows = []
+    for name, _, _ in BENCHMARKS:
+        if name not in results:
+            continue
+        base = baseline.get(name)
+        change = results[name]/base - 1 if base else None
+        rows.append((name, results[name], base, change,
+                     change is not None and change > threshold))
+    return rows
+
+def main():
+    """Run the suite, save or compare the baseline."""
+    parser = OPT.OptionParser()
+    parser.add_option('--database', default='sqlite:///',
+                      help="database URL [%default]")
+    parser.add_option('--baseline', default='bench_baseline.json',
+                      help="baseline file [%default]")
+    parser.add_option('--save', action='store_true', default=False,
+                      help="save results as the baseline")
+    parser.add_option('--compare', action='store_true', default=False,
+                      help="compare results to the baseline")
+    parser.add_option('--threshold', type='float', default=0.10,
+                      help="allowed slowdown, 0.10 is 10%% [%default]")
+    parser.add_option('--repeat', type='int', default=3,
+                      help="runs per benchmark, we take the best [%default]")
+    opts, _ = parser.parse_args()
+
+    baseline = {}
+    if opts.compare:
+        with open(opts.baseline) as baseline_file:
+            saved = JSON.load(baseline_file)
+        if saved['database'] != opts.database:
+            print "baseline was taken with %s" % saved['database']
+        baseline = saved['results']
+
+    results, skipped = run_all(opts)
+    rows = compare(results, baseline, opts.threshold)
+    print "%-32s %10s %10s %8s" % ("benchmark", "usec/op", "baseline", "change")
+    for name, usec, base, change, regressed in rows:
+        print "%-32s %10.2f %10s %8s%s" % (
+            name, usec, "%.2f" % base if base else "-",
+            "%+.1f%%" % (change*100) if change is not None else "-",
+            "  REGRESSION" if regressed else "")
+    for name, reason in sorted(skipped.iteritems()):
+        print "%-32s skipped: %s" % (name, reason)
+
+    if opts.save:
+        with open(opts.baseline, 'w') as baseline_file:
+            JSON.dump({'database': opts.database, 'results': results},
+                      baseline_file, indent=1, sort_keys=True)
+        print "saved baseline to %s" % opts.baseline
+    if any(row[4] for row in rows):
+        SYS.exit(1)
+
+if __name__ == "__main__":
+    L.basicConfig(level=L.WARNING)
+    main()
@@ -0,0 +1,87 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Micro-benchmark for userinfo parsing.
+
+Compares the split()-based parsing we used to do to the single
+pass parser in packet.py, for the userinfo string alone and for
+a whole userinfo packet (without checking the digest, hashing
+costs the same either way).
+
+Run it from the prototype directory:
+
+    python bench_parse.py [iterations]
+"""
+
+import sys as SYS
+import timeit as TIME
+
+import hub as HUB
+import packet as PACKET
+
+# a typical userinfo string from an ioq3 client
+USERINFO = (
+    "\\ip\\72.34.121.50:27960\\cg_predictItems\\1\\cl_anonymous\\0"
+    "\\cl_guid\\0123456789ABCDEF0123456789ABCDEF\\cg_rgb\\255 0 0"
+    "\\cg_physics\\1\\gear\\GLAAAAA\\racered\\0\\raceblue\\0"
+    "\\color\\4\\handicap\\100\\sex\\male\\cl_voip\\1"
+    "\\teamtask\\0\\snaps\\20\\rate\\25000\\model\\sarge"
+    "\\headmodel\\sarge\\team_model\\james\\team_headmodel\\*james"
+    "\\name\\|ALPHA| Mad Professor\\funred\\ninja,caplaser\\weapmodes\\0000"
+)
+PACKET_DATA = PACKET.HEADER + "0"*32 + "\nuserinfo\n" + USERINFO
+
+def parse_userinfo(userinfo):
+    """
+    Parse userinfo string into dictionary, the way hub.py did.
+    """
+    data = userinfo.split("\\")[1:]
+    assert len(data) % 2 == 0
+    keys = data[0::2]
+    values = data[1::2]
+    return dict(zip(keys, values))
+
+def split_packet(data):
+    """Take a userinfo packet apart, the way hub.py did."""
+    header, data = data[0:4], data[4:]
+    assert header == PACKET.HEADER
+    md4, data = data.split('\n', 1)
+    assert len(md4) == 32
+    kind, data = data.split('\n', 1)
+    assert kind == 'userinfo'
+    return md4, parse_userinfo(data)
+
+def scan_packet(data):
+    """Take a userinfo packet apart, the way hub.py does."""
+    md4, payload = PACKET.split(data, len(PACKET.HEADER))
+    body = PACKET.body(data, len(data)-len(payload), 'userinfo')
+    assert body > 0
+    return md4, PACKET.scan(data, body, HUB.USERINFO_KEYS)
+
+def measure(func, arg, iterations):
+    """Microseconds per call of func(arg)."""
+    timer = TIME.Timer(lambda: func(arg))
+    return min(timer.repeat(5, iterations)) / iterations * 1e6
+
+def main():
+    """Run all benchmarks and print a table."""
+    iterations = int(SYS.argv[1]) if len(SYS.argv) > 1 else 100000
+    scan = lambda userinfo: PACKET.scan(userinfo, 0, HUB.USERINFO_KEYS)
+    var = scan(USERINFO)
+    assert all(parse_userinfo(USERINFO)[key] == var[key] for key in var)
+    results = [
+        ("userinfo, parse_userinfo", measure(parse_userinfo, USERINFO,
+                                             iterations)),
+        ("userinfo, scan", measure(scan, USERINFO, iterations)),
+        ("packet, split", measure(split_packet, PACKET_DATA, iterations)),
+        ("packet, scan", measure(scan_packet, PACKET_DATA, iterations)),
+    ]
+    print "%s iterations, userinfo with %s keys" % (
+        iterations, len(parse_userinfo(USERINFO)))
+    print "%-26s %10s" % ("parser", "usec/call")
+    for name, usec in results:
+        print "%-26s %10.2f" % (name, usec)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Benchmark for the player and gossip write paths.
+
+Compares the old write path (SELECT, then INSERT or a fake
+UPDATE, with triggers maintaining "first", "last" and "count")
+to the single upsert statement in hub.py. For both we count
+the SQL statements each packet costs and time the writes.
+
+Statements issued by Python are counted directly. Triggers
+can't be observed through the sqlite3 module, but each of
+the old triggers is a single UPDATE of a single row, so the
+rows a statement changed beyond its own rowcount tell us how
+many trigger statements it ran; total_changes includes the
+changes made by triggers.
+
+Run it from the prototype directory:
+
+    python bench_upsert.py [packets [duplicate ratio]]
+"""
+
+import logging as L
+import os as OS
+import random as R
+import sqlite3 as SQL
+import sys as SYS
+import tempfile as TEMP
+import time as TIME
+
+import hub as HUB
+
+# the schema and write path before we switched to upserts
+LEGACY_SQL = """
+CREATE TABLE Players (
+    ip VARCHAR NOT NULL, name VARCHAR NOT NULL, guid VARCHAR NOT NULL,
+    server VARCHAR NOT NULL, port VARCHAR NOT NULL,
+    first TIMESTAMP DEFAULT NULL, last TIMESTAMP DEFAULT NULL,
+    PRIMARY KEY (ip, name, guid, server, port)
+);
+CREATE TRIGGER insertPlayer AFTER INSERT ON Players
+BEGIN
+  UPDATE Players SET first = datetime("now"), last = datetime("now")
+    WHERE rowid = new.rowid;
+END;
+CREATE TRIGGER updatePlayer AFTER UPDATE ON Players
+BEGIN
+  UPDATE Players SET last = datetime("now") WHERE rowid = new.rowid;
+END;
+CREATE TABLE Gossips (
+    ip VARCHAR NOT NULL, name VARCHAR NOT NULL, guid VARCHAR NOT NULL,
+    server VARCHAR NOT NULL, port VARCHAR NOT NULL, origin VARCHAR NOT NULL,
+    count INTEGER DEFAULT NULL,
+    first TIMESTAMP DEFAULT NULL, last TIMESTAMP DEFAULT NULL,
+    PRIMARY KEY (ip, name, guid, server, port, origin)
+);
+CREATE TRIGGER insertGossip AFTER INSERT ON Gossips
+BEGIN
+  UPDATE Gossips SET first = datetime("now"), last = datetime("now"),
+    count = 0 WHERE rowid = new.rowid;
+END;
+CREATE TRIGGER updateGossip AFTER UPDATE ON Gossips
+BEGIN
+  UPDATE Gossips SET last = datetime("now"),
+    count = (SELECT count FROM Gossips WHERE rowid = new.rowid)+1
+    WHERE rowid = new.rowid;
+END;
+"""
+
+def legacy_write_player(database, name, ip, guid, server, port):
+    """write_player() before upserts."""
+    results = database.execute(
+                  """SELECT * FROM Players WHERE
+                     name=? AND ip=? AND guid=? AND server=? AND port=?""",
+                  (name, ip, guid, server, port)
+              ).fetchall()
+    if len(results) == 0:
+        database.execute(
+            """INSERT INTO Players (name, ip, guid, server, port)
+               VALUES (?, ?, ?, ?, ?)""",
+            (name, ip, guid, server, port)
+        )
+    else:
+        database.execute(
+            """UPDATE Players SET guid=? WHERE
+               name=? AND ip=? AND guid=? AND server=? AND port=?""",
+            (guid, name, ip, guid, server, port)
+        )
+    database.commit()
+
+def legacy_write_gossip(database, name, ip, guid, server, port, origin):
+    """write_gossip() before upserts."""
+    results = database.execute(
+                  """SELECT * FROM Gossips WHERE
+                     name=? AND ip=? AND guid=? AND server=? AND port=? AND
+                     origin=?""",
+                  (name, ip, guid, server, port, origin)
+              ).fetchall()
+    if len(results) == 0:
+        database.execute(
+            """INSERT INTO Gossips (name, ip, guid, server, port, origin)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (name, ip, guid, server, port, origin)
+        )
+    else:
+        database.execute(
+            """UPDATE Gossips SET guid=? WHERE
+               name=? AND ip=? AND guid=? AND server=? AND port=? AND
+               origin=?""",
+            (guid, name, ip, guid, server, port, origin)
+        )
+    database.commit()
+
+class CountingConnection(object):
+    """
+    Wrap a connection to count the statements it runs,
+    including those run by triggers.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.statements = 0
+
+    def execute(self, sql, params=()):
+        """Run and count a statement."""
+        before = self.conn.total_changes
+        cursor = self.conn.execute(sql, params)
+        self.statements += 1
+        changed = max(cursor.rowcount, 0)
+        self.statements += self.conn.total_changes - before - changed
+        return cursor
+
+    def commit(self):
+        """Commit, not a statement as far as we're concerned."""
+        self.conn.commit()
+
+def make_packets(count, duplicates):
+    """
+    Make player tuples for count packets; a fraction of about
+    duplicates of them repeats an earlier player.
+    """
+    R.seed(count)
+    packets = []
+    for i in range(count):
+        if packets and R.random() < duplicates:
+            packets.append(R.choice(packets))
+        else:
+            packets.append(("player%s" % i, "10.0.%s.%s" % (i//256, i%256),
+                            "%032x" % i, "1.2.3.4", "27960"))
+    return packets
+
+def run(setup, write, packets, extra=()):
+    """Run one benchmark, return (statements per packet, packets/s)."""
+    handle, path = TEMP.mkstemp(suffix=".db")
+    OS.close(handle)
+    try:
+        conn = SQL.connect(path)
+        setup(conn)
+        counting = CountingConnection(conn)
+        start = TIME.time()
+        for packet in packets:
+            write(counting, *(packet+extra))
+        elapsed = TIME.time() - start
+        conn.close()
+    finally:
+        OS.remove(path)
+    return float(counting.statements)/len(packets), len(packets)/elapsed
+
+def main():
+    """Run all benchmarks and print a table."""
+    count = int(SYS.argv[1]) if len(SYS.argv) > 1 else 2000
+    duplicates = float(SYS.argv[2]) if len(SYS.argv) > 2 else 0.8
+    packets = make_packets(count, duplicates)
+    with open("hub.sql") as script_file:
+        script = script_file.read()
+    legacy = lambda conn: conn.executescript(LEGACY_SQL)
+    current = lambda conn: conn.executescript(script)
+    origin = ("5.6.7.8:9533",)
+    results = [
+        ("players, legacy", run(legacy, legacy_write_player, packets)),
+        ("players, upsert", run(current, HUB.write_player, packets)),
+        ("gossips, legacy", run(legacy, legacy_write_gossip, packets, origin)),
+        ("gossips, upsert", run(current, HUB.write_gossip, packets, origin)),
+    ]
+    print "%s packets, %.0f%% duplicates" % (count, duplicates*100)
+    print "%-16s %16s %12s" % ("write path", "statements/pkt", "packets/s")
+    for name, (statements, rate) in results:
+        print "%-16s %16.2f %12.0f" % (name, statements, rate)
+
+if __name__ == "__main__":
+    L.basicConfig(level=L.WARNING)
+    main()
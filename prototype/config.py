@@ -13,6 +13,50 @@ host = "the.hub.machine.tld"
 
 database = "hub.db"
 
+# player records are written in batches: as soon as flush_size
+# distinct players are waiting, but no later than flush_time
+# seconds (a float!) after the first of them showed up
+
+flush_size = 256
+flush_time = 1.0
+
+# a player we've recorded is recorded again only once
+# sighting_window seconds (a float!, 0.0 to record every
+# sighting) have passed, so its "last" time in the database
+# lags behind by at most that long; we remember at most
+# sighting_cache players, each costs a few hundred bytes
+
+sighting_window = 60.0
+sighting_cache = 65536
+
+# how we receive packets: "pool" reads them in the main thread
+# and hands each to a thread pool, "async" checks them right
+# where they arrive and only hands database writes to a thread
+
+engine = "pool"
+
+# how many packets we take from a socket before we look at the
+# other sockets again; check the batch size histogram in the
+# log to see how full our batches actually are
+
+batch = 64
+
+# how many batches may wait for the thread pool, per priority
+# lane, and what to do when a lane is full: "drop-oldest",
+# "drop-newest", or "reject" (all batches we read in one go);
+# either way we keep receiving, the log has the details
+
+pool_tasks = 16
+pool_policy = "drop-oldest"
+
+# how many processes receive and check packets; with more than
+# one, each of them binds the server and listen ports (Linux
+# only, we need SO_REUSEPORT, the hub won't start elsewhere) and
+# this process only writes to the database; engine doesn't
+# matter then
+
+workers = 1
+
 # the servers we listen to; for now each box has one port
 # and secret on the hub, even if it runs multiple game
 # servers; for a setup where one box runs games servers for
@@ -41,6 +85,25 @@ tell = {
     "another.hub.tld": (12345, "itssofun"),
 }
 
+# we tell each player on each game server to the tell hubs at
+# most once every gossip_window seconds; players are packed
+# into datagrams of at most gossip_mtu bytes, each waits at
+# most gossip_delay seconds (both windows are floats!)
+
+gossip_window = 30.0
+gossip_delay = 1.0
+gossip_mtu = 1400
+
+# we count packets received and rejected (and why), database
+# write latency, queue depths, and gossip datagrams; set
+# metrics_port to serve them at http://metrics_host:port/metrics
+# in the Prometheus text format, 0 turns that off; keep the
+# host local, there's no access control; with more than one
+# worker process, the workers send their packet counts here
+
+metrics_host = "localhost"
+metrics_port = 0
+
 # TODO: should there be another level, i.e. hubs that we
 # don't just gossip with but keep in sync with 100% (subject
 # to the limitations of using UDP that is)? seems like a
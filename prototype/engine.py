@@ -0,0 +1,77 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+An event-driven packet receiver.
+
+The thread pool engine reads each packet in the main thread
+and then hands it to a worker thread, which costs a queue
+handoff and a thread switch per packet. Checking a packet is
+cheap compared to that, so this engine handles each packet
+right in the thread that received it; callers only push work
+that can actually block (the database) elsewhere.
+
+Python 2 doesn't have asyncio, but asyncore gives us the same
+model: one dispatcher per socket and a callback whenever that
+socket is readable.
+"""
+
+import asyncore as ASYNC
+import logging as L
+
+import batch as BATCH
+
+class _Receiver(ASYNC.dispatcher):
+    """Dispatcher for one socket, don't instantiate directly!"""
+
+    def __init__(self, sock, handler, flush, socket_map, batch, histogram):
+        """Wrap sock and call handler for each packet received."""
+        ASYNC.dispatcher.__init__(self, sock, socket_map)
+        self.__handler = handler
+        self.__flush = flush
+        self.__batch = batch
+        self.__histogram = histogram
+
+    def writable(self):
+        """We only ever wait for packets."""
+        return False
+
+    def handle_read(self):
+        """Receive a batch of packets and handle them."""
+        batch = BATCH.drain(self.socket, self.__batch)
+        self.__histogram.add(len(batch))
+        L.debug("received %s packet(s) from %s", len(batch),
+                self.socket.getsockname())
+        for packet, host, port in batch:
+            try:
+                self.__handler(packet, host, port)
+            except Exception as exc:
+                L.exception("exception %s while handling packet from %s:%s"
+                            " ignored by engine", exc, host, port)
+        if self.__flush is not None:
+            self.__flush()
+        self.__histogram.report()
+
+    def handle_error(self):
+        """Log and keep going, unlike asyncore which would close."""
+        L.exception("exception while receiving ignored by engine")
+
+    def handle_close(self):
+        """Sockets belong to the caller, we never close them."""
+        pass
+
+def run(sockets, handler, batch=64, flush=None, timeout=30.0):
+    """
+    Receive packets from all sockets forever.
+
+    Calls handler(packet, host, port) for each packet; takes
+    at most batch packets from a socket before looking at the
+    others again, then calls flush() if given. Note that the
+    sockets are switched to non-blocking mode.
+    """
+    socket_map = {}
+    histogram = BATCH.Histogram(batch)
+    for sock in sockets:
+        _Receiver(sock, handler, flush, socket_map, batch, histogram)
+    L.debug("engine running for %s socket(s)", len(socket_map))
+    ASYNC.loop(timeout, True, socket_map)
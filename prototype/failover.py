@@ -20,7 +20,6 @@ A simple prototype for |ALPHA| Hub.
 # in the thread and close() there assuming that we'll die for
 # sure since the main thread will exit; messy, messy, messy
 
-import hashlib as HASH
 import logging as L
 import os as OS
 import platform as PLAT
@@ -28,7 +27,12 @@ import select as SEL
 import socket as S
 import sqlite3 as SQL
 
+import acks as ACKS
+import batch as BATCH
 import pool as POOL
+import replay as REPLAY
+import seglog as SEGLOG
+import verify as VERIFY
 
 def load_config(path):
     """
@@ -40,8 +44,22 @@ def load_config(path):
     default = {
         'host': 'localhost',
         'database': 'failover.db',
+        'storage': 'database',
+        'segments': 'failover.log',
+        'segment_size': 4*1024*1024,
         'servers': {},
         'hubs': {},
+        'batch': 64,
+        'pool_tasks': 16,
+        'pool_policy': 'drop-oldest',
+        'replay_page': 64,
+        'replay_backoff': 5.0,
+        'replay_backoff_max': 300.0,
+        'replay_rate': 100.0,
+        'replay_window': 1024,
+        'replay_interval': 0.1,
+        'ack_flush_size': 1024,
+        'ack_flush_time': 1.0,
         '__name': 'default',
     }
     config = {}
@@ -54,6 +72,11 @@ def load_config(path):
         validate_config(config, default)
         config['servers'] = resolve_config(config['servers'])
         config['hubs'] = resolve_config(config['hubs'])
+        if config['pool_policy'] not in POOL.POLICIES:
+            L.error("config file '%s' has unknown pool policy '%s'",
+                    config['__name'], config['pool_policy'])
+            config['pool_policy'] = default['pool_policy']
+    config['__hubs'] = VERIFY.make_verifiers(config['hubs'])
     L.debug("loaded config file '%s'", path)
     return config
 
@@ -108,14 +131,14 @@ def open_sockets(config):
         sock = S.socket(S.AF_INET, S.SOCK_DGRAM)
         sock.bind((host, port))
         L.debug("bound socket %s for hub %s", sock.getsockname(), server)
-        hubs.append(sock)
+        hubs.append((sock, config['__hubs'][server], (server, port)))
     return servers, hubs
 
 def close_sockets(servers, hubs):
     """
     Close all sockets.
     """
-    for sock in servers+hubs:
+    for sock in servers+[out for out, _, _ in hubs]:
         L.debug("closing socket %s", sock.getsockname())
         sock.close()
 
@@ -129,29 +152,104 @@ def open_database(config):
     return conn
 
 def create_tables(conn):
-    """Create database tables (unless they exist already)."""
+    """
+    Create database tables (unless they exist already), upgrade
+    the failover table of older databases.
+    """
+    upgrade = is_old_failover(conn)
+    if upgrade:
+        L.info("upgrading failover table to AUTOINCREMENT ids")
+        conn.executescript("""BEGIN TRANSACTION;
+                           DROP TRIGGER IF EXISTS insertPacket;
+                           ALTER TABLE failover RENAME TO failover_old;
+                           COMMIT;""")
     with open("failover.sql") as script_file:
         script = script_file.read()
         conn.executescript(script)
         # TODO: would love to detect if we actually created
         # tables here but can't due to sqlite3 interface?
+    if upgrade or conn.execute("""SELECT 1 FROM sqlite_master
+                               WHERE type = 'table'
+                               AND name = 'failover_old'""").fetchone():
+        # rows keep their rowids as ids; if we died halfway through
+        # last time we pick up here
+        conn.executescript("""BEGIN TRANSACTION;
+                           INSERT INTO failover (id, server, port, packet,
+                                                 time)
+                             SELECT rowid, server, port, packet, time
+                               FROM failover_old;
+                           DROP TABLE failover_old;
+                           COMMIT;""")
+
+def is_old_failover(conn):
+    """
+    True if the failover table is from before AUTOINCREMENT ids.
+
+    Without AUTOINCREMENT SQLite hands out the rowid of the newest
+    row again once that row is deleted, and replay.py never sends
+    a row with a rowid at or below a hub's watermark.
+    """
+    row = conn.execute("""SELECT sql FROM sqlite_master
+                       WHERE type = 'table'
+                       AND name = 'failover'""").fetchone()
+    return row is not None and 'AUTOINCREMENT' not in row[0].upper()
 
 def close_database(conn):
     """Close database connection."""
     conn.close()
     L.debug("closed database")
 
-def get_db_entries(conn):
-    """Get current database entries for failover."""
-    results = conn.execute("""SELECT 'rowid','server','port','packet', 'time'
-                           FROM failover""").fetchall()
-    return results
-
-def del_db_entry(conn, rowid):
-    """Delete entry from failover database"""
-    conn.execute("""delete from failover where `rowid`=?""", (rowid))
-    conn.commit()
-    
+def get_db_entries(conn, after, limit):
+    """Get up to limit failover entries with rowids beyond after."""
+    results = conn.execute("""SELECT rowid, server, port, packet, time
+                           FROM failover WHERE rowid > ?
+                           ORDER BY rowid LIMIT ?""",
+                           (after, limit)).fetchall()
+    return [tuple(row) for row in results]
+
+def get_db_rows(conn, rowids):
+    """Get the failover entries for rowids that still exist."""
+    marks = ','.join('?'*len(rowids))
+    results = conn.execute("""SELECT rowid, server, port, packet, time
+                           FROM failover WHERE rowid IN (%s)
+                           ORDER BY rowid""" % marks,
+                           tuple(rowids)).fetchall()
+    return [tuple(row) for row in results]
+
+def count_db_entries(conn):
+    """Number of failover entries in the database."""
+    return conn.execute("SELECT COUNT(*) FROM failover").fetchone()[0]
+
+class DatabaseStore(object):
+    """Failover entries in the database, as a replay store."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def after(self, rowid, limit):
+        return get_db_entries(self.conn, rowid, limit)
+
+    def rows(self, rowids):
+        return get_db_rows(self.conn, rowids)
+
+    def count(self):
+        return count_db_entries(self.conn)
+
+    def append(self, server, port, packet):
+        write_packet(self.conn, server, port, packet)
+
+    def delete(self, ranges):
+        del_db_ranges(self.conn, ranges)
+
+    def close(self):
+        close_database(self.conn)
+
+def del_db_ranges(conn, ranges):
+    """Delete failover entries in (first, last) rowid ranges at once."""
+    with conn:
+        conn.executemany("""DELETE FROM failover
+                         WHERE rowid BETWEEN ? AND ?""", ranges)
+
 def write_packet(database, server, port, userinfo):
     """
     Write a player record to the database.
@@ -170,109 +268,117 @@ def write_packet(database, server, port, userinfo):
     )
     database.commit()
 
-def echo_to_hubs(config, rowid, hubs, host, packet):
+def echo_to_hub(hub, row):
     """
-    Send gossip to tell hubs.
+    Send a failover entry, a (rowid, server, port, packet, time)
+    tuple, to a hub.
     """
-    L.debug("Sending Database Userinfo packet from %s to hubs ...",
-            host)
-    payload = 'failover player\n\\rowid\\%i\\server\\%s\\time\\%s\n%s' % (
-        rowid, host, packet[1], packet[0])
-    for out in hubs:
-        L.debug("...to hub %s", out.getpeername())
-        secret = config['hubs'][out.getpeername()[0]][1]
-        md4 = HASH.new('md4', secret+'\n'+payload).hexdigest()
-        packet = md4+'\n'+payload
-        try:
-            # NOTE: using out.send(packet) will fail too if the other
-            # side is not there; strange since the docs say it should
-            # just keep on truckin'
-            out.sendall(packet)
-        except S.error as exc:
-            L.warning("...sendall() failed with %s for %s", exc,
-                      out.getpeername())
-
-def handle_hub(config, database, host, data):
+    out, verifier, peer = hub
+    rowid, server, port, packet, time = row
+    L.debug("sending failover entry %s from %s:%s to hub %s",
+            rowid, server, port, peer)
+    payload = (
+        'failover player\n\\rowid\\%i\\server\\%s:%s\\time\\%s\n%s' %
+        (rowid, server, port, time, packet))
+    try:
+        # NOTE: our hub sockets are bound but not connected, so
+        # we have to say where the packet goes
+        out.sendto(verifier.sign(payload), peer)
+    except S.error as exc:
+        L.warning("...sendto() failed with %s for %s", exc, peer)
+
+def handle_hub(config, acks, host, data):
     """
-    Handle a gossip packet.
+    Handle an acknowledgement packet.
 
     Checks packet structure, MD4 checksum, etc. and eventually
-    writes the gossip record. Returns false if we rejected the
-    packet as invalid, true if we accepted it.
+    hands the acknowledged rowid ranges to the ack collector.
     """
     md4, data = data.split('\n', 1)
     if len(md4) != 32:
         L.debug("invalid md4 length")
         return
 
-    secret = config['hubs'][host][1]
-    checksum = HASH.new('md4', secret+'\n'+data).hexdigest()
-    if md4 != checksum:
+    if not config['__hubs'][host].check(md4, data):
         L.debug("invalid checksum (secrets probably don't match)")
         return
 
     kind, data = data.split('\n', 1)
-    if kind != 'got failover player':
-        L.debug("not a gossip player packet")
+    if kind not in (ACKS.KIND, 'got failover player'):
+        L.debug("not a got failover player(s) packet")
+        return
+    try:
+        ranges = ACKS.parse_ranges(data)
+    except ValueError as exc:
+        L.debug("invalid acknowledgement: %s", exc)
         return
-    del_db_entry(database, data.strip())
+    acks.add(ranges)
 
 def handle_packet(packet, host, port, _tp_local):
     """Examine a packet and figure out what to do."""
     loc = _tp_local
     if host in loc.config['servers']:
         L.debug("processing server packet from %s:%s", host, port)
-        write_packet(loc.database, host, port, packet)
+        loc.store.append(host, port, packet)
     elif host in loc.config['hubs']:
         L.debug("processing hub packet from %s:%s", host, port)
-        handle_hub(loc.config, loc.database, host, packet)
+        handle_hub(loc.config, loc.acks, host, packet)
     else:
         L.debug("ignored spurious packet from %s:%s", host, port)
 
-def run(config, servers, hubs):
+def handle_packets(batch, _tp_local):
+    """Handle a batch of packets from one socket."""
+    for packet, host, port in batch:
+        handle_packet(packet, host, port, _tp_local)
+
+def run(config, servers, hubs, acks, open_store):
     """
     Receive and handle packets from all our sockets.
     """
-    def thread_open_database(local):
+    def thread_open_store(local):
         """Helper to create thread-local storage."""
-        local.database = open_database(config)
+        local.store = open_store()
         local.config = config
         local.servers = servers
         local.hubs = hubs
-    pool = POOL.ThreadPool(init_local=thread_open_database)
+        local.acks = acks
+    pool = POOL.ThreadPool(max_tasks=config['pool_tasks'],
+                           init_local=thread_open_store,
+                           policy=config['pool_policy'])
+    pool.register(handle_packets, lane=POOL.BULK)
+    histogram = BATCH.Histogram(config['batch'])
+    sockets = servers+[sock for sock, _, _ in hubs]
+    for sock in sockets:
+        sock.setblocking(0)
     while True:
         L.debug("sleeping in select")
-        ready, _, _ = SEL.select(servers+hubs, [], [], 5)
-        print ready
-        if ready == []:
-            database = open_database(config)
-            for ent in get_db_entries(database):
-                source_server = '%i:%i' % (ent[1], ent[2])
-                echo_to_hubs(config,
-                             ent[0],
-                             hubs,
-                             source_server,
-                             (ent[3], ent[4])
-                             )
-            close_database(database)
+        ready, _, _ = SEL.select(sockets, [], [], 5)
         L.debug("woke up for %s socket(s)", len(ready))
+        tasks = []
         for sock in ready:
             # TODO: could pass sock to thread and read there, but
             # what are the implications of going back into select
             # while another thread could still be reading? seems
             # safer to just read here (although that costs time)
             # and put the handling off into a thread instead
-            packet, (host, port) = sock.recvfrom(4096)
-            L.debug("received packet from %s:%s", host, port)
-            pool.add(handle_packet, packet, host, port)
+            batch = BATCH.drain(sock, config['batch'])
+            histogram.add(len(batch))
+            L.debug("received %s packet(s) from %s", len(batch),
+                    sock.getsockname())
+            if batch:
+                tasks.append((handle_packets, (batch,), {}))
+        shed = pool.add_many(tasks)
+        if shed:
+            L.debug("shed %s batch(es) adding %s", shed, len(tasks))
+        histogram.report()
         
 
-def safe_run(config, servers, hubs):
+def safe_run(config, servers, hubs, acks, open_store):
     """
     Wrapper around run() to catch exceptions.
     """
     try:
-        run(config, servers, hubs)
+        run(config, servers, hubs, acks, open_store)
     except BaseException as exc:
         L.exception("terminated by exception %s", exc)
 
@@ -290,11 +396,31 @@ def main():
     config = load_config(OS.path.expanduser(config_path))
     servers, hubs = open_sockets(config)
     L.debug("bound and connected all sockets")
-    database = open_database(config)
-    create_tables(database)
-    safe_run(config, servers, hubs)
+    if config['storage'] == 'segments':
+        store = SEGLOG.SegmentLog(config['segments'], config['segment_size'])
+        open_store = store.open
+    else:
+        store = DatabaseStore(open_database(config))
+        create_tables(store.conn)
+        open_store = lambda: DatabaseStore(open_database(config))
+    acks = ACKS.AckCollector(open_store,
+                             config['ack_flush_size'],
+                             config['ack_flush_time'])
+    replayer = REPLAY.Replayer(hubs, echo_to_hub, config['replay_page'],
+                               config['replay_backoff'],
+                               config['replay_backoff_max'],
+                               config['replay_rate'],
+                               config['replay_window'])
+    scheduler = REPLAY.ReplayScheduler(
+        replayer, open_store,
+        config['replay_interval'])
+    safe_run(config, servers, hubs, acks, open_store)
     L.info("stopping |ALPHA| Failover Hub prototype")
-    close_database(database)
+    scheduler.close()
+    L.info("replay stats %s", scheduler.stats())
+    acks.close()
+    L.info("ack collector stats %s", acks.stats())
+    store.close()
     close_sockets(servers, hubs)
     L.debug("closed all sockets")
 
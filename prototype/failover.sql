@@ -5,8 +5,11 @@
 
 BEGIN TRANSACTION;
 
--- actual packets from game servers we run and trust
+-- actual packets from game servers we run and trust; replay.py
+-- needs ids that are never handed out twice, even after the
+-- newest rows were deleted, hence AUTOINCREMENT
 CREATE TABLE IF NOT EXISTS failover (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
     server VARCHAR NOT NULL,
     port VARCHAR NOT NULL,
     packet VARCHAR NOT NULL,
@@ -14,6 +17,7 @@ CREATE TABLE IF NOT EXISTS failover (
 );
 
 CREATE TRIGGER IF NOT EXISTS insertPacket AFTER INSERT ON failover
+WHEN new.time IS NULL
 BEGIN
   UPDATE failover
     SET time = datetime("now")
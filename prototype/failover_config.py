@@ -12,6 +12,54 @@ host = "host.ip.here"
 # "real" database connection URL
 
 database = "failover.db"
+
+# where we keep packets until a hub acknowledges them: either
+# "database" for the database above or "segments" for an
+# append-only log of segment files in the directory segments,
+# each at most segment_size bytes; the log is cheaper to write
+# when game servers send packets in bursts
+
+storage = "database"
+segments = "failover.log"
+segment_size = 4*1024*1024
+
+# how many packets we take from a socket before we look at the
+# other sockets again; check the batch size histogram in the
+# log to see how full our batches actually are
+
+batch = 64
+
+# how many batches may wait for the thread pool and what to do
+# when too many are waiting: "drop-oldest", "drop-newest", or
+# "reject" (all batches we read in one go)
+
+pool_tasks = 16
+pool_policy = "drop-oldest"
+
+# replay of packets the hubs haven't acknowledged yet runs in
+# its own thread every replay_interval seconds, no matter how
+# busy we are; it sends at most replay_page packets and at most
+# replay_rate packets per second (0 for no limit) to each hub
+# each time; a packet is resent replay_backoff seconds after it
+# was sent, then twice as long after each attempt up to
+# replay_backoff_max seconds; no more than replay_window packets
+# (at least replay_page) wait for a hub's acknowledgement, a
+# hub that's down gets nothing new until it acks some
+
+replay_page = 64
+replay_backoff = 5.0
+replay_backoff_max = 300.0
+replay_rate = 100.0
+replay_window = 1024
+replay_interval = 0.1
+
+# hubs acknowledge packets in batches of rowid ranges; we delete
+# acknowledged packets in one transaction once ack_flush_size
+# ranges are waiting or the oldest waited ack_flush_time seconds
+
+ack_flush_size = 1024
+ack_flush_time = 1.0
+
 # the servers we listen to; for now each box has one port
 # and secret on the hub, even if it runs multiple game
 # servers; for a setup where one box runs games servers for
@@ -0,0 +1,219 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+End-to-end throughput harness for the hub.
+
+Starts hub.py in a scratch directory that serves as its HOME,
+with a config for the game servers and peer hubs loadgen.py
+simulates, sends traffic, and meanwhile polls the hub's database
+for new players and gossip. When it's done it stops the hub and
+reports:
+
+- packets per second sent, and new players committed per second
+- drop rate: new players we sent that never got committed
+- p50/p99 latency from the first packet about a new player to
+  the poll that found it committed (so latencies are accurate
+  to about one poll interval)
+- the hub's own recorder stats, from its log (so only at log
+  level INFO or lower)
+
+Run it from the prototype directory:
+
+    python harness.py --help
+
+For example, 10 seconds of 2000 packets per second in bursts of
+50 against the async engine:
+
+    python harness.py --rate 2000 --burst 50 --engine async
+"""
+
+import ast as AST
+import os as OS
+import shutil as SHUTIL
+import signal as SIGNAL
+import sqlite3 as SQL
+import subprocess as SUB
+import sys as SYS
+import tempfile as TEMP
+import threading as T
+import time as TIME
+
+import loadgen as LOADGEN
+
+# runs the hub with a log level of our choosing
+HUB = """
+import logging as L
+L.basicConfig(level=L.%s,
+              format="%%(asctime)s - %%(threadName)s - %%(levelname)s - %%(message)s")
+import hub
+hub.main()
+"""
+
+def write_config(home, opts, database):
+    """Write ~/.alphahub/config.py for the hub into home."""
+    servers, listen = LOADGEN.hub_config(opts.servers, opts.hubs, opts.port)
+    settings = {
+        'host': '127.0.0.1',
+        'database': database,
+        'servers': servers,
+        'listen': listen,
+        'tell': {},
+        'engine': opts.engine,
+        'workers': opts.workers,
+    }
+    OS.mkdir(OS.path.join(home, '.alphahub'))
+    with open(OS.path.join(home, '.alphahub', 'config.py'), 'w') as config:
+        for key, value in sorted(settings.iteritems()):
+            config.write('%s = %r\n' % (key, value))
+
+def start_hub(home, log, level):
+    """Run hub.py from the prototype directory with HOME at home."""
+    env = dict(OS.environ, HOME=home)
+    return SUB.Popen([SYS.executable, '-c', HUB % level], env=env,
+                     cwd=OS.path.dirname(OS.path.abspath(__file__)),
+                     stdout=log, stderr=SUB.STDOUT)
+
+def wait_ready(database, timeout):
+    """Wait until the hub created its tables, False if it didn't."""
+    deadline = TIME.time() + timeout
+    while TIME.time() < deadline:
+        if OS.path.exists(database):
+            conn = SQL.connect(database, timeout=16)
+            try:
+                conn.execute("SELECT 1 FROM Gossips LIMIT 1")
+                return True
+            except SQL.OperationalError:
+                pass
+            finally:
+                conn.close()
+        TIME.sleep(0.1)
+    return False
+
+class Poller(object):
+    """Notes when new players and gossip show up in the database."""
+
+    TABLES = ('Players', 'Gossips')
+
+    def __init__(self, database, interval):
+        """Initialize and start polling database every interval seconds."""
+        self.__database = database
+        self.__interval = interval
+        self.__stop = T.Event()
+        # when each name was first found, by name
+        self.first_seen = {}
+        self.__thread = T.Thread(target=self.__run, name="Poller")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def close(self):
+        """Poll one last time and stop."""
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        """Background thread main loop."""
+        conn = SQL.connect(self.__database, timeout=16)
+        conn.text_factory = str
+        seen = dict((table, 0) for table in self.TABLES)
+        try:
+            while True:
+                stopping = self.__stop.wait(self.__interval)
+                now = TIME.time()
+                for table in self.TABLES:
+                    rows = conn.execute(
+                        "SELECT rowid, name FROM %s WHERE rowid > ?" % table,
+                        (seen[table],)).fetchall()
+                    for rowid, name in rows:
+                        self.first_seen.setdefault(name, now)
+                        seen[table] = max(seen[table], rowid)
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return float('nan')
+    return values[min(int(fraction*len(values)), len(values)-1)]
+
+def recorder_stats(log_path):
+    """The last "player recorder stats" the hub logged, or None."""
+    stats = None
+    with open(log_path) as log:
+        for line in log:
+            marker = line.find('player recorder stats ')
+            if marker >= 0:
+                stats = AST.literal_eval(
+                    line[marker+len('player recorder stats '):].strip())
+    return stats
+
+def report(opts, generator, poller, elapsed):
+    """Print what we found out."""
+    sent = generator.first_sent
+    seen = poller.first_seen
+    committed = [name for name in sent if name in seen]
+    latencies = sorted(seen[name]-sent[name] for name in committed)
+    drop = 1.0 - float(len(committed)) / len(sent) if sent else 0.0
+    print "sent %s packet(s) in %.1f seconds: %.0f packets/s" % (
+        generator.sent, elapsed, generator.sent/elapsed)
+    print "new players: %s sent, %s committed (%.0f/s), drop rate %.2f%%" % (
+        len(sent), len(committed), len(committed)/elapsed, drop*100)
+    print "packet to commit latency: p50 %.3f s, p99 %.3f s (poll %.3f s)" % (
+        percentile(latencies, 0.50), percentile(latencies, 0.99), opts.poll)
+
+def main():
+    """Run the hub, send traffic, report."""
+    parser = LOADGEN.options()
+    parser.add_option('--engine', default='pool',
+                      help="hub engine [%default]")
+    parser.add_option('--workers', type='int', default=1,
+                      help="hub worker processes [%default]")
+    parser.add_option('--poll', type='float', default=0.05,
+                      help="database poll interval [%default]")
+    parser.add_option('--drain', type='float', default=5.0,
+                      help="seconds to wait for commits at the end [%default]")
+    parser.add_option('--log-level', default='INFO',
+                      help="hub log level [%default]")
+    parser.add_option('--keep', action='store_true', default=False,
+                      help="keep the scratch directory")
+    opts, _ = parser.parse_args()
+
+    home = TEMP.mkdtemp(prefix='alphahub-harness-')
+    database = OS.path.join(home, 'hub.db')
+    log_path = OS.path.join(home, 'hub.log')
+    write_config(home, opts, database)
+    log = open(log_path, 'w')
+    hub = start_hub(home, log, opts.log_level)
+    try:
+        if not wait_ready(database, 10):
+            print "hub didn't start, see %s" % log_path
+            opts.keep = True
+            return
+        poller = Poller(database, opts.poll)
+        generator = LOADGEN.LoadGenerator(
+            '127.0.0.1', opts.port, opts.servers, opts.hubs, opts.players,
+            opts.churn, opts.duplicates, opts.seed)
+        start = TIME.time()
+        generator.run(opts.duration, opts.rate, opts.burst)
+        elapsed = TIME.time() - start
+        generator.close()
+        deadline = TIME.time() + opts.drain
+        while (TIME.time() < deadline and
+               len(poller.first_seen) < len(generator.first_sent)):
+            TIME.sleep(opts.poll)
+        poller.close()
+    finally:
+        hub.send_signal(SIGNAL.SIGINT)
+        hub.wait()
+        log.close()
+    report(opts, generator, poller, elapsed)
+    print "hub recorder stats %s" % recorder_stats(log_path)
+    if opts.keep:
+        print "kept %s" % home
+    else:
+        SHUTIL.rmtree(home)
+
+if __name__ == "__main__":
+    main()
@@ -20,15 +20,23 @@ A simple prototype for |ALPHA| Hub.
 # in the thread and close() there assuming that we'll die for
 # sure since the main thread will exit; messy, messy, messy
 
-import hashlib as HASH
 import logging as L
+import multiprocessing as MP
 import os as OS
 import platform as PLAT
 import select as SEL
 import socket as S
 import sqlite3 as SQL
+import time as TIME
 
+import batch as BATCH
+import engine as ENGINE
+import metrics as METRICS
+import outbox as OUTBOX
+import packet as PACKET
 import pool as POOL
+import recorder as RECORDER
+import verify as VERIFY
 
 def load_config(path):
     """
@@ -43,6 +51,20 @@ def load_config(path):
         'servers': {},
         'listen': {},
         'tell': {},
+        'flush_size': 256,
+        'flush_time': 1.0,
+        'sighting_window': 60.0,
+        'sighting_cache': 65536,
+        'engine': 'pool',
+        'batch': 64,
+        'pool_tasks': 16,
+        'pool_policy': 'drop-oldest',
+        'workers': 1,
+        'gossip_window': 30.0,
+        'gossip_delay': 1.0,
+        'gossip_mtu': 1400,
+        'metrics_host': 'localhost',
+        'metrics_port': 0,
         '__name': 'default',
     }
     config = {}
@@ -56,6 +78,17 @@ def load_config(path):
         config['servers'] = resolve_config(config['servers'])
         config['listen'] = resolve_config(config['listen'])
         config['tell'] = resolve_config(config['tell'])
+        if config['engine'] not in ENGINES:
+            L.error("config file '%s' has unknown engine '%s'",
+                    config['__name'], config['engine'])
+            config['engine'] = default['engine']
+        if config['pool_policy'] not in POOL.POLICIES:
+            L.error("config file '%s' has unknown pool policy '%s'",
+                    config['__name'], config['pool_policy'])
+            config['pool_policy'] = default['pool_policy']
+    config['__servers'] = VERIFY.make_verifiers(config['servers'])
+    config['__listen'] = VERIFY.make_verifiers(config['listen'])
+    config['__tell'] = VERIFY.make_verifiers(config['tell'])
     L.debug("loaded config file '%s'", path)
     return config
 
@@ -101,20 +134,34 @@ def resolve_config(section):
             resolved[server] = section[server]
     return resolved
 
-def open_sockets(config):
+# Python 2 doesn't know SO_REUSEPORT yet, 15 is the Linux value; other
+# systems either don't have it, or don't spread packets between sockets
+# with it (BSD, OS X), or can't fork our workers at all (Windows)
+SO_REUSEPORT = (getattr(S, 'SO_REUSEPORT', 15) if PLAT.system() == 'Linux'
+                else None)
+
+def open_sockets(config, reuse=False):
     """
     Open all sockets.
+
+    With reuse several processes can bind the same server and
+    listen ports; the kernel spreads packets between them.
     """
+    assert not reuse or SO_REUSEPORT is not None
     host = config['host']
     servers = []
     for server, (port, _secret) in config['servers'].iteritems():
         sock = S.socket(S.AF_INET, S.SOCK_DGRAM)
+        if reuse:
+            sock.setsockopt(S.SOL_SOCKET, SO_REUSEPORT, 1)
         sock.bind((host, port))
         L.debug("bound socket %s for server %s", sock.getsockname(), server)
         servers.append(sock)
     listen = []
     for server, (port, _secret) in config['listen'].iteritems():
         sock = S.socket(S.AF_INET, S.SOCK_DGRAM)
+        if reuse:
+            sock.setsockopt(S.SOL_SOCKET, SO_REUSEPORT, 1)
         sock.bind((host, port))
         L.debug("bound socket %s for listen %s", sock.getsockname(), server)
         listen.append(sock)
@@ -124,14 +171,19 @@ def open_sockets(config):
         sock.connect((server, port))
         L.debug("connected socket %s for tell %s",
                 sock.getsockname(), sock.getpeername())
-        tell.append(sock)
+        tell.append((sock, config['__tell'][server], sock.getpeername()))
     return servers, listen, tell
 
+def make_outbox(config, tell):
+    """Start gossip outbox for tell sockets."""
+    return OUTBOX.GossipOutbox(tell, config['gossip_window'],
+                               config['gossip_delay'], config['gossip_mtu'])
+
 def close_sockets(servers, listen, tell):
     """
     Close all sockets.
     """
-    for sock in servers+listen+tell:
+    for sock in servers+listen+[out for out, _, _ in tell]:
         L.debug("closing socket %s", sock.getsockname())
         sock.close()
 
@@ -165,170 +217,260 @@ def write_player(database, name, ip, guid, server, port):
     """
     Write a player record to the database.
 
-    If the record exists already, we fake an update
-    to get "last" updated by the database trigger.
+    One upsert, the one the recorder uses, either inserts the
+    record or, if it exists already, updates "last".
     """
     L.info(
         "recording %s from ip %s with guid %s playing on %s:%s",
         name, ip, guid, server, port
     )
-    results = database.execute(
-                  """SELECT * FROM Players WHERE
-                     name=? AND ip=? AND guid=? AND server=? AND port=?""",
-                  (name, ip, guid, server, port)
-              ).fetchall()
-    if len(results) == 0:
-        database.execute(
-            """INSERT INTO Players (name, ip, guid, server, port)
-               VALUES (?, ?, ?, ?, ?)""",
-            (name, ip, guid, server, port)
-        )
-    else:
-        database.execute(
-            """UPDATE Players SET guid=? WHERE
-               name=? AND ip=? AND guid=? AND server=? AND port=?""",
-            (guid, name, ip, guid, server, port)
-        )
+    now = RECORDER.timestamp()
+    database.execute(RECORDER.UPSERT, (name, ip, guid, server, port, now, now))
     database.commit()
 
 def write_gossip(database, name, ip, guid, server, port, origin):
     """
     Write a gossip record to the database.
 
-    If the record exists already, we fake an update
-    to get "last" and "count" updated by the database trigger.
+    One upsert either inserts the record or, if it exists
+    already, updates "last" and "count".
     """
     L.info(
         "gossip from %s: recording %s from ip %s with guid %s playing on %s:%s",
         origin, name, ip, guid, server, port
     )
-    results = database.execute(
-                  """SELECT * FROM Gossips WHERE
-                     name=? AND ip=? AND guid=? AND server=? AND port=? AND
-                     origin=?""",
-                  (name, ip, guid, server, port, origin)
-              ).fetchall()
-    if len(results) == 0:
-        database.execute(
-            """INSERT INTO Gossips (name, ip, guid, server, port, origin)
-               VALUES (?, ?, ?, ?, ?, ?)""",
-            (name, ip, guid, server, port, origin)
-        )
-    else:
-        database.execute(
-            """UPDATE Gossips SET guid=? WHERE
-               name=? AND ip=? AND guid=? AND server=? AND port=? AND
-               origin=?""",
-            (guid, name, ip, guid, server, port, origin)
-        )
+    database.execute(
+        """INSERT INTO Gossips (name, ip, guid, server, port, origin,
+                                count, first, last)
+           VALUES (?, ?, ?, ?, ?, ?, 0, datetime("now"), datetime("now"))
+           ON CONFLICT (ip, name, guid, server, port, origin)
+           DO UPDATE SET last = excluded.last, count = count+1""",
+        (name, ip, guid, server, port, origin)
+    )
     database.commit()
 
-def parse_userinfo(userinfo):
+# userinfo keys we care about in packets from servers and hubs
+USERINFO_KEYS = PACKET.wanted('name', 'ip', 'cl_guid')
+GOSSIP_KEYS = PACKET.wanted('server', 'name', 'ip', 'guid')
+
+# metrics; children that hot paths use are looked up once here
+RECEIVED = METRICS.REGISTRY.counter(
+    'hub_packets_received_total', "Packets received, by sender.",
+    ('source',))
+FROM_SERVER = RECEIVED.labels('server')
+FROM_LISTEN = RECEIVED.labels('listen')
+FROM_SPURIOUS = RECEIVED.labels('spurious')
+REJECTED = METRICS.REGISTRY.counter(
+    'hub_packets_rejected_total', "Packets rejected, by kind and reason.",
+    ('kind', 'reason'))
+ACCEPTED = METRICS.REGISTRY.counter(
+    'hub_records_accepted_total', "Checked userinfo and gossip records.",
+    ('kind',))
+ACCEPTED_USERINFO = ACCEPTED.labels('userinfo')
+ACCEPTED_GOSSIP = ACCEPTED.labels('gossip')
+DB_WRITE = METRICS.REGISTRY.histogram(
+    'hub_db_write_seconds', "Database write latency, by table.", ('table',))
+DB_WRITE_GOSSIPS = DB_WRITE.labels('gossips')
+
+def watch_pool(pool, name):
     """
-    Parse userinfo string into dictionary.
+    Export the lane depths and shed tasks of pool in the
+    metrics; they're only collected when we're scraped.
     """
-    data = userinfo.split("\\")[1:]
-    assert len(data) % 2 == 0
-    keys = data[0::2]
-    values = data[1::2]
-    return dict(zip(keys, values))
-
-def handle_userinfo(config, database, tell, host, port, data):
+    def depth():
+        stats = pool.stats()
+        return [((name, lane), stats[lane+'_depth']) for lane in POOL.LANES]
+    def shed():
+        stats = pool.stats()
+        return [((name, lane, how), stats[lane+'_'+how])
+                for lane in POOL.LANES for how in ('dropped', 'rejected')]
+    METRICS.REGISTRY.callback(
+        'hub_pool_depth', "Tasks waiting in thread pool lanes.", 'gauge',
+        ('pool', 'lane'), depth)
+    METRICS.REGISTRY.callback(
+        'hub_pool_shed_total', "Tasks thread pools threw away.", 'counter',
+        ('pool', 'lane', 'how'), shed)
+
+def watch_recorder(recorder):
+    """Export the depth of the player recorder in the metrics."""
+    METRICS.REGISTRY.callback(
+        'hub_recorder_depth', "Player sightings waiting to be written.",
+        'gauge', (), lambda: [((), recorder.stats()['depth'])])
+
+def watch_outbox(outbox):
+    """Export the depth and datagrams of the gossip outbox in the metrics."""
+    def datagrams():
+        stats = outbox.stats()
+        return [(('sent',), stats['datagrams']),
+                (('failed',), stats['send_failures'])]
+    METRICS.REGISTRY.callback(
+        'hub_outbox_depth', "Gossip records waiting to be told.",
+        'gauge', (), lambda: [((), outbox.stats()['depth'])])
+    METRICS.REGISTRY.callback(
+        'hub_gossip_datagrams_total', "Gossip datagrams told, by result.",
+        'counter', ('result',), datagrams)
+
+def check_signed(verifiers, host, data, start, kind):
     """
-    Handle a userinfo packet.
+    Check MD4 checksum of a signed packet whose digest starts at
+    offset start; returns offset of the payload or -1 if we
+    rejected the packet (counted as kind in the metrics).
+    """
+    signed = PACKET.split(data, start)
+    if signed is None:
+        L.debug("invalid md4 length")
+        REJECTED.labels(kind, 'bad_md4').inc()
+        return -1
 
-    Checks packet structure, MD4 checksum, etc. and eventually
-    writes the player record.
+    md4, payload = signed
+    if not verifiers[host].check(md4, payload):
+        L.debug("invalid checksum (secrets probably don't match)")
+        REJECTED.labels(kind, 'bad_md4').inc()
+        return -1
+
+    return len(data)-len(payload)
+
+def check_keys(data, start, end, keys, kind):
     """
-    header, data = data[0:4], data[4:]
-    if header != '\xff\xff\xff\xff':
-        L.debug("invalid packet header")
+    Scan userinfo between offsets start and end for keys;
+    returns None unless we found all of them.
+    """
+    var = PACKET.scan(data, start, keys, end)
+    if len(var) != len(keys):
+        L.debug("%s lacks some of %s", kind, [k for k, _ in keys])
+        REJECTED.labels(kind, 'missing_keys').inc()
         return
+    return var
 
-    md4, data = data.split('\n', 1)
-    if len(md4) != 32:
-        L.debug("invalid md4 length")
+def check_userinfo(config, host, data):
+    """
+    Check a userinfo packet.
+
+    Checks packet structure, MD4 checksum, etc. and returns the
+    parsed userinfo; returns None if we rejected the packet.
+    """
+    if not data.startswith(PACKET.HEADER):
+        L.debug("invalid packet header")
+        REJECTED.labels('userinfo', 'bad_header').inc()
         return
 
-    secret = config['servers'][host][1]
-    checksum = HASH.new('md4', secret+'\n'+data).hexdigest()
-    if md4 != checksum:
-        L.debug("invalid checksum (secrets probably don't match)")
+    payload = check_signed(config['__servers'], host, data,
+                           len(PACKET.HEADER), 'userinfo')
+    if payload < 0:
         return
 
-    kind, data = data.split('\n', 1)
-    if kind != 'userinfo':
+    body = PACKET.body(data, payload, 'userinfo')
+    if body < 0:
         L.debug("not a userinfo packet")
+        REJECTED.labels('userinfo', 'unknown_kind').inc()
         return
 
-    var = parse_userinfo(data)
-    write_player(database, var['name'], var['ip'], var['cl_guid'], host, port)
-    if len(tell) > 0:
-        echo_tell(config, tell, host, port, var)
+    return check_keys(data, body, len(data), USERINFO_KEYS, 'userinfo')
 
-def echo_tell(config, tell, host, port, var):
+def accept_userinfo(recorder, outbox, host, port, var):
     """
-    Send gossip to tell hubs.
+    Accept a checked userinfo: record player and gossip about it.
     """
-    L.debug("echoing packet from %s:%s...", host, port)
-    payload = 'gossip player\n\\server\\%s:%s\\name\\%s\\ip\\%s\\guid\\%s' % (
-        host, port, var['name'], var['ip'], var['cl_guid'])
-    for out in tell:
-        L.debug("...to tell %s", out.getpeername())
-        secret = config['tell'][out.getpeername()[0]][1]
-        md4 = HASH.new('md4', secret+'\n'+payload).hexdigest()
-        packet = md4+'\n'+payload
-        try:
-            # NOTE: using out.send(packet) will fail too if the other
-            # side is not there; strange since the docs say it should
-            # just keep on truckin'
-            out.sendall(packet)
-        except S.error as exc:
-            L.warning("...sendall() failed with %s for %s", exc,
-                      out.getpeername())
+    ACCEPTED_USERINFO.inc()
+    recorder.record(var['name'], var['ip'], var['cl_guid'], host, port)
+    if len(outbox) > 0:
+        outbox.add(host, port, var['name'], var['ip'], var['cl_guid'])
 
-def handle_gossip(config, database, host, port, data):
+def handle_userinfo(config, recorder, outbox, host, port, data):
     """
-    Handle a gossip packet.
+    Handle a userinfo packet.
 
     Checks packet structure, MD4 checksum, etc. and eventually
-    writes the gossip record.
+    hands the player record to the recorder.
     """
-    md4, data = data.split('\n', 1)
-    if len(md4) != 32:
-        L.debug("invalid md4 length")
-        return
+    var = check_userinfo(config, host, data)
+    if var is not None:
+        accept_userinfo(recorder, outbox, host, port, var)
 
-    secret = config['listen'][host][1]
-    checksum = HASH.new('md4', secret+'\n'+data).hexdigest()
-    if md4 != checksum:
-        L.debug("invalid checksum (secrets probably don't match)")
+def check_gossip(config, host, data):
+    """
+    Check a gossip packet.
+
+    Checks packet structure, MD4 checksum, etc. and returns a
+    list of parsed gossip records; returns None if we rejected
+    the packet. A "gossip player" packet has one record, a
+    "gossip players" packet one per line; see outbox.py.
+    """
+    payload = check_signed(config['__listen'], host, data, 0, 'gossip')
+    if payload < 0:
         return
 
-    kind, data = data.split('\n', 1)
-    if kind != 'gossip player':
-        L.debug("not a gossip player packet")
+    body = PACKET.body(data, payload, 'gossip player')
+    if body >= 0:
+        var = check_keys(data, body, len(data), GOSSIP_KEYS, 'gossip')
+        if var is None:
+            return
+        ACCEPTED_GOSSIP.inc()
+        return [var]
+
+    body = PACKET.body(data, payload, OUTBOX.KIND)
+    if body < 0:
+        L.debug("not a gossip packet")
+        REJECTED.labels('gossip', 'unknown_kind').inc()
         return
 
-    var = parse_userinfo(data)
+    records = []
+    for start, end in PACKET.lines(data, body):
+        var = check_keys(data, start, end, GOSSIP_KEYS, 'gossip')
+        if var is not None:
+            records.append(var)
+    ACCEPTED_GOSSIP.inc(len(records))
+    return records
+
+def gossip_record(host, port, var):
+    """
+    Arguments for write_gossip() from checked gossip received
+    from host:port.
+    """
     origin = '%s:%s' % (host, port)
     host, port = var['server'].split(':')
-    write_gossip(database, var['name'], var['ip'], var['guid'], host, port,
-                 origin)
+    return var['name'], var['ip'], var['guid'], host, port, origin
+
+def store_gossip(database, host, port, var):
+    """
+    Store checked gossip received from host:port.
+    """
+    start = TIME.time()
+    write_gossip(database, *gossip_record(host, port, var))
+    DB_WRITE_GOSSIPS.observe(TIME.time() - start)
+
+def handle_gossip(config, database, host, port, data):
+    """
+    Handle a gossip packet.
+
+    Checks packet structure, MD4 checksum, etc. and eventually
+    writes the gossip records.
+    """
+    for var in check_gossip(config, host, data) or []:
+        store_gossip(database, host, port, var)
 
 def handle_packet(packet, host, port, _tp_local):
     """Examine a packet and figure out what to do."""
     loc = _tp_local
     if host in loc.config['servers']:
         L.debug("processing server packet from %s:%s", host, port)
-        handle_userinfo(loc.config, loc.database, loc.tell, host, port, packet)
+        FROM_SERVER.inc()
+        handle_userinfo(loc.config, loc.recorder, loc.outbox, host, port,
+                        packet)
     elif host in loc.config['listen']:
         L.debug("processing listen packet from %s:%s", host, port)
+        FROM_LISTEN.inc()
         handle_gossip(loc.config, loc.database, host, port, packet)
     else:
         L.debug("ignored spurious packet from %s:%s", host, port)
+        FROM_SPURIOUS.inc()
+
+def handle_packets(batch, _tp_local):
+    """Handle a batch of packets from one socket."""
+    for packet, host, port in batch:
+        handle_packet(packet, host, port, _tp_local)
 
-def run(config, servers, listen, tell):
+def run(config, servers, listen, outbox, recorder):
     """
     Receive and handle packets from all our sockets.
     """
@@ -338,29 +480,219 @@ def run(config, servers, listen, tell):
         local.config = config
         local.servers = servers
         local.listen = listen
-        local.tell = tell
-
-    pool = POOL.ThreadPool(init_local=thread_open_database)
+        local.outbox = outbox
+        local.recorder = recorder
+
+    pool = POOL.ThreadPool(max_tasks=config['pool_tasks'],
+                           init_local=thread_open_database,
+                           policy=config['pool_policy'])
+    # userinfo and gossip are bulk work; admin logins and ban
+    # requests will go into the urgent lane once we handle them
+    pool.register(handle_packets, lane=POOL.BULK)
+    watch_pool(pool, 'packets')
+    histogram = BATCH.Histogram(config['batch'])
+    reported = TIME.time()
+    for sock in servers+listen:
+        sock.setblocking(0)
     while True:
         L.debug("sleeping in select")
         ready, _, _ = SEL.select(servers+listen, [], [])
         L.debug("woke up for %s socket(s)", len(ready))
+        tasks = []
         for sock in ready:
             # TODO: could pass sock to thread and read there, but
             # what are the implications of going back into select
             # while another thread could still be reading? seems
             # safer to just read here (although that costs time)
             # and put the handling off into a thread instead
-            packet, (host, port) = sock.recvfrom(4096)
-            L.debug("received packet from %s:%s", host, port)
-            pool.add(handle_packet, packet, host, port)
+            batch = BATCH.drain(sock, config['batch'])
+            histogram.add(len(batch))
+            L.debug("received %s packet(s) from %s", len(batch),
+                    sock.getsockname())
+            if batch:
+                tasks.append((handle_packets, (batch,), {}))
+        shed = pool.add_many(tasks)
+        if shed:
+            L.debug("shed %s batch(es) adding %s", shed, len(tasks))
+        histogram.report()
+        if TIME.time() - reported >= 60:
+            reported = TIME.time()
+            L.info("thread pool stats %s", pool.stats())
+
+def run_async(config, servers, listen, outbox, recorder):
+    """
+    Receive and handle packets from all our sockets.
+
+    Unlike run() we check packets right where we receive them
+    and only hand database work to a dedicated writer thread;
+    see engine.py. Player records go to the recorder anyway.
+    """
+    def thread_open_database(local):
+        """Helper to create thread-local storage."""
+        local.database = open_database(config)
+
+    def write_gossip_task(host, port, var, _tp_local):
+        """Writer thread task."""
+        store_gossip(_tp_local.database, host, port, var)
+
+    # the writer gets single records, not batches
+    writer = POOL.ThreadPool(num_threads=1,
+                             max_tasks=config['pool_tasks']*config['batch'],
+                             init_local=thread_open_database,
+                             policy=config['pool_policy'])
+    watch_pool(writer, 'writer')
+
+    def handle(packet, host, port):
+        """Examine a packet and figure out what to do."""
+        if host in config['servers']:
+            L.debug("processing server packet from %s:%s", host, port)
+            FROM_SERVER.inc()
+            var = check_userinfo(config, host, packet)
+            if var is not None:
+                accept_userinfo(recorder, outbox, host, port, var)
+        elif host in config['listen']:
+            L.debug("processing listen packet from %s:%s", host, port)
+            FROM_LISTEN.inc()
+            for var in check_gossip(config, host, packet) or []:
+                writer.add(write_gossip_task, host, port, var)
+        else:
+            L.debug("ignored spurious packet from %s:%s", host, port)
+            FROM_SPURIOUS.inc()
+
+    ENGINE.run(servers+listen, handle, config['batch'])
 
-def safe_run(config, servers, listen, tell):
+def run_worker(config, writes):
     """
-    Wrapper around run() to catch exceptions.
+    Receive and handle packets in a worker process.
+
+    Each worker binds all server and listen ports itself and
+    checks packets like run_async() does; records go to the
+    writer process through writes, and so do our counters
+    whenever they changed, for the writer's metrics.
     """
+    servers, listen, tell = open_sockets(config, reuse=True)
+    outbox = make_outbox(config, tell)
+    forward = RECORDER.ForwardingRecorder(writes)
+    name = MP.current_process().name
+    sent = [{}]
+
+    def flush():
+        """Forward records and changed counters."""
+        counters = METRICS.REGISTRY.counters()
+        if counters != sent[0]:
+            forward.metrics(name, counters)
+            sent[0] = counters
+        forward.flush()
+
+    def handle(packet, host, port):
+        """Examine a packet and figure out what to do."""
+        if host in config['servers']:
+            L.debug("processing server packet from %s:%s", host, port)
+            FROM_SERVER.inc()
+            var = check_userinfo(config, host, packet)
+            if var is not None:
+                accept_userinfo(forward, outbox, host, port, var)
+        elif host in config['listen']:
+            L.debug("processing listen packet from %s:%s", host, port)
+            FROM_LISTEN.inc()
+            for var in check_gossip(config, host, packet) or []:
+                forward.gossip(*gossip_record(host, port, var))
+        else:
+            L.debug("ignored spurious packet from %s:%s", host, port)
+            FROM_SPURIOUS.inc()
+
     try:
-        run(config, servers, listen, tell)
+        ENGINE.run(servers+listen, handle, config['batch'], flush)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        outbox.close()
+        close_sockets(servers, listen, tell)
+
+def start_workers(config):
+    """
+    Start config['workers'] worker processes.
+
+    The GIL keeps a single process on a single core no matter
+    how many threads we have, so for checking packets we fork
+    worker processes that all bind the same ports. We stay
+    behind as the only writer; see run_workers().
+
+    The kernel picks a worker by hashing the sender's address,
+    so each game server sticks to one worker.
+
+    Call this before starting any threads, forking a process
+    with threads that hold locks (even logging ones) is asking
+    for trouble.
+
+    Raises RuntimeError on systems other than Linux, where we
+    can't have workers share ports.
+    """
+    if SO_REUSEPORT is None:
+        raise RuntimeError(
+            "config file '%s' asks for %s workers, but %s can't spread "
+            "packets between them (no SO_REUSEPORT); set workers = 1" %
+            (config['__name'], config['workers'], PLAT.system())
+        )
+    writes = MP.Queue()
+    workers = []
+    for number in range(config['workers']):
+        worker = MP.Process(target=run_worker, args=(config, writes),
+                            name="Worker-%s" % number)
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    return workers, writes
+
+def run_workers(config, workers, writes, recorder):
+    """
+    Write what the worker processes send us.
+
+    Player records go through the recorder, gossip straight to
+    the database; counters from the workers go into our metrics.
+    """
+    database = open_database(config)
+    # worker name -> counters last merged
+    merged = {}
+    try:
+        while True:
+            for kind, record in writes.get():
+                if kind == 'player':
+                    recorder.record(*record)
+                elif kind == 'gossip':
+                    write_gossip(database, *record)
+                else:
+                    worker, counters = record
+                    METRICS.REGISTRY.merge(merged.get(worker, {}), counters)
+                    merged[worker] = counters
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        close_database(database)
+
+ENGINES = {
+    'pool': run,
+    'async': run_async,
+}
+
+def safe_run(config, servers, listen, outbox, recorder):
+    """
+    Wrapper around run() or run_async() to catch exceptions.
+    """
+    try:
+        L.info("running %s engine", config['engine'])
+        ENGINES[config['engine']](config, servers, listen, outbox, recorder)
+    except BaseException as exc:
+        L.exception("terminated by exception %s", exc)
+
+def safe_run_workers(config, workers, writes, recorder):
+    """
+    Wrapper around run_workers() to catch exceptions.
+    """
+    try:
+        L.info("running %s worker processes", len(workers))
+        run_workers(config, workers, writes, recorder)
     except BaseException as exc:
         L.exception("terminated by exception %s", exc)
 
@@ -376,15 +708,43 @@ def main():
         'Windows': '~/alphahub/config.py',
     }[PLAT.system()]
     config = load_config(OS.path.expanduser(config_path))
-    servers, listen, tell = open_sockets(config)
-    L.debug("bound and connected all sockets")
+    if config['workers'] > 1:
+        workers, writes = start_workers(config)
+    else:
+        servers, listen, tell = open_sockets(config)
+        L.debug("bound and connected all sockets")
+        outbox = make_outbox(config, tell)
     database = open_database(config)
     create_tables(database)
-    safe_run(config, servers, listen, tell)
+    recorder = RECORDER.PlayerRecorder(lambda: open_database(config),
+                                       config['flush_size'],
+                                       config['flush_time'],
+                                       DB_WRITE.labels('players').observe)
+    if config['sighting_window'] > 0:
+        recorder = RECORDER.CachingRecorder(recorder, RECORDER.SightingCache(
+            config['sighting_window'], config['sighting_cache']))
+    watch_recorder(recorder)
+    if config['workers'] <= 1:
+        watch_outbox(outbox)
+    server = None
+    if config['metrics_port'] > 0:
+        server = METRICS.MetricsServer(config['metrics_host'],
+                                       config['metrics_port'])
+    if config['workers'] > 1:
+        safe_run_workers(config, workers, writes, recorder)
+    else:
+        safe_run(config, servers, listen, outbox, recorder)
     L.info("stopping |ALPHA| Hub prototype")
+    if server is not None:
+        server.close()
+    recorder.close()
+    L.info("player recorder stats %s", recorder.stats())
     close_database(database)
-    close_sockets(servers, listen, tell)
-    L.debug("closed all sockets")
+    if config['workers'] <= 1:
+        outbox.close()
+        L.info("gossip outbox stats %s", outbox.stats())
+        close_sockets(servers, listen, tell)
+        L.debug("closed all sockets")
 
 if __name__ == "__main__":
     L.basicConfig(
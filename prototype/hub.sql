@@ -17,20 +17,6 @@ CREATE TABLE IF NOT EXISTS Players (
     PRIMARY KEY (ip, name, guid, server, port)
 );
 
-CREATE TRIGGER IF NOT EXISTS insertPlayer AFTER INSERT ON Players
-BEGIN
-  UPDATE Players
-    SET first = datetime("now"), last = datetime("now")
-      WHERE rowid = new.rowid;
-END;
-
-CREATE TRIGGER IF NOT EXISTS updatePlayer AFTER UPDATE ON Players
-BEGIN
-  UPDATE Players
-    SET last = datetime("now")
-      WHERE rowid = new.rowid;
-END;
-
 -- gossip from other hubs we keep only for reference
 CREATE TABLE IF NOT EXISTS Gossips (
     ip VARCHAR NOT NULL,
@@ -45,19 +31,12 @@ CREATE TABLE IF NOT EXISTS Gossips (
     PRIMARY KEY (ip, name, guid, server, port, origin)
 );
 
-CREATE TRIGGER IF NOT EXISTS insertGossip AFTER INSERT ON Gossips
-BEGIN
-  UPDATE Gossips
-    SET first = datetime("now"), last = datetime("now"), count = 0
-      WHERE rowid = new.rowid;
-END;
-
-CREATE TRIGGER IF NOT EXISTS updateGossip AFTER UPDATE ON Gossips
-BEGIN
-  UPDATE Gossips
-    SET last = datetime("now"),
-        count = (SELECT count FROM Gossips WHERE rowid = new.rowid)+1
-      WHERE rowid = new.rowid;
-END;
+-- timestamps and counts used to be maintained by triggers, now
+-- write_player() and write_gossip() set them in their upserts;
+-- drop the triggers from databases created by older versions
+DROP TRIGGER IF EXISTS insertPlayer;
+DROP TRIGGER IF EXISTS updatePlayer;
+DROP TRIGGER IF EXISTS insertGossip;
+DROP TRIGGER IF EXISTS updateGossip;
 
 COMMIT;
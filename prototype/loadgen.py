@@ -0,0 +1,231 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Synthetic traffic for load testing the hub.
+
+Simulates game servers sending userinfo packets and peer hubs
+sending "gossip player" packets, signed just like the real ones,
+from addresses on the loopback network: game server i sends
+from 127.0.1.i, peer hub j from 127.0.2.j (Linux routes all of
+127.0.0.0/8 to the loopback interface), so the hub can tell
+them apart the same way it tells real ones apart.
+
+Each game server has a number of players; most packets are
+about one of those (the game sends userinfo again on every cvar
+change), but with probability churn a player leaves and a new
+one joins instead. With probability duplicates a packet is sent
+twice in a row. Packets are sent in bursts of burst packets,
+spaced to give rate packets per second on average.
+
+Every new player gets a unique name, and for each of them we
+remember when its first packet was sent, so harness.py can tell
+how long it took until the player was committed.
+
+Run it from the prototype directory against a running hub:
+
+    python loadgen.py --help
+"""
+
+import logging as L
+import optparse as OPT
+import random as RANDOM
+import socket as S
+import time as TIME
+
+import packet as PACKET
+import verify as VERIFY
+
+# everything but name, ip, and cl_guid of a typical ioq3 userinfo
+USERINFO = (
+    "\\cg_predictItems\\1\\cl_anonymous\\0\\cg_rgb\\255 0 0"
+    "\\cg_physics\\1\\gear\\GLAAAAA\\racered\\0\\raceblue\\0"
+    "\\color\\4\\handicap\\100\\sex\\male\\cl_voip\\1"
+    "\\teamtask\\0\\snaps\\20\\rate\\25000\\model\\sarge"
+    "\\headmodel\\sarge\\team_model\\james\\team_headmodel\\*james"
+    "\\funred\\ninja,caplaser\\weapmodes\\0000"
+)
+
+def server_address(index):
+    """Source address of simulated game server index."""
+    return '127.0.1.%s' % (index+1)
+
+def hub_address(index):
+    """Source address of simulated peer hub index."""
+    return '127.0.2.%s' % (index+1)
+
+def secret(address):
+    """Made up secret for a simulated address."""
+    return 'loadgen-%s' % address
+
+def hub_config(servers, hubs, first_port):
+    """
+    The "servers" and "listen" sections a hub needs for our
+    simulated game servers and peer hubs, on consecutive ports
+    from first_port.
+    """
+    section = lambda addresses, port: dict(
+        (address, (port+i, secret(address)))
+        for i, address in enumerate(addresses))
+    return (section([server_address(i) for i in range(servers)], first_port),
+            section([hub_address(i) for i in range(hubs)],
+                    first_port+servers))
+
+def userinfo_packet(verifier, name, ip, guid):
+    """Signed userinfo packet like a game server sends it."""
+    payload = 'userinfo\n\\name\\%s\\ip\\%s:27960\\cl_guid\\%s%s' % (
+        name, ip, guid, USERINFO)
+    return PACKET.HEADER + verifier.sign(payload)
+
+def gossip_packet(verifier, server, name, ip, guid):
+    """Signed "gossip player" packet like a peer hub sends it."""
+    payload = 'gossip player\n\\server\\%s\\name\\%s\\ip\\%s\\guid\\%s' % (
+        server, name, ip, guid)
+    return verifier.sign(payload)
+
+class Source(object):
+    """A simulated game server or peer hub and its players."""
+
+    def __init__(self, address, target, players):
+        """Bind a socket on address for sending to target."""
+        self.address = address
+        self.target = target
+        self.verifier = VERIFY.Verifier(secret(address))
+        self.sock = S.socket(S.AF_INET, S.SOCK_DGRAM)
+        self.sock.bind((address, 0))
+        self.players = [None]*players
+
+    def close(self):
+        """Close our socket."""
+        self.sock.close()
+
+class LoadGenerator(object):
+    """Sends synthetic userinfo and gossip to a hub."""
+
+    def __init__(self, host, first_port, servers, hubs, players=16,
+                 churn=0.05, duplicates=0.0, seed=None):
+        """
+        Initialize servers simulated game servers and hubs peer
+        hubs for a hub on host configured by hub_config() with
+        the same first_port. Each one has players players.
+        """
+        assert 0 <= churn <= 1
+        assert 0 <= duplicates <= 1
+        self.__sources = (
+            [Source(server_address(i), (host, first_port+i), players)
+             for i in range(servers)] +
+            [Source(hub_address(i), (host, first_port+servers+i), players)
+             for i in range(hubs)])
+        self.__servers = servers
+        self.__churn = churn
+        self.__duplicates = duplicates
+        self.__random = RANDOM.Random(seed)
+        self.__next = 0
+        # when each new player's first packet went out, by name
+        self.first_sent = {}
+        # counters
+        self.sent = 0
+        self.failures = 0
+
+    def close(self):
+        """Close all sockets."""
+        for source in self.__sources:
+            source.close()
+
+    def __player(self, source):
+        """Pick a player of source, maybe replacing it by a new one."""
+        index = self.__random.randrange(len(source.players))
+        player = source.players[index]
+        if player is None or self.__random.random() < self.__churn:
+            self.__next += 1
+            player = ('player%s' % self.__next,
+                      '10.%s.%s.%s' % (self.__next >> 16 & 255,
+                                       self.__next >> 8 & 255,
+                                       self.__next & 255),
+                      '%032X' % self.__next)
+            source.players[index] = player
+        return player
+
+    def __packet(self, source, player):
+        """Packet about player from source."""
+        if source.address.startswith('127.0.1.'):
+            return userinfo_packet(source.verifier, *player)
+        server = '%s:27960' % server_address(
+            self.__random.randrange(max(self.__servers, 1)))
+        return gossip_packet(source.verifier, server, *player)
+
+    def send_one(self):
+        """Send one packet (or two, if it's a duplicate)."""
+        source = self.__random.choice(self.__sources)
+        player = self.__player(source)
+        data = self.__packet(source, player)
+        copies = 2 if self.__random.random() < self.__duplicates else 1
+        now = TIME.time()
+        self.first_sent.setdefault(player[0], now)
+        for _ in range(copies):
+            try:
+                source.sock.sendto(data, source.target)
+                self.sent += 1
+            except S.error as exc:
+                self.failures += 1
+                L.debug("sendto() failed with %s", exc)
+
+    def run(self, duration, rate, burst=1):
+        """
+        Send rate packets per second on average for duration
+        seconds, in bursts of burst packets.
+        """
+        assert rate > 0
+        assert burst > 0
+        gap = float(burst) / rate
+        start = TIME.time()
+        due = start
+        while due-start < duration:
+            wait = due - TIME.time()
+            if wait > 0:
+                TIME.sleep(wait)
+            for _ in range(burst):
+                self.send_one()
+            due += gap
+
+def options():
+    """Command line options shared with harness.py."""
+    parser = OPT.OptionParser()
+    parser.add_option('--servers', type='int', default=4,
+                      help="simulated game servers [%default]")
+    parser.add_option('--hubs', type='int', default=1,
+                      help="simulated peer hubs [%default]")
+    parser.add_option('--players', type='int', default=16,
+                      help="players per server or hub [%default]")
+    parser.add_option('--churn', type='float', default=0.05,
+                      help="chance a packet is about a new player [%default]")
+    parser.add_option('--duplicates', type='float', default=0.0,
+                      help="chance a packet is sent twice [%default]")
+    parser.add_option('--rate', type='float', default=1000.0,
+                      help="packets per second [%default]")
+    parser.add_option('--burst', type='int', default=1,
+                      help="packets per burst [%default]")
+    parser.add_option('--duration', type='float', default=10.0,
+                      help="seconds to send for [%default]")
+    parser.add_option('--port', type='int', default=27000,
+                      help="first hub port [%default]")
+    parser.add_option('--seed', type='int', default=None,
+                      help="random seed")
+    return parser
+
+def main():
+    """Send traffic to a hub configured with hub_config()."""
+    parser = options()
+    parser.add_option('--host', default='127.0.0.1',
+                      help="hub address [%default]")
+    opts, _ = parser.parse_args()
+    generator = LoadGenerator(opts.host, opts.port, opts.servers, opts.hubs,
+                              opts.players, opts.churn, opts.duplicates,
+                              opts.seed)
+    generator.run(opts.duration, opts.rate, opts.burst)
+    generator.close()
+    print "sent %s packet(s), %s new player(s), %s failure(s)" % (
+        generator.sent, len(generator.first_sent), generator.failures)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Metrics for the hub in the Prometheus text format.
+
+A registry holds families of counters, gauges, and histograms,
+each with a fixed set of label names; a family hands out one
+child per combination of label values. Updating a child takes
+a lock and an addition, so hot paths should look their
+children up once and keep them around:
+
+    RECEIVED = REGISTRY.counter('packets_received_total',
+                                "Packets received.", ('source',))
+    FROM_SERVERS = RECEIVED.labels('server')
+    ...
+    FROM_SERVERS.inc()
+
+Numbers that some object already keeps, like the depth of a
+queue, don't need updating at all: a callback family asks for
+them only when someone scrapes the registry.
+
+Worker processes count into their own copy of the registry;
+they send counters() snapshots to the parent, which merge()s
+them into the registry it serves.
+
+MetricsServer serves the registry over HTTP; point Prometheus
+(or curl) at http://host:port/metrics.
+"""
+
+import BaseHTTPServer as HTTP
+import bisect as BISECT
+import logging as L
+import threading as T
+
+# in seconds, good for database writes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape(value):
+    """Escape a label value."""
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+def format_labels(names, values):
+    """Label set like {a="1",b="2"}, empty without labels."""
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value))
+                             for name, value in zip(names, values))
+
+def format_value(value):
+    """Sample value the way Prometheus spells it."""
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class Counter(object):
+    """A number that only goes up."""
+
+    def __init__(self):
+        self.__lock = T.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Add amount (not negative!)."""
+        with self.__lock:
+            self.value += amount
+
+    def samples(self, name, names, values):
+        """Lines for this child."""
+        return ['%s%s %s' % (name, format_labels(names, values),
+                             format_value(self.value))]
+
+class Gauge(Counter):
+    """A number that goes up and down."""
+
+    def set(self, value):
+        """Replace the value."""
+        self.value = value
+
+    def dec(self, amount=1):
+        """Subtract amount."""
+        self.inc(-amount)
+
+class Histogram(object):
+    """Observations counted into buckets by upper bound."""
+
+    def __init__(self, buckets):
+        self.__lock = T.Lock()
+        self.__buckets = buckets
+        # the last one is +Inf
+        self.__counts = [0]*(len(buckets)+1)
+        self.__sum = 0.0
+
+    def observe(self, value):
+        """Count value into its bucket."""
+        index = BISECT.bisect_left(self.__buckets, value)
+        with self.__lock:
+            self.__counts[index] += 1
+            self.__sum += value
+
+    def samples(self, name, names, values):
+        """Lines for this child, buckets are cumulative."""
+        with self.__lock:
+            counts = list(self.__counts)
+            total = self.__sum
+        lines = []
+        count = 0
+        for bound, hits in zip(self.__buckets+(float('inf'),), counts):
+            count += hits
+            lines.append('%s_bucket%s %s' % (
+                name, format_labels(names+('le',), values+(format_value(
+                    float(bound)),)), count))
+        labels = format_labels(names, values)
+        lines.append('%s_sum%s %s' % (name, labels, format_value(total)))
+        lines.append('%s_count%s %s' % (name, labels, count))
+        return lines
+
+class Family(object):
+    """Metric with a name, help text, type, and one child per label set."""
+
+    def __init__(self, name, doc, kind, labelnames, make):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.__make = make
+        self.__lock = T.Lock()
+        self.__children = {}
+
+    def labels(self, *values):
+        """The child for these label values, made on first use."""
+        assert len(values) == len(self.labelnames)
+        child = self.__children.get(values)
+        if child is None:
+            with self.__lock:
+                child = self.__children.setdefault(values, self.__make())
+        return child
+
+    def values(self):
+        """Values of all children by label values, not for histograms."""
+        with self.__lock:
+            return dict((values, child.value)
+                        for values, child in self.__children.iteritems())
+
+    def samples(self):
+        """Lines for all children."""
+        with self.__lock:
+            children = sorted(self.__children.items())
+        lines = []
+        for values, child in children:
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+class CallbackFamily(object):
+    """
+    Metric whose samples come from calling collect() when we're
+    scraped; it returns a list of (label values, value) pairs.
+    """
+
+    def __init__(self, name, doc, kind, labelnames, collect):
+        self.name = name
+        self.doc = doc
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.__collect = collect
+
+    def samples(self):
+        """Lines for whatever collect() says."""
+        return ['%s%s %s' % (self.name,
+                             format_labels(self.labelnames, tuple(values)),
+                             format_value(value))
+                for values, value in self.__collect()]
+
+class Registry(object):
+    """All the metrics we export."""
+
+    def __init__(self, prefix=''):
+        """Initialize an empty registry, names get prefix prepended."""
+        self.__prefix = prefix
+        self.__lock = T.Lock()
+        self.__families = {}
+
+    def __add(self, family):
+        """Add family unless we have one of that name already."""
+        with self.__lock:
+            return self.__families.setdefault(family.name, family)
+
+    def counter(self, name, doc, labelnames=()):
+        """Family of counters."""
+        return self.__add(Family(self.__prefix+name, doc, 'counter',
+                                 labelnames, Counter))
+
+    def gauge(self, name, doc, labelnames=()):
+        """Family of gauges."""
+        return self.__add(Family(self.__prefix+name, doc, 'gauge',
+                                 labelnames, Gauge))
+
+    def histogram(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        """Family of histograms with the given bucket upper bounds."""
+        buckets = tuple(sorted(buckets))
+        return self.__add(Family(self.__prefix+name, doc, 'histogram',
+                                 labelnames, lambda: Histogram(buckets)))
+
+    def callback(self, name, doc, kind, labelnames, collect):
+        """
+        Family of counters or gauges (kind) from collect(); this
+        replaces an earlier callback family of the same name, so
+        a new pool or queue can take over from an old one.
+        """
+        family = CallbackFamily(self.__prefix+name, doc, kind, labelnames,
+                                collect)
+        with self.__lock:
+            self.__families[family.name] = family
+        return family
+
+    def counters(self):
+        """
+        Snapshot of all counters as {(name, label values): value},
+        for passing to merge() in another process.
+        """
+        with self.__lock:
+            families = [family for family in self.__families.itervalues()
+                        if isinstance(family, Family) and
+                        family.kind == 'counter']
+        snapshot = {}
+        for family in families:
+            for values, value in family.values().iteritems():
+                snapshot[(family.name, values)] = value
+        return snapshot
+
+    def merge(self, previous, current):
+        """
+        Add what counters went up by from snapshot previous to
+        snapshot current, both from counters() of a registry in
+        another process, to our counters of the same names.
+        """
+        for (name, values), value in current.iteritems():
+            increase = value - previous.get((name, values), 0)
+            if not increase:
+                continue
+            with self.__lock:
+                family = self.__families.get(name)
+            if family is None:
+                L.warning("can't merge unknown counter %s", name)
+                continue
+            family.labels(*values).inc(increase)
+
+    def render(self):
+        """Everything in the Prometheus text format."""
+        with self.__lock:
+            families = sorted(self.__families.items())
+        lines = []
+        for name, family in families:
+            try:
+                samples = family.samples()
+            except Exception as exc:
+                L.exception("collecting metric %s failed: %s", name, exc)
+                continue
+            lines.append('# HELP %s %s' % (name, family.doc.replace(
+                '\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, family.kind))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+class _Handler(HTTP.BaseHTTPRequestHandler):
+    """Answers GET /metrics with the server's registry."""
+
+    def do_GET(self):
+        """Send the metrics, or 404 for other paths."""
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log to our log instead of stderr."""
+        L.debug("metrics request from %s: %s", self.client_address[0],
+                format % args)
+
+class MetricsServer(object):
+    """Serves a registry over HTTP from a background thread."""
+
+    def __init__(self, host, port, registry=REGISTRY):
+        """Bind host:port and start serving registry."""
+        self.__server = HTTP.HTTPServer((host, port), _Handler)
+        self.__server.registry = registry
+        self.address = self.__server.server_address
+        self.__thread = T.Thread(target=self.__server.serve_forever,
+                                 name="MetricsServer")
+        self.__thread.daemon = True
+        self.__thread.start()
+        L.info("serving metrics on http://%s:%s/metrics", *self.address)
+
+    def close(self):
+        """Stop serving."""
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
@@ -0,0 +1,141 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Coalescing gossip outbox.
+
+Userinfo churns a lot while a player is connected, and we used
+to tell every tell hub about every single userinfo packet. Most
+of those told the other hubs nothing new. The outbox tells a
+player (server, name, ip, guid) to other hubs at most once per
+window, and packs as many players as fit into one datagram:
+
+    gossip players
+    \\server\\1.2.3.4:27960\\name\\foo\\ip\\5.6.7.8\\guid\\0123...
+    \\server\\1.2.3.4:27960\\name\\bar\\ip\\9.8.7.6\\guid\\4567...
+
+A background thread sends whatever is pending once its oldest
+record waited long enough, or as soon as a datagram is full;
+add() itself never touches the network. A single record too
+large for a datagram is dropped, records can't span them.
+"""
+
+import logging as L
+import socket as S
+import time as TIME
+
+import writebehind as WRITEBEHIND
+
+KIND = 'gossip players'
+
+class GossipOutbox(WRITEBEHIND.WriteBehind):
+    """Gossip waiting to be told to our tell hubs."""
+
+    def __init__(self, tell, window=30.0, delay=1.0, mtu=1400):
+        """
+        Initialize and start a new outbox for tell, a list of
+        (socket, verifier, peer) tuples.
+
+        A player is told at most once per window seconds; records
+        wait at most delay seconds; datagrams are at most mtu
+        bytes long, digest included.
+        """
+        assert window >= 0
+        assert mtu > 512
+        self.__tell = tell
+        self.__window = window
+        # room for records: digest, newline, kind, newline
+        self.__room = mtu-32-1-len(KIND)-1
+        self.__told = {}
+        self.__forgotten = TIME.time()
+        # counters, read them through stats()
+        self.__offered = 0
+        self.__dropped = 0
+        self.__oversized = 0
+        self.__datagrams = 0
+        self.__send_failures = 0
+        super(GossipOutbox, self).__init__(self.__room, delay)
+
+    def __len__(self):
+        return len(self.__tell)
+
+    def add(self, host, port, name, ip, guid):
+        """
+        Tell hubs about a player on game server host:port,
+        eventually; never waits for the network, the background
+        thread does the sending.
+        """
+        server = '%s:%s' % (host, port)
+        key = (server, name, ip, guid)
+        record = '\\server\\%s\\name\\%s\\ip\\%s\\guid\\%s' % key
+        now = TIME.time()
+        with self._cond:
+            self.__offered += 1
+            if len(record)+1 > self.__room:
+                # records can't span datagrams
+                self.__oversized += 1
+                L.warning("record for %s on %s too large to tell",
+                          name, server)
+                return
+            if now - self.__told.get(key, -self.__window) < self.__window:
+                self.__dropped += 1
+                return
+            self.__told[key] = now
+            if now - self.__forgotten >= self.__window:
+                self.__forget(now)
+            self._pending().append(record)
+            self._added()
+
+    def _size(self, pending):
+        """Bytes pending records take up in datagrams."""
+        return sum(len(record)+1 for record in pending)
+
+    def _counters(self):
+        return {
+            'offered': self.__offered,
+            'dropped': self.__dropped,
+            'oversized': self.__oversized,
+            'datagrams': self.__datagrams,
+            'send_failures': self.__send_failures,
+        }
+
+    def _write(self, _resource, pending):
+        """Pack pending records into datagrams and send them."""
+        records = []
+        size = 0
+        for record in pending:
+            if records and size+len(record)+1 > self.__room:
+                self.__send(records)
+                records = []
+                size = 0
+            records.append(record)
+            size += len(record)+1
+        if records:
+            self.__send(records)
+
+    def __forget(self, now):
+        """Forget players told long enough ago, call with lock held."""
+        expired = [key for key, when in self.__told.iteritems()
+                   if now - when >= self.__window]
+        for key in expired:
+            del self.__told[key]
+        self.__forgotten = now
+
+    def __send(self, records):
+        """Send records to all tell hubs, without holding the lock."""
+        payload = KIND+'\n'+'\n'.join(records)
+        sent = failed = 0
+        for out, verifier, peer in self.__tell:
+            L.debug("telling %s about %s player(s)", peer, len(records))
+            try:
+                # NOTE: using out.send(packet) will fail too if the other
+                # side is not there; strange since the docs say it should
+                # just keep on truckin'
+                out.sendall(verifier.sign(payload))
+                sent += 1
+            except S.error as exc:
+                failed += 1
+                L.warning("...sendall() failed with %s for %s", exc, peer)
+        with self._cond:
+            self.__datagrams += sent
+            self.__send_failures += failed
@@ -0,0 +1,84 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Single-pass packet parsing.
+
+Splitting a packet into header, digest, kind, and userinfo and
+then splitting the userinfo into keys and values copies every
+packet several times over, and most of those copies are of
+keys we never look at. Here we work with offsets into the
+packet instead: the digest is checked against a memoryview of
+the payload, and of the userinfo we only copy the values for
+the keys we actually want.
+
+Packets look like this, the header is only present in packets
+from game servers:
+
+    \\xff\\xff\\xff\\xff<md4 hex digest>\\n<kind>\\n\\key\\value\\key\\value...
+"""
+
+HEADER = '\xff\xff\xff\xff'
+DIGEST = 32
+
+def split(data, start):
+    """
+    Find digest and payload of a signed packet whose digest
+    starts at offset start; returns (digest, payload) where
+    payload is a memoryview, or None if the packet is broken.
+    """
+    end = start+DIGEST
+    if data.find('\n', start, end+1) != end:
+        return None
+    return data[start:end], memoryview(data)[end+1:]
+
+def body(data, start, kind):
+    """
+    Offset of the body if the payload starting at offset start
+    is of the given kind, otherwise -1.
+    """
+    end = start+len(kind)
+    if data.startswith(kind, start) and data.startswith('\n', end):
+        return end+1
+    return -1
+
+def wanted(*keys):
+    """Prepare keys for scan()."""
+    return tuple((key, '\\'+key+'\\') for key in keys)
+
+def scan(data, start, keys, end=None):
+    """
+    Scan userinfo \\key\\value pairs from offset start up to
+    offset end (default the end of data), return a dictionary
+    for the given keys (from wanted()) only. Keys
+    that appear more than once keep their last value, like
+    they did when we built a dict of all pairs.
+
+    Instead of walking all pairs we search for each key we want
+    directly, from the end; backslashes can't appear in keys or
+    values, so a match is a key if an even number of
+    backslashes precede it.
+    """
+    if end is None:
+        end = len(data)
+    found = {}
+    for key, pattern in keys:
+        pos = data.rfind(pattern, start, end)
+        while pos != -1 and data.count('\\', start, pos) % 2:
+            # matches may overlap, so look for one starting before pos
+            pos = data.rfind(pattern, start, pos+len(pattern)-1)
+        if pos == -1:
+            continue
+        value = pos+len(pattern)
+        value_end = data.find('\\', value, end)
+        found[key] = data[value:value_end if value_end != -1 else end]
+    return found
+
+def lines(data, start):
+    """Yield (start, end) offsets of the lines from offset start."""
+    while start < len(data):
+        end = data.find('\n', start)
+        if end == -1:
+            end = len(data)
+        yield start, end
+        start = end+1
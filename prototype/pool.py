@@ -24,8 +24,26 @@ This thread pool assumes that all tasks are throwaway. It
 doesn't care if they finish and it certainly doesn't care
 to tell anyone that a task is done. Also, while some pools
 go to great lengths to cope with blocked threads, this one
-assumes that your application is broken if no progress can
-be made for a certain amount of time; see add() below.
+simply throws tasks away once too many are waiting; see
+add() below.
+
+Priority Lanes
+==============
+
+Tasks wait in lanes, and workers always take the oldest task
+of the most urgent lane that has any. Each lane holds at most
+so many tasks; when a lane is full, the pool sheds load with
+one of these policies:
+
+- "drop-oldest" drops the oldest waiting task of the lane to
+  make room for the new one (the default, old news is the
+  least interesting news)
+- "drop-newest" drops the new task
+- "reject" drops all tasks of an add_many() call for a lane
+  if they don't all fit
+
+Either way add() never blocks the caller. Which lane a task
+goes to is decided per callable; see register() below.
 
 Thread-local Storage
 ====================
@@ -36,12 +54,21 @@ own database connection.
 
 This thread pool automatically equips each worker with local
 storage; see __init__() and add() below.
+
+Whether a task wants thread-local storage is figured out once
+per callable and then remembered; see register() below.
 """
 
+import collections as C
 import inspect as I
 import logging as L
-import Queue as Q
 import threading as T
+import time as TIME
+
+URGENT = 'urgent'
+BULK = 'bulk'
+LANES = (URGENT, BULK)
+POLICIES = ('drop-oldest', 'drop-newest', 'reject')
 
 class _NullHandler(L.Handler):
     """Logging handler that does nothing."""
@@ -49,13 +76,105 @@ class _NullHandler(L.Handler):
         pass
 L.getLogger("com.urbanban.threading.throwaway.pool").addHandler(_NullHandler())
 
+class _Lane(object):
+    """One lane of the task queue and its counters."""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.tasks = C.deque()
+        self.queued = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.taken = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+class _TaskQueue(object):
+    """Task queue with priority lanes that sheds load when full."""
+
+    def __init__(self, lanes, maxsize, policy):
+        """
+        Initialize lanes, most urgent first, each holding at most
+        maxsize tasks; policy says what to do when one is full.
+        """
+        assert policy in POLICIES
+        self.lanes = [_Lane(name, maxsize) for name in lanes]
+        self.policy = policy
+        self.not_empty = T.Condition()
+
+    def put_many(self, items):
+        """
+        Put (lane index, task) items, return how many tasks we
+        shed doing so: items we didn't queue plus, for
+        drop-oldest, waiting tasks we dropped to make room.
+        """
+        now = TIME.time()
+        shed = 0
+        with self.not_empty:
+            if self.policy == 'reject':
+                fitting = self.__fitting(items)
+                shed += len(items)-len(fitting)
+                items = fitting
+            for index, task in items:
+                lane = self.lanes[index]
+                if len(lane.tasks) >= lane.maxsize:
+                    lane.dropped += 1
+                    shed += 1
+                    if self.policy != 'drop-oldest':
+                        continue
+                    lane.tasks.popleft()
+                lane.tasks.append((now, task))
+                lane.queued += 1
+                self.not_empty.notify()
+        return shed
+
+    def get(self):
+        """Remove and return the next task, wait for one if necessary."""
+        with self.not_empty:
+            while True:
+                for lane in self.lanes:
+                    if lane.tasks:
+                        queued_at, task = lane.tasks.popleft()
+                        wait = TIME.time() - queued_at
+                        lane.taken += 1
+                        lane.wait_total += wait
+                        lane.wait_max = max(lane.wait_max, wait)
+                        return task
+                self.not_empty.wait()
+
+    def stats(self):
+        """Snapshot of all lane counters as a dictionary."""
+        stats = {}
+        with self.not_empty:
+            for lane in self.lanes:
+                stats[lane.name+'_depth'] = len(lane.tasks)
+                for counter in ('queued', 'dropped', 'rejected', 'taken',
+                                'wait_total', 'wait_max'):
+                    stats[lane.name+'_'+counter] = getattr(lane, counter)
+        return stats
+
+    def __fitting(self, items):
+        """
+        Items for lanes that have room for all of them, counting
+        the others as rejected; call with lock held.
+        """
+        wanted = C.Counter(index for index, _ in items)
+        full = set()
+        for index, count in wanted.iteritems():
+            lane = self.lanes[index]
+            if len(lane.tasks) + count > lane.maxsize:
+                lane.rejected += count
+                full.add(index)
+        return [(index, task) for index, task in items if index not in full]
+
 class _Worker(T.Thread):
     """Worker thread, don't instantiate directly!"""
 
     def __init__(self, task_queue, init_local=None):
         """Initialize and start a new worker."""
         super(_Worker, self).__init__()
-        assert isinstance(task_queue, Q.Queue)
+        assert isinstance(task_queue, _TaskQueue)
         assert init_local is None or callable(init_local)
         self.__task_queue = task_queue
         self.__init_local = init_local
@@ -79,14 +198,12 @@ class _Worker(T.Thread):
         while True:
             task = self.__task_queue.get()
             self.__run_task(task, storage)
-            self.__task_queue.task_done()
 
     def __run_task(self, task, storage):
         """Run a single task."""
-        func, args, kwargs = task
-        required_args, _, _, _ = I.getargspec(func)
+        func, wants_local, args, kwargs = task
         try:
-            if '_tp_local' in required_args:
+            if wants_local:
                 func(_tp_local=storage, *args, **kwargs)
             else:
                 func(*args, **kwargs)
@@ -99,14 +216,18 @@ class _Worker(T.Thread):
 class ThreadPool(object):
     """The thread pool."""
 
-    def __init__(self, num_threads=4, max_tasks=16, timeout=32,
-                 init_local=None, stack_size=None):
+    def __init__(self, num_threads=4, max_tasks=16, timeout=None,
+                 init_local=None, stack_size=None, lanes=LANES,
+                 policy='drop-oldest'):
         """
         Initialize and start a new thread pool.
 
-        Exactly num_threads will be spawned. At most max_tasks
-        can be queued before add() blocks; add() blocks for at
-        most timeout seconds before raising an exception.
+        Exactly num_threads will be spawned. Tasks wait in lanes,
+        given by name and most urgent first; at most max_tasks
+        can wait in each lane before add() sheds load according
+        to policy, one of POLICIES. Since add() never blocks any
+        more, timeout is ignored; it's only still here so callers
+        can keep passing arguments by position.
 
         You can pass a callable with one argument as init_local
         to initialize thread-local storage for each thread; see
@@ -122,16 +243,54 @@ class ThreadPool(object):
         """
         assert num_threads > 0
         assert max_tasks > 0
-        assert timeout > 0
+        assert len(lanes) > 0
+        assert policy in POLICIES
         # TODO: undocumented and probably a very bad idea
         assert stack_size is None or stack_size > 16*4096
         if stack_size is not None:
             T.stack_size(stack_size)
-        self.__queue = Q.Queue(max_tasks)
-        self.__timeout = timeout
+        self.__queue = _TaskQueue(lanes, max_tasks, policy)
+        self.__lanes = dict((name, index) for index, name in enumerate(lanes))
+        self.__registered = {}
         for _ in range(num_threads):
             _Worker(self.__queue, init_local)
 
+    def register(self, func, wants_local=None, lane=None):
+        """
+        Register a task callable, how to call it, and which lane
+        its tasks wait in.
+
+        Pass wants_local to say whether func requires the special
+        "_tp_local" argument; leave it out to have us find out by
+        looking at the arguments of func. Pass the name of a lane
+        to put tasks for func there; leave it out for the least
+        urgent lane. Callables that are not registered explicitly
+        get registered by add() the first time we see them, so
+        calling register() is only necessary for callables we
+        can't inspect, like functools.partial, or for callables
+        whose tasks are more urgent than others.
+        """
+        assert callable(func)
+        assert lane is None or lane in self.__lanes
+        if wants_local is None:
+            try:
+                required_args, _, _, _ = I.getargspec(func)
+            except TypeError:
+                required_args = []
+            wants_local = '_tp_local' in required_args
+        index = self.__lanes[lane] if lane is not None else len(self.__lanes)-1
+        self.__registered[func] = (wants_local, index)
+        return wants_local
+
+    def __item(self, func, args, kwargs):
+        """Make a (lane index, task tuple) item for the queue."""
+        registered = self.__registered.get(func)
+        if registered is None:
+            self.register(func)
+            registered = self.__registered[func]
+        wants_local, index = registered
+        return index, (func, wants_local, args, kwargs)
+
     def add(self, func, *args, **kwargs):
         """
         Add a task.
@@ -152,9 +311,36 @@ class ThreadPool(object):
                 _tp_local.connection.commit()
             ...
             pool.add(task, act, ual, ments=parameters)
+
+        Returns True if all went well, False if we had to shed a
+        task: this one, or with drop-oldest the oldest task
+        waiting in its lane, which makes room for this one.
         """
         assert callable(func)
-        self.__queue.put((func, args, kwargs), True, self.__timeout)
+        return self.__queue.put_many([self.__item(func, args, kwargs)]) == 0
+
+    def add_many(self, tasks):
+        """
+        Add several tasks at once.
+
+        Each task is a (func, args, kwargs) tuple, for example:
+
+            pool.add_many([(task, (1, 2), {}), (task, (3, 4), {})])
+
+        The tasks go into the queue while we hold its lock only
+        once. Returns how many tasks we shed, 0 if all went well;
+        like for add() these can be tasks that were waiting.
+        """
+        return self.__queue.put_many([self.__item(*task) for task in tasks])
+
+    def stats(self):
+        """
+        Snapshot of the lane counters as a dictionary; for each
+        lane there's its depth, how many tasks were queued, dropped,
+        rejected, and taken by workers, and how long those waited
+        in total and at most, in seconds.
+        """
+        return self.__queue.stats()
 
 def test():
     """Simple example and test case."""
@@ -177,9 +363,14 @@ def test():
 
     pool = ThreadPool(init_local=init_local)
     L.info("starting to add tasks to pool")
+    shed = 0
     for i in range(32):
-        pool.add(task, i)
-    L.info("all tasks added, press CTRL-C to exit")
+        if not pool.add(task, i):
+            L.info("shed a task to make room for task %s", i)
+            shed += 1
+    stats = pool.stats()
+    assert shed == stats['bulk_dropped'] + stats['bulk_rejected']
+    L.info("all tasks added, %s shed, press CTRL-C to exit", shed)
     pause()
 
 if __name__ == "__main__":
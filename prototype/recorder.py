@@ -0,0 +1,257 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+A write-behind recorder for player sightings.
+
+Game servers send userinfo packets in bursts, and writing
+each one with its own transaction makes the whole hub wait
+for SQLite to sync the disk once per packet. The recorder
+collects sightings in memory instead, merges repeated ones,
+and writes them all in a single transaction once enough of
+them piled up or the oldest has waited long enough.
+
+A sighting that's still in memory is lost if the hub dies,
+which is fine for us: the game servers will tell us about
+the player again soon enough.
+
+Game servers also send userinfo on every cvar change, so most
+sightings are of players we've just recorded. A CachingRecorder
+in front of the recorder remembers recent sightings and passes
+a player on only if we haven't seen it for a while; its "last"
+time then lags behind by at most that long.
+"""
+
+import collections as C
+import logging as L
+import threading as T
+import time as TIME
+
+import writebehind as WRITEBEHIND
+
+UPSERT = """INSERT INTO Players (name, ip, guid, server, port, first, last)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (ip, name, guid, server, port)
+            DO UPDATE SET last = excluded.last"""
+
+def timestamp(when=None):
+    """Format time (default now) like SQLite's datetime("now")."""
+    return TIME.strftime("%Y-%m-%d %H:%M:%S", TIME.gmtime(when))
+
+class PlayerRecorder(WRITEBEHIND.WriteBehind):
+    """
+    Write-behind stage for player records.
+
+    A background thread with its own database connection
+    writes the collected sightings; record() never touches
+    the database itself.
+    """
+
+    def __init__(self, open_database, flush_size=256, flush_time=1.0,
+                 observe=None):
+        """
+        Initialize and start a new recorder.
+
+        The open_database callable is used by the background
+        thread to get its connection. Sightings are written as
+        soon as flush_size distinct ones are waiting, but no
+        later than flush_time seconds after the first of them
+        arrived. If given, observe is called with the latency
+        of each write, say to feed a metrics histogram.
+        """
+        assert callable(open_database)
+        assert observe is None or callable(observe)
+        self.__open_database = open_database
+        self.__observe = observe
+        # counters, read them through stats()
+        self.__recorded = 0
+        self.__merged = 0
+        self.__latency_last = 0.0
+        self.__latency_max = 0.0
+        self.__latency_total = 0.0
+        super(PlayerRecorder, self).__init__(flush_size, flush_time)
+
+    def record(self, name, ip, guid, server, port):
+        """Remember a player sighting, write it later."""
+        key = (name, ip, guid, server, port)
+        now = timestamp()
+        with self._cond:
+            pending = self._pending()
+            self.__recorded += 1
+            seen = pending.get(key)
+            if seen is None:
+                pending[key] = [now, now]
+                self._added()
+            else:
+                seen[1] = now
+                self.__merged += 1
+
+    def _empty(self):
+        return {}
+
+    def _counters(self):
+        return {
+            'recorded': self.__recorded,
+            'merged': self.__merged,
+            'latency_last': self.__latency_last,
+            'latency_max': self.__latency_max,
+            'latency_total': self.__latency_total,
+        }
+
+    def _open(self):
+        return self.__open_database()
+
+    def _write(self, database, pending):
+        """Write pending sightings in one transaction."""
+        rows = [key+tuple(seen) for key, seen in pending.iteritems()]
+        start = TIME.time()
+        with database:
+            database.executemany(UPSERT, rows)
+        latency = TIME.time() - start
+        if self.__observe is not None:
+            self.__observe(latency)
+        with self._cond:
+            self.__latency_last = latency
+            self.__latency_max = max(self.__latency_max, latency)
+            self.__latency_total += latency
+        L.debug("wrote %s player(s) in %.3f seconds", len(rows), latency)
+
+    def _close(self, database):
+        database.close()
+
+class ForwardingRecorder(object):
+    """
+    Recorder stand-in for worker processes.
+
+    Collects player and gossip records, and snapshots of the
+    worker's metrics, and forwards them to the writer process
+    through a multiprocessing queue, one list of records per
+    flush() to keep the queue traffic low.
+    """
+
+    def __init__(self, queue):
+        """Initialize a new recorder forwarding to queue."""
+        self.__queue = queue
+        self.__pending = []
+
+    def record(self, name, ip, guid, server, port):
+        """Remember a player sighting until the next flush()."""
+        self.__pending.append(('player', (name, ip, guid, server, port)))
+
+    def gossip(self, name, ip, guid, server, port, origin):
+        """Remember a gossip record until the next flush()."""
+        self.__pending.append(
+            ('gossip', (name, ip, guid, server, port, origin)))
+
+    def metrics(self, worker, counters):
+        """
+        Remember a snapshot of worker's counters (from counters()
+        of a metrics registry) until the next flush().
+        """
+        self.__pending.append(('metrics', (worker, counters)))
+
+    def flush(self):
+        """Forward all records we have."""
+        if self.__pending:
+            self.__queue.put(self.__pending)
+            self.__pending = []
+
+class SightingCache(object):
+    """
+    Bounded cache of recent sightings.
+
+    Keys are kept in the order they were last let through, so
+    the oldest are at the front: that's where we expire keys
+    older than window seconds, and where we evict keys once we
+    hold more than capacity of them.
+    """
+
+    def __init__(self, window=60.0, capacity=65536):
+        """Initialize an empty cache."""
+        assert window > 0
+        assert capacity > 0
+        self.__window = window
+        self.__capacity = capacity
+        self.__lock = T.Lock()
+        self.__seen = C.OrderedDict()
+        # counters, read them through stats()
+        self.__hits = 0
+        self.__misses = 0
+        self.__expired = 0
+        self.__evictions = 0
+
+    def __len__(self):
+        return len(self.__seen)
+
+    def fresh(self, key, now=None):
+        """
+        True if key was let through less than window seconds ago;
+        otherwise remember it as let through now and return False.
+        """
+        if now is None:
+            now = TIME.time()
+        with self.__lock:
+            when = self.__seen.get(key)
+            if when is not None and now-when < self.__window:
+                self.__hits += 1
+                return True
+            self.__misses += 1
+            if when is not None:
+                del self.__seen[key]
+            self.__seen[key] = now
+            self.__trim(now)
+            return False
+
+    def stats(self):
+        """Snapshot of our counters as a dictionary."""
+        with self.__lock:
+            return {
+                'size': len(self.__seen),
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'expired': self.__expired,
+                'evictions': self.__evictions,
+            }
+
+    def __trim(self, now):
+        """Drop expired keys and keys over capacity, call with lock held."""
+        seen = self.__seen
+        while seen:
+            key, when = next(seen.iteritems())
+            if now-when >= self.__window:
+                self.__expired += 1
+            elif len(seen) > self.__capacity:
+                self.__evictions += 1
+            else:
+                break
+            del seen[key]
+
+class CachingRecorder(object):
+    """
+    Recorder stand-in that skips sightings a SightingCache
+    considers fresh and passes the others on to a recorder.
+    """
+
+    def __init__(self, recorder, cache):
+        """Initialize a new recorder in front of recorder."""
+        self.__recorder = recorder
+        self.__cache = cache
+
+    def record(self, name, ip, guid, server, port):
+        """Pass a player sighting on unless we've seen it recently."""
+        if not self.__cache.fresh((name, ip, guid, server, port)):
+            self.__recorder.record(name, ip, guid, server, port)
+
+    def close(self):
+        """Close the recorder we're in front of."""
+        self.__recorder.close()
+
+    def stats(self):
+        """
+        Snapshot of the recorder's counters plus our cache's,
+        prefixed with "cache_", as a dictionary.
+        """
+        stats = self.__recorder.stats()
+        for key, value in self.__cache.stats().iteritems():
+            stats['cache_'+key] = value
+        return stats
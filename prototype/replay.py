@@ -0,0 +1,337 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Incremental replay of failover packets to hubs.
+
+The failover hub keeps every packet from our game servers until
+a hub acknowledges it, and replays what's still there to the
+hubs. We used to reload and resend the whole table each time,
+which gets more expensive the longer a hub is down, exactly
+when the failover hub should be cheap to run.
+
+The replayer instead remembers, for each hub, the highest rowid
+it has sent so far (the watermark) and reads only rows beyond
+that, one bounded page at a time, and only while fewer than a
+window of rows are in flight to that hub. Rows below the watermark have
+been sent already; each of them is resent on its own schedule,
+waiting twice as long after each attempt, until the hub acks it
+and the row disappears from the store.
+
+Rows come from a store with two methods:
+
+    after(rowid, limit) -> up to limit rows with larger rowids
+    rows(rowids) -> the rows for those rowids that still exist
+    count() -> number of rows in the store
+
+where each row is a (rowid, server, port, packet, time) tuple.
+A store must never hand out a rowid twice, not even after the
+newest rows are gone, or new rows hide below a watermark.
+
+Replay must not wait for the hub to be idle, otherwise a busy
+failover hub never gets rid of its backlog. The ReplayScheduler
+ticks the replayer from its own thread, and the replayer keeps
+to a budget of packets per second for each hub (a token bucket
+holding at most one second worth of packets) so that catching up
+doesn't flood a hub that just came back.
+"""
+
+import logging as L
+import threading as T
+import time as TIME
+
+class Replayer(object):
+    """Replay state for all hubs, used from one thread only."""
+
+    def __init__(self, hubs, send, page=64, backoff=5.0, backoff_max=300.0,
+                 rate=0, window=1024):
+        """
+        Initialize replay for hubs, a list of hub targets that
+        send(hub, row) knows how to deliver to.
+
+        At most page rows per hub are sent per tick(), resends
+        first, then new rows; a row is resent backoff seconds after
+        it was first sent, then twice as long after each attempt,
+        but at most backoff_max seconds later. If rate is not 0
+        we send at most rate packets per second to each hub. At
+        most window rows per hub are in flight (sent but not
+        acked); a hub that's down doesn't get more until acks
+        come in, so our memory doesn't grow with the backlog.
+        """
+        assert callable(send)
+        assert page > 0
+        assert 0 < backoff <= backoff_max
+        assert rate >= 0
+        assert window >= page
+        self.__hubs = hubs
+        self.__send = send
+        self.__page = page
+        self.__backoff = backoff
+        self.__backoff_max = backoff_max
+        self.__rate = rate
+        self.__window = window
+        # one watermark, one {rowid: [due, delay]} map, and
+        # one token bucket per hub
+        self.__watermark = [0]*len(hubs)
+        self.__waiting = [{} for _ in hubs]
+        self.__tokens = [float(rate)]*len(hubs)
+        self.__purged = [None]*len(hubs)
+        self.__ticked = None
+        # counters, read them through stats()
+        self.__sent = 0
+        self.__resent = 0
+        self.__acked = 0
+
+    def tick(self, store, now=None):
+        """Send new rows and resend rows that are due, page-wise."""
+        if now is None:
+            now = TIME.time()
+        elapsed = now-self.__ticked if self.__ticked is not None else 0
+        self.__ticked = now
+        for index, hub in enumerate(self.__hubs):
+            budget = self.__page
+            if self.__rate:
+                tokens = min(self.__tokens[index]+elapsed*self.__rate,
+                             self.__rate)
+                budget = min(budget, int(tokens))
+            sent = self.__retry(store, index, hub, now, budget)
+            sent += self.__advance(store, index, hub, now, budget-sent)
+            if self.__rate:
+                self.__tokens[index] = tokens-sent
+
+    def stats(self):
+        """Snapshot of our counters as a dictionary."""
+        return {
+            'waiting': sum(len(waiting) for waiting in self.__waiting),
+            'sent': self.__sent,
+            'resent': self.__resent,
+            'acked': self.__acked,
+        }
+
+    def __advance(self, store, index, hub, now, limit):
+        """
+        Send up to limit rows beyond the watermark, as long as
+        the window has room; return how many we sent.
+        """
+        waiting = self.__waiting[index]
+        if len(waiting) >= self.__window and limit > 0:
+            self.__purge(store, index, now)
+        limit = min(limit, self.__window-len(waiting))
+        if limit <= 0:
+            return 0
+        rows = store.after(self.__watermark[index], limit)
+        for row in rows:
+            self.__send(hub, row)
+            waiting[row[0]] = [now+self.__backoff, self.__backoff]
+            self.__sent += 1
+        if rows:
+            self.__watermark[index] = rows[-1][0]
+            L.debug("replayed %s new row(s) to %s, watermark %s",
+                    len(rows), hub, self.__watermark[index])
+        return len(rows)
+
+    def __purge(self, store, index, now):
+        """
+        Forget rows in flight that some hub acked, so a full window
+        doesn't have to wait for their resends; at most once a
+        second.
+        """
+        purged = self.__purged[index]
+        if purged is not None and now-purged < 1.0:
+            return
+        self.__purged[index] = now
+        waiting = self.__waiting[index]
+        rowids = sorted(waiting)
+        found = set()
+        for start in range(0, len(rowids), self.__page):
+            found.update(row[0] for row in
+                         store.rows(rowids[start:start+self.__page]))
+        for rowid in rowids:
+            if rowid not in found:
+                del waiting[rowid]
+                self.__acked += 1
+
+    def __retry(self, store, index, hub, now, limit):
+        """
+        Resend up to limit rows whose backoff ran out, return
+        how many we sent.
+        """
+        waiting = self.__waiting[index]
+        due = sorted(rowid for rowid, (when, _) in waiting.iteritems()
+                     if when <= now)[:max(limit, 0)]
+        if not due:
+            return 0
+        rows = store.rows(due)
+        found = set(row[0] for row in rows)
+        for rowid in due:
+            if rowid not in found:
+                # gone from the store, so some hub acked it
+                del waiting[rowid]
+                self.__acked += 1
+        for row in rows:
+            self.__send(hub, row)
+            entry = waiting[row[0]]
+            entry[1] = min(entry[1]*2, self.__backoff_max)
+            entry[0] = now+entry[1]
+            self.__resent += 1
+        if rows:
+            L.debug("resent %s row(s) to %s", len(rows), hub)
+        return len(rows)
+
+class ReplayScheduler(object):
+    """Ticks a Replayer from a thread of its own."""
+
+    def __init__(self, replayer, open_store, interval=0.1, report=60):
+        """
+        Initialize and start a new scheduler.
+
+        The open_store callable is used by the background thread
+        to get its store. The replayer is ticked every interval
+        seconds; backlog and drain rate are logged every report
+        seconds.
+        """
+        assert callable(open_store)
+        assert interval > 0
+        assert report > 0
+        self.__replayer = replayer
+        self.__open_store = open_store
+        self.__interval = interval
+        self.__report = report
+        self.__stop = T.Event()
+        self.__lock = T.Lock()
+        # read these through stats()
+        self.__backlog = 0
+        self.__drain_rate = 0.0
+        self.__failures = 0
+        self.__thread = T.Thread(target=self.__run, name="ReplayScheduler")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def close(self):
+        """Stop replaying."""
+        self.__stop.set()
+        self.__thread.join()
+
+    def stats(self):
+        """
+        Snapshot of the replayer's counters plus the backlog (rows
+        in the store), drain rate (rows per second the backlog
+        shrank by since the last report), and failed ticks as a
+        dictionary.
+        """
+        with self.__lock:
+            stats = self.__replayer.stats()
+            stats['backlog'] = self.__backlog
+            stats['drain_rate'] = self.__drain_rate
+            stats['failures'] = self.__failures
+            return stats
+
+    def __measure(self, store, last, now):
+        """Update backlog and drain rate, return the new backlog."""
+        backlog = store.count()
+        with self.__lock:
+            self.__backlog = backlog
+            if last is not None:
+                self.__drain_rate = (last[0]-backlog) / (now-last[1])
+        return backlog
+
+    def __run(self):
+        """
+        Background thread main loop; a tick that fails (say the
+        database is locked) is counted and we try again next
+        interval, only close() stops us. We log the first failure
+        in a row in full, the others only for debugging.
+        """
+        store = self.__open_store()
+        try:
+            last = None
+            failing = False
+            while not self.__stop.wait(self.__interval):
+                now = TIME.time()
+                try:
+                    with self.__lock:
+                        self.__replayer.tick(store, now)
+                    if last is None or now-last[1] >= self.__report:
+                        last = (self.__measure(store, last, now), now)
+                        L.info("replay stats %s", self.stats())
+                except Exception as exc:
+                    with self.__lock:
+                        self.__failures += 1
+                    if failing:
+                        L.debug("replay tick failed again with %s", exc)
+                    else:
+                        L.exception("replay tick failed with %s", exc)
+                    failing = True
+                else:
+                    failing = False
+        finally:
+            store.close()
+            L.debug("replay scheduler stopped")
+
+def test():
+    """
+    Simple test case: rows appended after every row was acked
+    must still be replayed, in a new database and in one that
+    was upgraded from rowids that get reused; rows in flight
+    must stay within the window.
+    """
+    import sqlite3 as SQL
+    import failover as FAILOVER
+
+    def replay(conn):
+        """Replay three rows, ack them all, append one more."""
+        store = FAILOVER.DatabaseStore(conn)
+        sent = []
+        replayer = Replayer(['hub'], lambda hub, row: sent.append(row[0]))
+        for number in range(3):
+            store.append('127.0.0.1', 27960, 'packet %s' % number)
+        replayer.tick(store, 0)
+        store.delete([(sent[0], sent[-1])])
+        store.append('127.0.0.1', 27960, 'packet 3')
+        replayer.tick(store, 1)
+        L.info("replayed rowids %s", sent)
+        assert len(sent) == 4 and sent == sorted(set(sent)), sent
+
+    conn = SQL.connect(':memory:')
+    FAILOVER.create_tables(conn)
+    replay(conn)
+    conn.close()
+
+    conn = SQL.connect(':memory:')
+    conn.executescript("""CREATE TABLE failover (server VARCHAR NOT NULL,
+                                                 port VARCHAR NOT NULL,
+                                                 packet VARCHAR NOT NULL,
+                                                 time TIMESTAMP DEFAULT NULL);
+                       INSERT INTO failover VALUES ('a', 1, 'x',
+                                                   '2011-01-01 00:00:00');
+                       INSERT INTO failover VALUES ('b', 2, 'y',
+                                                   '2012-01-01 00:00:00');""")
+    FAILOVER.create_tables(conn)
+    assert not FAILOVER.is_old_failover(conn)
+    rows = conn.execute("SELECT rowid, server, time FROM failover").fetchall()
+    assert rows == [(1, 'a', '2011-01-01 00:00:00'),
+                    (2, 'b', '2012-01-01 00:00:00')], rows
+    conn.execute("DELETE FROM failover")
+    replay(conn)
+
+    # a hub that never acks gets no more than a window of rows,
+    # once it acks them it gets more right away
+    store = FAILOVER.DatabaseStore(conn)
+    for number in range(100):
+        store.append('127.0.0.1', 27960, 'packet %s' % number)
+    sent = []
+    replayer = Replayer(['hub'], lambda hub, row: sent.append(row[0]),
+                        page=8, backoff=300.0, window=32)
+    for now in range(20):
+        replayer.tick(store, now)
+    assert replayer.stats()['waiting'] == 32, replayer.stats()
+    store.delete([(sent[0], sent[-1])])
+    replayer.tick(store, 20)
+    assert replayer.stats()['waiting'] == 8, replayer.stats()
+    conn.close()
+    L.info("replay test passed")
+
+if __name__ == "__main__":
+    L.basicConfig(level=L.DEBUG,
+                  format="%(asctime)s - %(levelname)s - %(message)s")
+    test()
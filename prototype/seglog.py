@@ -0,0 +1,273 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Append-only segmented packet log for the failover hub.
+
+The failover hub only keeps packets around until a hub has
+acknowledged them, it never looks inside. Storing them in SQLite
+cost an INSERT, a trigger UPDATE, and a commit per packet. The
+packet log appends them to segment files instead, sequentially:
+
+    <dir>/<first rowid, 16 hex digits>.seg
+
+Each record is a header (body length, CRC32, rowid, time) and a
+body (server, port, and packet separated by NUL bytes). Once a
+segment holds segment_size bytes we start a new one. Reads for
+replay go through an mmap of the segment. A segment is deleted
+once every record in it has been acknowledged.
+
+Acknowledgements are only kept in memory: after a restart the
+records of segments we didn't delete yet are replayed again,
+which the hubs shrug off. On startup we scan all segments; a
+record that's cut short or fails its CRC (we died while writing
+it) ends its segment, and the rest of the file is truncated.
+
+A SegmentLog implements the store interface of replay.py and
+acks.py and is shared by all threads: open() hands out another
+reference to it, close() drops one, and the last close() closes
+the files.
+"""
+
+import bisect as BI
+import datetime as DT
+import logging as L
+import mmap as MM
+import os as OS
+import struct as ST
+import threading as T
+import time as TIME
+import zlib as Z
+
+HEADER = ST.Struct('<IIQd')
+SUFFIX = '.seg'
+
+def encode(rowid, when, server, port, packet):
+    """Record for a packet as a string."""
+    body = '%s\0%s\0%s' % (server, port, packet)
+    crc = Z.crc32(ST.pack('<Qd', rowid, when)+body) & 0xffffffff
+    return HEADER.pack(len(body), crc, rowid, when)+body
+
+def decode(data, offset):
+    """
+    Record at offset in data as (rowid, when, body, next offset),
+    or None if there's no complete and intact record there.
+    """
+    if offset+HEADER.size > len(data):
+        return None
+    length, crc, rowid, when = HEADER.unpack_from(data, offset)
+    start = offset+HEADER.size
+    if start+length > len(data):
+        return None
+    body = data[start:start+length]
+    if Z.crc32(ST.pack('<Qd', rowid, when)+body) & 0xffffffff != crc:
+        return None
+    return rowid, when, body, start+length
+
+class Segment(object):
+    """One segment file and the index of its records."""
+
+    def __init__(self, path, first):
+        """Open (and create if needed) the segment file at path."""
+        self.path = path
+        self.first = first
+        self.file = open(path, 'a+b')
+        self.size = OS.fstat(self.file.fileno()).st_size
+        self.rowids = []
+        self.offsets = []
+        self.live = set()
+        self.__mm = None
+
+    def recover(self):
+        """
+        Index all intact records, truncate whatever follows them;
+        return the last rowid we found (or None).
+        """
+        data = self.view()
+        offset = 0
+        while True:
+            record = decode(data, offset)
+            if record is None or (self.rowids and
+                                  record[0] <= self.rowids[-1]):
+                break
+            self.rowids.append(record[0])
+            self.offsets.append(offset)
+            self.live.add(record[0])
+            offset = record[3]
+        if offset < self.size:
+            L.warning("truncating %s at %s of %s bytes",
+                      self.path, offset, self.size)
+            self.unmap()
+            self.file.truncate(offset)
+            self.size = offset
+        return self.rowids[-1] if self.rowids else None
+
+    def append(self, rowid, record):
+        """Append an encoded record."""
+        self.file.write(record)
+        self.file.flush()
+        self.rowids.append(rowid)
+        self.offsets.append(self.size)
+        self.live.add(rowid)
+        self.size += len(record)
+
+    def view(self):
+        """Map the segment, remapping if it grew; '' if it's empty."""
+        if self.size == 0:
+            return ''
+        if self.__mm is None or len(self.__mm) < self.size:
+            self.unmap()
+            self.__mm = MM.mmap(self.file.fileno(), self.size,
+                                access=MM.ACCESS_READ)
+        return self.__mm
+
+    def read(self, index):
+        """Row for the record at index."""
+        rowid, when, body, _ = decode(self.view(), self.offsets[index])
+        server, port, packet = body.split('\0', 2)
+        return rowid, server, port, packet, DT.datetime.utcfromtimestamp(
+            int(when))
+
+    def unmap(self):
+        """Drop our mapping, if any."""
+        if self.__mm is not None:
+            self.__mm.close()
+            self.__mm = None
+
+    def close(self):
+        """Close the segment file."""
+        self.unmap()
+        self.file.close()
+
+class SegmentLog(object):
+    """Failover entries in segment files, as a replay store."""
+
+    def __init__(self, directory, segment_size=4*1024*1024):
+        """
+        Open the log in directory (created if needed), recovering
+        whatever segments are in it.
+        """
+        assert segment_size > HEADER.size
+        self.__directory = directory
+        self.__segment_size = segment_size
+        self.__lock = T.Lock()
+        self.__references = 1
+        if not OS.path.isdir(directory):
+            OS.makedirs(directory)
+        self.__segments = []
+        last = 0
+        for name in sorted(OS.listdir(directory)):
+            if not name.endswith(SUFFIX):
+                continue
+            segment = Segment(OS.path.join(directory, name),
+                              int(name[:-len(SUFFIX)], 16))
+            found = segment.recover()
+            if found is None:
+                segment.close()
+                OS.remove(segment.path)
+                continue
+            self.__segments.append(segment)
+            last = max(last, found)
+        self.__next = last+1
+        L.debug("opened segment log '%s' with %s segment(s), next rowid %s",
+                directory, len(self.__segments), self.__next)
+
+    def open(self):
+        """Another reference to this log."""
+        with self.__lock:
+            assert self.__references > 0
+            self.__references += 1
+            return self
+
+    def close(self):
+        """Drop a reference, close the log with the last one."""
+        with self.__lock:
+            self.__references -= 1
+            if self.__references > 0:
+                return
+            for segment in self.__segments:
+                segment.close()
+            self.__segments = []
+        L.debug("closed segment log '%s'", self.__directory)
+
+    def append(self, server, port, packet):
+        """Append a packet from game server server:port."""
+        with self.__lock:
+            rowid = self.__next
+            self.__next += 1
+            record = encode(rowid, TIME.time(), server, port, packet)
+            active = self.__segments[-1] if self.__segments else None
+            if active is None or (active.rowids and active.size+len(record) >
+                                  self.__segment_size):
+                active = self.__start(rowid)
+            active.append(rowid, record)
+
+    def after(self, rowid, limit):
+        """Up to limit unacknowledged rows with rowids beyond rowid."""
+        rows = []
+        with self.__lock:
+            for segment in self.__segments[self.__find(rowid+1):]:
+                index = BI.bisect_right(segment.rowids, rowid)
+                while index < len(segment.rowids) and len(rows) < limit:
+                    if segment.rowids[index] in segment.live:
+                        rows.append(segment.read(index))
+                    index += 1
+                if len(rows) >= limit:
+                    break
+        return rows
+
+    def rows(self, rowids):
+        """The rows for those rowids that are still unacknowledged."""
+        rows = []
+        with self.__lock:
+            for rowid in sorted(rowids):
+                position = self.__find(rowid)
+                if position >= len(self.__segments):
+                    continue
+                segment = self.__segments[position]
+                if rowid in segment.live:
+                    rows.append(segment.read(
+                        BI.bisect_left(segment.rowids, rowid)))
+        return rows
+
+    def count(self):
+        """Number of unacknowledged rows."""
+        with self.__lock:
+            return sum(len(segment.live) for segment in self.__segments)
+
+    def delete(self, ranges):
+        """
+        Acknowledge rows in (first, last) rowid ranges; delete
+        segments that have nothing left but the one we append to.
+        """
+        with self.__lock:
+            for first, last in ranges:
+                for segment in self.__segments[self.__find(first):]:
+                    if segment.first > last:
+                        break
+                    start = BI.bisect_left(segment.rowids, first)
+                    end = BI.bisect_right(segment.rowids, last)
+                    segment.live.difference_update(segment.rowids[start:end])
+            for segment in self.__segments[:-1]:
+                if not segment.live:
+                    self.__reclaim(segment)
+
+    def __find(self, rowid):
+        """Position of the segment that would hold rowid."""
+        firsts = [segment.first for segment in self.__segments]
+        return max(BI.bisect_right(firsts, rowid)-1, 0)
+
+    def __start(self, rowid):
+        """Start a new segment with rowid, call with lock held."""
+        name = '%016x%s' % (rowid, SUFFIX)
+        segment = Segment(OS.path.join(self.__directory, name), rowid)
+        self.__segments.append(segment)
+        L.debug("started segment %s", segment.path)
+        return segment
+
+    def __reclaim(self, segment):
+        """Delete a fully acknowledged segment, call with lock held."""
+        self.__segments.remove(segment)
+        segment.close()
+        OS.remove(segment.path)
+        L.debug("reclaimed segment %s", segment.path)
@@ -0,0 +1,56 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Packet signatures.
+
+Every packet we exchange with game servers and hubs carries
+the MD4 digest of a shared secret, a newline, and the payload.
+Checking that digest is the first thing every packet hits, so
+we prepare one Verifier per peer when we load the config: it
+holds an MD4 state that has already seen the secret, and each
+packet only costs a copy() of that state plus the payload.
+"""
+
+import hashlib as HASH
+
+try:
+    from hmac import compare_digest
+except ImportError:
+    def compare_digest(a, b):
+        """Compare strings in time independent of where they differ."""
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+class Verifier(object):
+    """Signs and checks packets for one peer."""
+
+    def __init__(self, secret):
+        """Prepare MD4 state for secret."""
+        self.__seed = HASH.new('md4', secret+'\n')
+
+    def digest(self, payload):
+        """Hex digest for payload."""
+        md4 = self.__seed.copy()
+        md4.update(payload)
+        return md4.hexdigest()
+
+    def check(self, digest, payload):
+        """True if digest is correct for payload."""
+        return compare_digest(digest, self.digest(payload))
+
+    def sign(self, payload):
+        """Payload prefixed with its digest and a newline."""
+        return self.digest(payload)+'\n'+payload
+
+def make_verifiers(section):
+    """
+    Map each host in a resolved config section to a Verifier
+    for its secret.
+    """
+    return dict((host, Verifier(secret))
+                for host, (_port, secret) in section.iteritems())
@@ -0,0 +1,180 @@
+# |ALPHA| Hub - an authorization server for alpha-ioq3
+# See files README and COPYING for copyright and licensing details.
+
+"""
+Base class for write-behind stages.
+
+Some writes are frequent, cheap to lose, and not worth making
+the caller wait for: player sightings, acknowledged failover
+entries, gossip for other hubs. We collect them in memory and
+let a background thread write them in batches. This module has
+the part all of them share: the lock, the pending items, the
+thread that waits until enough items are pending or the oldest
+waited long enough, writes them without holding the lock, and
+counts how that went. Subclasses only say how to collect items
+and how to write them.
+
+Whatever is still pending is lost if the process dies, so use
+this only for writes we can afford to lose or repeat.
+
+The hub proper has the same class in ../hub/writebehind.py; the
+prototype keeps its own so it runs without the hub next to it.
+"""
+
+import abc as ABC
+import logging as L
+import threading as T
+import time as TIME
+
+class WriteBehind(object):
+    """
+    Base class for write-behind stages.
+
+    Subclasses collect items like this, lock held:
+
+        with self._cond:
+            pending = self._pending()
+            ... add to pending ...
+            self._added()
+
+    and must override _write(resource, pending) to write a batch,
+    we refuse to create them otherwise; raising an exception
+    counts as a failure, the batch is lost.
+    They may also override _empty() for another kind of
+    container than a list, _size() for what counts towards
+    flush_size, _open() and _close() for a resource the thread
+    keeps while it runs, and _counters() for more stats().
+
+    Subclasses must set up their own state before calling our
+    __init__(), the thread starts right away.
+    """
+    __metaclass__ = ABC.ABCMeta
+
+    def __init__(self, flush_size=None, flush_time=1.0, name=None):
+        """
+        Initialize and start a new stage. Pending items are
+        written as soon as flush_size of them are waiting (never
+        if None), but no later than flush_time seconds after the
+        first of them arrived.
+        """
+        assert flush_size is None or flush_size > 0
+        assert flush_time > 0
+        self.__flush_size = flush_size
+        self.__flush_time = flush_time
+        self._cond = T.Condition()
+        self.__pending = self._empty()
+        self.__since = None
+        self.__closed = False
+        # counters, read them through stats()
+        self.__flushes = 0
+        self.__written = 0
+        self.__failures = 0
+        self.__thread = T.Thread(
+            target=self.__run, name=name or self.__class__.__name__)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def close(self):
+        """Write whatever is still pending and stop."""
+        with self._cond:
+            self.__closed = True
+            self._cond.notify()
+        self.__thread.join()
+
+    def stats(self):
+        """Snapshot of our counters as a dictionary."""
+        with self._cond:
+            stats = {
+                'depth': len(self.__pending),
+                'flushes': self.__flushes,
+                'written': self.__written,
+                'failures': self.__failures,
+            }
+            stats.update(self._counters())
+            return stats
+
+    def _pending(self):
+        """Pending items to add to, call with lock held."""
+        assert not self.__closed
+        return self.__pending
+
+    def _added(self):
+        """Call after adding to _pending(), lock still held."""
+        if self.__since is None:
+            self.__since = TIME.time()
+            self._cond.notify()
+        elif self.__full():
+            self._cond.notify()
+
+    def _empty(self):
+        """New empty container for pending items."""
+        return []
+
+    def _size(self, pending):
+        """How far pending counts towards flush_size."""
+        return len(pending)
+
+    def _open(self):
+        """Resource for _write(), called by the thread once."""
+        return None
+
+    @ABC.abstractmethod
+    def _write(self, resource, pending):
+        """Write pending items; called without the lock held."""
+
+    def _close(self, resource):
+        """Release what _open() returned, once the thread stops."""
+        pass
+
+    def _counters(self):
+        """More counters for stats(), called with lock held."""
+        return {}
+
+    def __full(self):
+        """True if enough items are pending, call with lock held."""
+        return (self.__flush_size is not None and
+                self._size(self.__pending) >= self.__flush_size)
+
+    def __take(self):
+        """Wait until it's time to write, then grab pending items."""
+        with self._cond:
+            while not self.__closed:
+                if self.__full():
+                    break
+                if self.__since is None:
+                    self._cond.wait()
+                    continue
+                left = self.__since + self.__flush_time - TIME.time()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            pending, self.__pending = self.__pending, self._empty()
+            self.__since = None
+            return pending, self.__closed
+
+    def __run(self):
+        """Background thread main loop."""
+        resource = self._open()
+        try:
+            closed = False
+            while not closed:
+                pending, closed = self.__take()
+                if pending:
+                    self.__write(resource, pending)
+        finally:
+            self._close(resource)
+            L.debug("%s stopped", self.__thread.name)
+
+    def __write(self, resource, pending):
+        """Write pending items in one go, count how that went."""
+        try:
+            self._write(resource, pending)
+        except Exception as exc:
+            L.exception("%s failed to write %s item(s): %s",
+                              self.__thread.name, len(pending), exc)
+            with self._cond:
+                self.__failures += 1
+            return
+        with self._cond:
+            self.__flushes += 1
+            self.__written += len(pending)